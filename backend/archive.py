@@ -0,0 +1,358 @@
+"""Cold-session archive in Parquet files.
+
+Completed sessions stay in the ``sessions`` collection, and in every scan
+of it, forever. The archiver moves those last written more than
+``min_age`` ago into zstd-compressed Parquet files, partitioned by the
+month of ``start_date_time`` and the CPO party:
+
+    <root>/month=2024-03/party=NL-ABC/<batch>.parquet
+
+Only sessions the CDR pipeline is done with are archived: the cutoff is
+never later than its checkpoint, and sessions it left in ``cdr_failures``
+stay in Mongo until a price turns them into CDRs, so nothing is archived
+before its CDR exists. Each file keeps the fields archive queries filter on as typed
+columns, plus the OCPI session (its model ``fields``, charging periods
+included) as JSON in ``document``, so reads return it without re-encoding.
+Hub bookkeeping such as the owner and eMSP ids is only kept in columns.
+
+A batch is recorded in ``session_archive_batches`` before its files are
+written and marked written before its sessions are deleted. A batch found
+unfinished is rolled back (files removed) or completed (sessions deleted),
+so an archived session is never both in Mongo and in the archive for
+longer than a crash. Only one worker archives at a time, holding a lease
+like the CDR pipeline. Every worker reads ``root``, so it must be shared
+storage when the hub runs on several hosts.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from cdrs import CHECKPOINTS_COLLECTION, CHECKPOINT_ID, FAILURES_COLLECTION, naive_utc, parse_datetime
+from conditional import bump_version
+from serialization import ORJSON_OPTIONS
+from session_updates import PERIODS_COLLECTION, load_periods, session_key
+
+logger = logging.getLogger(__name__)
+
+LEASE_COLLECTION = "session_archive"
+LEASE_ID = "sessions"
+BATCHES_COLLECTION = "session_archive_batches"
+
+TIMESTAMP = pa.timestamp("ms", tz="UTC")
+SCHEMA = pa.schema([
+    ("country_code", pa.string()),
+    ("party_id", pa.string()),
+    ("id", pa.string()),
+    ("start_date_time", TIMESTAMP),
+    ("end_date_time", TIMESTAMP),
+    ("last_updated", TIMESTAMP),
+    ("location_id", pa.string()),
+    ("evse_uid", pa.string()),
+    ("kwh", pa.float64()),
+    ("location_owner_id", pa.string()),
+    ("emsp_id", pa.string()),
+    ("document", pa.string()),
+])
+# Called with the keys of the sessions removed from Mongo
+ArchiveCallback = Callable[[List[str]], Awaitable[None]]
+
+
+def month(value: Optional[datetime]) -> str:
+    return value.strftime("%Y-%m") if value else "unknown"
+
+
+def party(country_code: str, party_id: str) -> str:
+    return f"{country_code}-{party_id}"
+
+
+def archive_row(session: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    document = {field: session[field] for field in fields if field in session}
+    return {
+        "country_code": session["country_code"],
+        "party_id": session["party_id"],
+        "id": session["id"],
+        "start_date_time": naive_utc(parse_datetime(session.get("start_date_time"))),
+        "end_date_time": naive_utc(parse_datetime(session.get("end_date_time"))),
+        "last_updated": naive_utc(parse_datetime(session.get("last_updated"))),
+        "location_id": session.get("location_id"),
+        "evse_uid": session.get("evse_uid"),
+        "kwh": session.get("kwh"),
+        "location_owner_id": session.get("location_owner_id"),
+        "emsp_id": session.get("emsp_id"),
+        "document": orjson.dumps(document, option=ORJSON_OPTIONS).decode(),
+    }
+
+
+class SessionArchive:
+    """Read side: prunes partition directories, then filters rows in the selected files."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _partitions(self, name: str, path: str, selected: Callable[[str], bool]) -> List[str]:
+        try:
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            return []
+        prefix = f"{name}="
+        return sorted(
+            entry.path for entry in entries
+            if entry.is_dir() and entry.name.startswith(prefix) and selected(entry.name[len(prefix):])
+        )
+
+    def files(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        parties: Optional[Iterable[str]] = None,
+    ) -> List[str]:
+        # Months compare as strings; sessions without a start date only match unbounded queries
+        first = month(naive_utc(date_from)) if date_from else None
+        last = month(naive_utc(date_to - timedelta(milliseconds=1))) if date_to else None
+        wanted = set(parties) if parties is not None else None
+        files = []
+        for month_path in self._partitions("month", self.root, lambda m: (
+            (m == "unknown" and first is None and last is None)
+            or (m != "unknown" and (first is None or m >= first) and (last is None or m <= last))
+        )):
+            for party_path in self._partitions("party", month_path, lambda p: wanted is None or p in wanted):
+                files.extend(sorted(
+                    entry.path for entry in os.scandir(party_path)
+                    if entry.is_file() and entry.name.endswith(".parquet")
+                ))
+        return files
+
+    def query(
+        self,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        parties: Optional[Iterable[str]] = None,
+        visible_to: Optional[Tuple[str, str]] = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> Tuple[int, List[str], int]:
+        """Archived sessions as JSON documents in start order, the total count and files scanned.
+
+        ``date_from`` (inclusive) and ``date_to`` (exclusive) apply to ``start_date_time``;
+        ``visible_to`` is a ``(field, organization id)`` pair, as for the sessions listing.
+        """
+        files = self.files(date_from, date_to, parties)
+        if not files:
+            return 0, [], 0
+        condition = None
+        for expression in (
+            ds.field("start_date_time") >= pa.scalar(naive_utc(date_from), TIMESTAMP) if date_from else None,
+            ds.field("start_date_time") < pa.scalar(naive_utc(date_to), TIMESTAMP) if date_to else None,
+            ds.field(visible_to[0]) == visible_to[1] if visible_to else None,
+        ):
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+        dataset = ds.dataset(files, schema=SCHEMA, format="parquet")
+        # Row groups whose statistics cannot match are skipped by the scanner
+        keys = dataset.to_table(columns=["start_date_time", "country_code", "party_id", "id"], filter=condition)
+        if keys.num_rows == 0:
+            return 0, [], len(files)
+        order = pc.sort_indices(
+            keys, sort_keys=[("start_date_time", "ascending"), ("country_code", "ascending"),
+                             ("party_id", "ascending"), ("id", "ascending")]
+        )
+        page = keys.take(order[offset:offset + limit]) if offset < keys.num_rows else keys.slice(0, 0)
+        if page.num_rows == 0:
+            return keys.num_rows, [], len(files)
+        ids = ds.field("id").isin(page.column("id").to_pylist())
+        rows = dataset.to_table(
+            columns=["country_code", "party_id", "id", "document"],
+            filter=ids if condition is None else condition & ids
+        ).to_pylist()
+        documents = {(r["country_code"], r["party_id"], r["id"]): r["document"] for r in rows}
+        return keys.num_rows, [
+            documents[key] for key in zip(*(page.column(c).to_pylist() for c in ("country_code", "party_id", "id")))
+        ], len(files)
+
+
+class SessionArchiver:
+    def __init__(
+        self,
+        db,
+        root: str,
+        fields: Iterable[str],
+        min_age: timedelta = timedelta(days=90),
+        batch_size: int = 5000,
+        interval: float = 3600.0,
+        lease: float = 300.0,
+        on_archive: Optional[ArchiveCallback] = None,
+    ):
+        self.db = db
+        self.archive = SessionArchive(root)
+        self.root = root
+        self.fields = tuple(fields)
+        self.min_age = min_age
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.on_archive = on_archive
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.archived = 0
+
+    async def acquire(self) -> Optional[Dict[str, Any]]:
+        """Take or renew the archiver lease; returns the lease document when held."""
+        now = datetime.now(timezone.utc)
+        try:
+            return await self.db[LEASE_COLLECTION].find_one_and_update(
+                {"_id": LEASE_ID, "$or": [{"owner": self.owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "lease_until": now + timedelta(seconds=self.lease)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease
+            return None
+
+    async def eligible(self) -> Optional[Dict[str, Any]]:
+        """Query for completed sessions old enough and already turned into CDRs."""
+        checkpoint = await self.db[CHECKPOINTS_COLLECTION].find_one(
+            {"_id": CHECKPOINT_ID}, {"hub_updated_at": 1, "session_oid": 1}
+        )
+        if not checkpoint or not checkpoint.get("hub_updated_at"):
+            # No CDR generated yet: archiving now could lose CDRs
+            return None
+        cutoff = naive_utc(datetime.now(timezone.utc) - self.min_age)
+        position = naive_utc(checkpoint["hub_updated_at"]), checkpoint["session_oid"]
+        # Passed by the checkpoint without a CDR; few, as long as prices arrive
+        without_cdr = await self.db[FAILURES_COLLECTION].distinct("session_oid")
+        query: Dict[str, Any] = {"status": "COMPLETED", "_id": {"$nin": without_cdr}}
+        if cutoff <= position[0]:
+            return {**query, "hub_updated_at": {"$lt": cutoff}}
+        # Up to and including the last session the CDR pipeline processed
+        return {**query, "$or": [
+            {"hub_updated_at": {"$lt": position[0]}},
+            {"hub_updated_at": position[0], "_id": {"$lte": position[1]}},
+        ]}
+
+    def _write_files(self, batch_id: str, sessions: List[Dict[str, Any]]) -> List[str]:
+        partitions: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for session in sessions:
+            row = archive_row(session, self.fields)
+            partitions.setdefault(
+                (month(row["start_date_time"]), party(row["country_code"], row["party_id"])), []
+            ).append(row)
+        files = []
+        for (month_name, party_name), rows in sorted(partitions.items()):
+            directory = os.path.join(self.root, f"month={month_name}", f"party={party_name}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{batch_id}.parquet")
+            rows.sort(key=lambda r: (r["start_date_time"] or datetime.min, r["id"]))
+            # Written aside and renamed, so readers never see half a file
+            pq.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), path + ".tmp", compression="zstd")
+            os.replace(path + ".tmp", path)
+            files.append(path)
+        return files
+
+    async def _finish(self, batch: Dict[str, Any]) -> None:
+        keys = batch["session_keys"]
+        await self.db.sessions.delete_many({"_id": {"$in": batch["session_oids"]}})
+        await self.db[PERIODS_COLLECTION].delete_many({"session_key": {"$in": keys}})
+        await self.db[BATCHES_COLLECTION].update_one(
+            {"_id": batch["_id"]},
+            {"$set": {"state": "done", "finished_at": datetime.now(timezone.utc), "sessions": len(keys)},
+             "$unset": {"session_keys": "", "session_oids": ""}}
+        )
+        await self.db[LEASE_COLLECTION].update_one({"_id": LEASE_ID}, {"$inc": {"archived": len(keys)}})
+        await bump_version(self.db, "sessions")
+        self.archived += len(keys)
+        if self.on_archive:
+            await self.on_archive(keys)
+
+    async def recover(self) -> None:
+        """Complete or roll back batches a previous run left unfinished."""
+        async for batch in self.db[BATCHES_COLLECTION].find({"state": {"$ne": "done"}}):
+            if batch["state"] == "written":
+                await self._finish(batch)
+                continue
+            for path in batch["files"]:
+                for name in (path, path + ".tmp"):
+                    if os.path.exists(name):
+                        os.remove(name)
+            await self.db[BATCHES_COLLECTION].delete_one({"_id": batch["_id"]})
+            logger.warning("Rolled back unfinished session archive batch %s", batch["_id"])
+
+    async def run_batch(self, query: Dict[str, Any]) -> int:
+        # Uses the CDR pipeline index; archived sessions leave the collection, so no position is kept
+        sessions = await self.db.sessions.find(query).sort([("hub_updated_at", 1), ("_id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+        if not sessions:
+            return 0
+        keys = [session_key(s["country_code"], s["party_id"], s["id"]) for s in sessions]
+        periods = await load_periods(self.db, keys)
+        for key, session in zip(keys, sessions):
+            if key in periods:
+                session["charging_periods"] = (session.get("charging_periods") or []) + periods[key]
+
+        batch_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        # File names are known up front, so a rollback can find them
+        planned = sorted({
+            os.path.join(
+                self.root, f"month={month(naive_utc(parse_datetime(s.get('start_date_time'))))}",
+                f"party={party(s['country_code'], s['party_id'])}", f"{batch_id}.parquet"
+            )
+            for s in sessions
+        })
+        batch = {
+            "_id": batch_id, "state": "writing", "files": planned, "session_keys": keys,
+            "session_oids": [s["_id"] for s in sessions], "created_at": datetime.now(timezone.utc),
+        }
+        await self.db[BATCHES_COLLECTION].insert_one(batch)
+        await asyncio.to_thread(self._write_files, batch_id, sessions)
+        await self.db[BATCHES_COLLECTION].update_one({"_id": batch_id}, {"$set": {"state": "written"}})
+        await self._finish(batch)
+        return len(sessions)
+
+    async def run_once(self) -> int:
+        """Archive every eligible session while holding the lease."""
+        if await self.acquire() is None:
+            return 0
+        await self.recover()
+        query = await self.eligible()
+        total = 0
+        while query is not None:
+            archived = await self.run_batch(query)
+            total += archived
+            if archived < self.batch_size or await self.acquire() is None:
+                break
+        return total
+
+    async def run(self) -> None:
+        while True:
+            try:
+                archived = await self.run_once()
+                if archived:
+                    logger.info("Archived %d sessions", archived)
+            except Exception:
+                logger.exception("Session archiving failed")
+            await asyncio.sleep(self.interval)
+
+    async def stats(self) -> Dict[str, Any]:
+        lease = await self.db[LEASE_COLLECTION].find_one({"_id": LEASE_ID}) or {}
+        unfinished = await self.db[BATCHES_COLLECTION].count_documents({"state": {"$ne": "done"}})
+        files = await asyncio.to_thread(self.archive.files)
+        return {
+            "archived_by_this_worker": self.archived,
+            "archived_total": lease.get("archived", 0),
+            "files": len(files),
+            "bytes": sum(os.path.getsize(f) for f in files),
+            "unfinished_batches": unfinished,
+            "lease_owner": lease.get("owner"),
+            "lease_held": lease.get("owner") == self.owner,
+        }
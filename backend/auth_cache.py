@@ -0,0 +1,141 @@
+"""In-process cache for API token -> Organization lookups.
+
+Every OCPI request authenticates through ``get_current_organization``; this
+cache keeps recently seen tokens in memory so that path does not hit Mongo on
+every call. Entries expire after ``ttl`` seconds and the least recently used
+entry is evicted once ``maxsize`` is reached.
+
+Tokens are never stored in clear text: keys are SHA-256 digests, and
+invalidation signals shared between workers only carry organization ids.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+INVALIDATIONS_COLLECTION = "auth_invalidations"
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires_at, organization_id, value)
+        self._entries: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        self._org_keys: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[Any]:
+        key = token_key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, token: str, organization_id: str, value: Any) -> None:
+        key = token_key(token)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, organization_id, value)
+        self._org_keys.setdefault(organization_id, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, token: str) -> None:
+        key = token_key(token)
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_organization(self, organization_id: str) -> None:
+        for key in list(self._org_keys.get(organization_id, ())):
+            self._remove(key)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._org_keys.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: str) -> None:
+        _, organization_id, _ = self._entries.pop(key)
+        keys = self._org_keys.get(organization_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._org_keys[organization_id]
+
+
+async def publish_invalidation(db, cache: TokenCache, organization_id: str) -> None:
+    """Drop an organization's tokens locally and tell the other workers."""
+    cache.invalidate_organization(organization_id)
+    await db[INVALIDATIONS_COLLECTION].insert_one({
+        "organization_id": organization_id,
+        "created_at": datetime.now(timezone.utc),
+    })
+
+
+async def watch_invalidations(
+    db,
+    cache: TokenCache,
+    interval: float = 2.0,
+    needed: Callable[[], bool] = lambda: True,
+) -> None:
+    """Poll the shared invalidation log and apply entries from other workers.
+
+    Signals older than the cache TTL are irrelevant (the entries they target
+    have expired anyway), so polling starts from "now"; old log entries are
+    cleaned up by the TTL index created in migrations. Polling pauses while
+    ``needed()`` is false, i.e. while the event bus reports organization
+    changes from every worker.
+    """
+    collection = db[INVALIDATIONS_COLLECTION]
+    last_seen = datetime.now(timezone.utc)
+    while True:
+        await asyncio.sleep(interval)
+        if not needed():
+            continue
+        try:
+            async for signal in collection.find({"created_at": {"$gt": last_seen}}).sort("created_at", 1):
+                cache.invalidate_organization(signal["organization_id"])
+                last_seen = signal["created_at"]
+        except Exception:
+            logger.exception("Failed to poll auth cache invalidations")
@@ -0,0 +1,242 @@
+"""Streaming NDJSON bulk import for OCPI catalogs.
+
+Input is read chunk by chunk (plain or gzip-compressed NDJSON), validated one
+record at a time and written through unordered ``bulk_write`` upserts in
+batches. At most one batch is buffered while the previous one is being
+written, so memory stays bounded regardless of the input size.
+
+Progress is reported as a stream of events (dicts):
+
+* ``{"type": "error", "line": n, "error": "..."}`` for every rejected record
+* ``{"type": "progress", "processed": n, "written": n, "failed": n}`` after each batch
+* ``{"type": "summary", ...}`` once the input is exhausted
+
+A spec's ``on_written`` hook is called with the documents of every batch
+that reached Mongo (minus rejected writes), e.g. to push them to partners.
+
+Command line usage (from the backend directory):
+
+    python bulk_ingest.py locations catalog.ndjson.gz --country-code TR --party-id EPS
+"""
+
+import asyncio
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple, Type
+
+import orjson
+from pydantic import BaseModel, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DEFAULT_BATCH_SIZE = 1000
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+@dataclass
+class IngestSpec:
+    collection: str
+    model: Type[BaseModel]
+    key_fields: Tuple[str, ...]
+    # Turns a validated model into the document to store for the given owner
+    prepare: Callable[[BaseModel, Any], Dict[str, Any]]
+    # Roles allowed to import this kind of object
+    roles: Tuple[str, ...]
+    # Called with the written documents of each batch and the owner
+    on_written: Optional[Callable[[List[Dict[str, Any]], Any], Awaitable[None]]] = None
+
+
+class IngestRejected(ValueError):
+    pass
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines, transparently gunzipping it."""
+    decompressor = None
+    buffer = b""
+    first = True
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if decompressor is not None:
+        buffer += decompressor.flush()
+    if buffer:
+        yield buffer
+
+
+def parse_record(spec: IngestSpec, line: bytes, owner) -> Tuple[UpdateOne, Dict[str, Any]]:
+    try:
+        record = spec.model.model_validate(orjson.loads(line))
+    except orjson.JSONDecodeError as e:
+        raise IngestRejected(f"Invalid JSON: {e}")
+    except ValidationError as e:
+        error = e.errors()[0]
+        raise IngestRejected(f"{'.'.join(str(p) for p in error['loc'])}: {error['msg']}")
+    document = spec.prepare(record, owner)
+    key = {field: document[field] for field in spec.key_fields}
+    return UpdateOne(
+        key,
+        {"$set": document, "$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    ), document
+
+
+async def write_batch(
+    spec: IngestSpec,
+    collection,
+    operations: List[UpdateOne],
+    documents: List[Dict[str, Any]],
+    line_numbers: List[int],
+    owner,
+) -> Tuple[int, List[Dict[str, Any]]]:
+    try:
+        await collection.bulk_write(operations, ordered=False)
+        errors = []
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        rejected = {error["index"] for error in errors}
+        documents = [document for index, document in enumerate(documents) if index not in rejected]
+    if spec.on_written is not None and documents:
+        await spec.on_written(documents, owner)
+    return len(documents), [
+        {"type": "error", "line": line_numbers[error["index"]], "error": error.get("errmsg", "Write failed")}
+        for error in errors
+    ]
+
+
+async def ingest(
+    db,
+    spec: IngestSpec,
+    chunks: AsyncIterator[bytes],
+    owner,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Import NDJSON records from ``chunks`` and yield progress events."""
+    collection = db[spec.collection]
+    started = time.perf_counter()
+    processed = written = failed = 0
+    operations: List[UpdateOne] = []
+    documents: List[Dict[str, Any]] = []
+    line_numbers: List[int] = []
+    pending: Optional[asyncio.Task] = None
+
+    async def collect(task: asyncio.Task):
+        nonlocal written, failed
+        ok, errors = await task
+        written += ok
+        failed += len(errors)
+        for error in errors:
+            yield error
+        yield {"type": "progress", "processed": processed, "written": written, "failed": failed}
+
+    line_number = 0
+    async for line in ndjson_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        processed += 1
+        try:
+            operation, document = parse_record(spec, line, owner)
+            operations.append(operation)
+            documents.append(document)
+            line_numbers.append(line_number)
+        except IngestRejected as e:
+            failed += 1
+            yield {"type": "error", "line": line_number, "error": str(e)}
+            continue
+
+        if len(operations) >= batch_size:
+            # Keep a single write in flight while the next batch is parsed
+            if pending is not None:
+                async for event in collect(pending):
+                    yield event
+            pending = asyncio.create_task(write_batch(spec, collection, operations, documents, line_numbers, owner))
+            operations, documents, line_numbers = [], [], []
+
+    if pending is not None:
+        async for event in collect(pending):
+            yield event
+    if operations:
+        last = write_batch(spec, collection, operations, documents, line_numbers, owner)
+        async for event in collect(asyncio.create_task(last)):
+            yield event
+
+    elapsed = time.perf_counter() - started
+    yield {
+        "type": "summary",
+        "processed": processed,
+        "written": written,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(processed / elapsed) if elapsed else processed,
+    }
+
+
+async def file_chunks(f: BinaryIO, chunk_size: int = 1 << 20) -> AsyncIterator[bytes]:
+    while chunk := f.read(chunk_size):
+        yield chunk
+
+
+async def spool_request(chunks: AsyncIterator[bytes], max_memory: int = 8 << 20) -> BinaryIO:
+    """Buffer an upload to a temporary file (in memory up to ``max_memory``).
+
+    Starlette's StreamingResponse listens for client disconnects on the same
+    receive channel as the request body, so the body has to be consumed before
+    progress events can be streamed back.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    async for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+if __name__ == "__main__":
+    import typer
+
+    def main(
+        kind: str = typer.Argument(..., help="Object kind, e.g. locations"),
+        path: Path = typer.Argument(..., exists=True, dir_okay=False, help="NDJSON or NDJSON.gz file"),
+        country_code: str = typer.Option(..., help="Owning party country code"),
+        party_id: str = typer.Option(..., help="Owning party id"),
+        batch_size: int = typer.Option(DEFAULT_BATCH_SIZE),
+        show_errors: bool = typer.Option(True, help="Print rejected records"),
+    ):
+        """Import an NDJSON catalog straight into MongoDB."""
+        import server
+
+        spec = server.INGEST_SPECS.get(kind)
+        if spec is None:
+            raise typer.BadParameter(f"Unknown kind, expected one of: {', '.join(server.INGEST_SPECS)}")
+
+        async def run():
+            org = await server.db.organizations.find_one(
+                {"country_code": country_code, "party_id": party_id}, {"_id": 0, "api_token": 0}
+            )
+            if not org:
+                raise typer.BadParameter("No organization registered for this country_code/party_id")
+            owner = server.Organization(**org)
+            with open(path, "rb") as f:
+                async for event in ingest(server.db, spec, file_chunks(f), owner, batch_size):
+                    if event["type"] == "error" and show_errors:
+                        typer.echo(f"line {event['line']}: {event['error']}", err=True)
+                    elif event["type"] == "progress":
+                        typer.echo(f"processed {event['processed']}  written {event['written']}  failed {event['failed']}")
+                    elif event["type"] == "summary":
+                        typer.echo(orjson.dumps(event).decode())
+
+        asyncio.run(run())
+
+    typer.run(main)
@@ -0,0 +1,317 @@
+"""CDR generation pipeline.
+
+Completed sessions are turned into OCPI CDRs in batches by a background task.
+Progress is kept in a checkpoint document holding the keyset position
+``(hub_updated_at, _id)`` of the last processed session, so the pipeline
+resumes where it stopped after a restart. CDR ids equal session ids and are
+written with upserts, so re-processing a batch is harmless.
+
+Only one worker runs the pipeline at a time: the checkpoint document doubles
+as a lease that the active worker renews after every batch.
+
+A session that cannot be turned into a CDR never holds the checkpoint back.
+Sessions that fail (e.g. malformed charging periods) or have no price,
+neither from the CPO nor from a tariff, are recorded in ``cdr_failures``
+instead. When such a session is written again, e.g. repriced, its
+``hub_updated_at`` moves and the pipeline retries it.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from conditional import bump_version
+from session_updates import load_periods, session_key
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS_COLLECTION = "cdr_checkpoints"
+CHECKPOINT_ID = "sessions"
+FAILURES_COLLECTION = "cdr_failures"
+
+# Prices sessions that carry no CPO-provided total_cost; returns total_cost per session key
+Pricer = Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, Dict[str, Any]]]]
+
+
+def parse_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def period_totals(session: Dict[str, Any]) -> Dict[str, float]:
+    """Energy (kWh), charging time and parking time (hours) from charging periods."""
+    periods = session.get("charging_periods") or []
+    end = naive_utc(parse_datetime(session.get("end_date_time")))
+    energy = time_hours = parking_hours = 0.0
+    for i, period in enumerate(periods):
+        start = naive_utc(parse_datetime(period.get("start_date_time")))
+        stop = naive_utc(parse_datetime(periods[i + 1].get("start_date_time"))) if i + 1 < len(periods) else end
+        for dimension in period.get("dimensions") or []:
+            if dimension.get("type") == "ENERGY":
+                energy += dimension.get("volume") or 0
+            elif dimension.get("type") == "PARKING_TIME":
+                parking_hours += dimension.get("volume") or 0
+        if start and stop and stop > start:
+            time_hours += (stop - start).total_seconds() / 3600
+    if not periods:
+        start = naive_utc(parse_datetime(session.get("start_date_time")))
+        if start and end and end > start:
+            time_hours = (end - start).total_seconds() / 3600
+    return {
+        # Sessions without ENERGY dimensions still report their meter reading
+        "total_energy": round(energy or session.get("kwh") or 0, 4),
+        "total_time": round(time_hours, 4),
+        "total_parking_time": round(parking_hours, 4),
+    }
+
+
+def cdr_location(location: Optional[Dict[str, Any]], session: Dict[str, Any]) -> Dict[str, Any]:
+    result = {
+        "id": session["location_id"],
+        "evse_uid": session["evse_uid"],
+        "connector_id": session["connector_id"],
+    }
+    if not location:
+        return result
+    result.update({
+        k: location.get(k)
+        for k in ("name", "address", "city", "postal_code", "state", "country", "coordinates")
+        if location.get(k) is not None
+    })
+    evse = next((e for e in location.get("evses") or [] if e.get("uid") == session["evse_uid"]), None)
+    if evse:
+        result["evse_id"] = evse.get("evse_id")
+        connector = next((c for c in evse.get("connectors") or [] if c.get("id") == session["connector_id"]), None)
+        if connector:
+            for k in ("standard", "format", "power_type"):
+                result[f"connector_{k}"] = connector.get(k)
+    return result
+
+
+def build_cdr(session: Dict[str, Any], location: Optional[Dict[str, Any]], total_cost: Dict[str, Any]) -> Dict[str, Any]:
+    cdr = {
+        "country_code": session["country_code"],
+        "party_id": session["party_id"],
+        "id": session["id"],
+        "session_id": session["id"],
+        "start_date_time": session["start_date_time"],
+        "end_date_time": session.get("end_date_time") or session.get("last_updated"),
+        "cdr_token": session["cdr_token"],
+        "auth_method": session["auth_method"],
+        "authorization_reference": session.get("authorization_reference"),
+        "cdr_location": cdr_location(location, session),
+        "meter_id": session.get("meter_id"),
+        "currency": session["currency"],
+        "charging_periods": session.get("charging_periods") or [],
+        "total_cost": total_cost,
+        "last_updated": datetime.now(timezone.utc),
+        # Hub-internal visibility fields, same as on sessions
+        "location_owner_id": session.get("location_owner_id"),
+        "emsp_id": session.get("emsp_id"),
+    }
+    cdr.update(period_totals(session))
+    return cdr
+
+
+class CdrPipeline:
+    def __init__(
+        self,
+        db,
+        batch_size: int = 1000,
+        interval: float = 10.0,
+        lag: float = 5.0,
+        lease: float = 60.0,
+        pricer: Optional[Pricer] = None,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        # Sessions written in the last `lag` seconds are left for the next run, so
+        # writes from workers with slightly skewed clocks are not skipped
+        self.lag = lag
+        self.lease = lease
+        self.pricer = pricer
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.generated = 0
+        self.failed = 0
+        self.unpriced = 0
+
+    async def acquire(self) -> Optional[Dict[str, Any]]:
+        """Take or renew the pipeline lease; returns the checkpoint when held."""
+        now = datetime.now(timezone.utc)
+        try:
+            return await self.db[CHECKPOINTS_COLLECTION].find_one_and_update(
+                {"_id": CHECKPOINT_ID, "$or": [{"owner": self.owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "lease_until": now + timedelta(seconds=self.lease)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease
+            return None
+
+    async def run_batch(self, checkpoint: Dict[str, Any]) -> int:
+        query: Dict[str, Any] = {
+            "status": "COMPLETED",
+            "hub_updated_at": {"$lt": datetime.now(timezone.utc) - timedelta(seconds=self.lag)},
+        }
+        if checkpoint.get("hub_updated_at"):
+            position = checkpoint["hub_updated_at"], checkpoint["session_oid"]
+            query["$or"] = [
+                {"hub_updated_at": {"$gt": position[0]}},
+                {"hub_updated_at": position[0], "_id": {"$gt": position[1]}},
+            ]
+        sessions = await self.db.sessions.find(query).sort(
+            [("hub_updated_at", 1), ("_id", 1)]
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not sessions:
+            return 0
+
+        keys = [session_key(s["country_code"], s["party_id"], s["id"]) for s in sessions]
+        periods = await load_periods(self.db, keys)
+        for key, session in zip(keys, sessions):
+            if key in periods:
+                session["charging_periods"] = (session.get("charging_periods") or []) + periods[key]
+
+        location_keys: List[Tuple[str, str, str]] = list({
+            (s["country_code"], s["party_id"], s["location_id"]) for s in sessions
+        })
+        locations = {
+            (loc["country_code"], loc["party_id"], loc["id"]): loc
+            async for loc in self.db.locations.find(
+                {"$or": [{"country_code": c, "party_id": p, "id": i} for c, p, i in location_keys]},
+                {"_id": 0, "country_code": 1, "party_id": 1, "id": 1, "name": 1, "address": 1, "city": 1,
+                 "postal_code": 1, "state": 1, "country": 1, "coordinates": 1, "evses": 1}
+            )
+        }
+
+        failures: Dict[str, Tuple[Dict[str, Any], str, str]] = {}
+        prices = await self.price(
+            [(k, s) for k, s in zip(keys, sessions) if not s.get("total_cost")], failures
+        ) if self.pricer else {}
+
+        operations, generated = [], []
+        for key, session in zip(keys, sessions):
+            if key in failures:
+                continue
+            total_cost = session.get("total_cost") or prices.get(key)
+            if not total_cost:
+                # A zero-cost CDR would bill the driver nothing; wait for a price instead
+                failures[key] = session, "unpriced", "No total_cost from the CPO and no tariff price"
+                continue
+            try:
+                location = locations.get((session["country_code"], session["party_id"], session["location_id"]))
+                cdr = build_cdr(session, location, total_cost)
+            except Exception as e:
+                failures[key] = session, "failed", repr(e)
+                continue
+            operations.append(UpdateOne(
+                {"country_code": cdr["country_code"], "party_id": cdr["party_id"], "id": cdr["id"]},
+                {"$set": cdr, "$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+                upsert=True
+            ))
+            generated.append(key)
+        if operations:
+            await self.db.cdrs.bulk_write(operations, ordered=False)
+            await bump_version(self.db, "cdrs")
+            # Sessions that failed before and went through now
+            await self.db[FAILURES_COLLECTION].delete_many({"_id": {"$in": generated}})
+        if failures:
+            await self.record_failures(failures)
+        failed = sum(1 for _, reason, _ in failures.values() if reason == "failed")
+
+        last = sessions[-1]
+        await self.db[CHECKPOINTS_COLLECTION].update_one(
+            {"_id": CHECKPOINT_ID, "owner": self.owner},
+            {"$set": {
+                "hub_updated_at": last["hub_updated_at"],
+                "session_oid": last["_id"],
+                "updated_at": datetime.now(timezone.utc),
+            }, "$inc": {"generated": len(generated), "failed": failed, "unpriced": len(failures) - failed}}
+        )
+        self.generated += len(generated)
+        self.failed += failed
+        self.unpriced += len(failures) - failed
+        return len(sessions)
+
+    async def price(
+        self, sessions: List[Tuple[str, Dict[str, Any]]], failures: Dict[str, Tuple[Dict[str, Any], str, str]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Prices for sessions without a CPO total_cost; sessions the pricer fails on go to ``failures``."""
+        if not sessions:
+            return {}
+        try:
+            return await self.pricer([s for _, s in sessions])
+        except Exception:
+            # One bad session must not leave the whole batch unpriced: find it
+            prices: Dict[str, Dict[str, Any]] = {}
+            for key, session in sessions:
+                try:
+                    prices.update(await self.pricer([session]))
+                except Exception as e:
+                    failures[key] = session, "failed", repr(e)
+            return prices
+
+    async def record_failures(self, failures: Dict[str, Tuple[Dict[str, Any], str, str]]) -> None:
+        now = datetime.now(timezone.utc)
+        await self.db[FAILURES_COLLECTION].bulk_write([
+            UpdateOne({"_id": key}, {"$set": {
+                "country_code": session["country_code"], "party_id": session["party_id"],
+                "session_id": session["id"], "session_oid": session["_id"],
+                "hub_updated_at": session.get("hub_updated_at"), "reason": reason, "error": error,
+                "recorded_at": now,
+            }}, upsert=True)
+            for key, (session, reason, error) in failures.items()
+        ], ordered=False)
+        logger.warning("%d sessions left without a CDR, see %s", len(failures), FAILURES_COLLECTION)
+
+    async def run_once(self) -> int:
+        """Process every pending session while holding the lease."""
+        total = 0
+        while True:
+            checkpoint = await self.acquire()
+            if checkpoint is None:
+                return total
+            processed = await self.run_batch(checkpoint)
+            total += processed
+            if processed < self.batch_size:
+                return total
+
+    async def run(self) -> None:
+        while True:
+            try:
+                processed = await self.run_once()
+                if processed:
+                    logger.info("Generated %d CDRs", processed)
+            except Exception:
+                logger.exception("CDR generation failed")
+            await asyncio.sleep(self.interval)
+
+    async def stats(self) -> Dict[str, Any]:
+        checkpoint = await self.db[CHECKPOINTS_COLLECTION].find_one({"_id": CHECKPOINT_ID}) or {}
+        return {
+            "generated_by_this_worker": self.generated,
+            "generated_total": checkpoint.get("generated", 0),
+            "failed_by_this_worker": self.failed,
+            "unpriced_by_this_worker": self.unpriced,
+            "failed_total": checkpoint.get("failed", 0),
+            "unpriced_total": checkpoint.get("unpriced", 0),
+            "sessions_without_cdr": await self.db[FAILURES_COLLECTION].count_documents({}),
+            "checkpoint": checkpoint.get("hub_updated_at"),
+            "lease_owner": checkpoint.get("owner"),
+            "lease_held": checkpoint.get("owner") == self.owner,
+        }
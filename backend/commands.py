@@ -0,0 +1,410 @@
+"""OCPI Commands (START_SESSION, STOP_SESSION, RESERVE_NOW) through the hub.
+
+An eMSP sends ``POST /commands/{command}`` with ``OCPI-to-*`` headers naming
+the CPO. The hub stores the command, answers ``ACCEPTED`` straight away and
+forwards it to the CPO in the background. The ``response_url`` in the body
+is replaced with a hub URL for that command. When the CPO posts its
+``CommandResult`` there, the hub passes it on to the eMSP's original
+``response_url``. If the CPO rejects the command, or sends no result before
+the timeout, the hub sends the eMSP a ``CommandResult`` of its own.
+
+In-flight commands are tracked in one dict and one heap of
+``(deadline, command id)``. A single timer task sleeps until the earliest
+deadline, and a fixed pool of workers forwards commands and delivers
+results. Tens of thousands of pending commands therefore cost a few hundred
+bytes each and no coroutine apiece. Heap entries are not removed when a
+command completes early; stale ones are skipped when they come up.
+
+Commands are persisted in ``commands``. A completion is claimed with a
+conditional update on ``status``, so the result the eMSP receives is the
+first one recorded, even when the CPO's callback lands on another worker.
+The same update moves the command to ``DELIVERING`` with this worker as
+delivery owner for ``delivery_lease`` seconds. After a restart, pending
+commands are tracked again until their deadline, and each result whose
+delivery lease expired is claimed again by one worker and sent again.
+Delivered and undelivered commands expire ``FINISHED_RETENTION`` seconds
+after they finished.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+import orjson
+from pymongo import ReturnDocument
+
+from routing import Route, RoutingTable
+from serialization import ORJSON_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+COMMANDS_COLLECTION = "commands"
+COMMAND_TYPES = ("START_SESSION", "STOP_SESSION", "RESERVE_NOW")
+# Kept for troubleshooting, then removed by a TTL index on finished_at
+FINISHED_RETENTION = 7 * 24 * 3600
+
+# CommandResponseType answered by the CPO -> CommandResultType sent to the eMSP
+RESPONSE_RESULTS = {"NOT_SUPPORTED": "NOT_SUPPORTED", "REJECTED": "REJECTED", "UNKNOWN_SESSION": "FAILED"}
+# Connection failures mean the CPO never saw the command, so it can be sent again
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class Command:
+    __slots__ = (
+        "id", "command", "body", "response_url", "sender", "receiver", "deadline", "result", "message", "attempts"
+    )
+
+    def __init__(self, id: str, command: str, body: Dict[str, Any], response_url: str, sender: Route,
+                 receiver: Route, deadline: float):
+        self.id = id
+        self.command = command
+        # As forwarded to the CPO, with the hub's response_url
+        self.body = body
+        # The eMSP's own response_url
+        self.response_url = response_url
+        self.sender = sender
+        self.receiver = receiver
+        # time.time() of the timeout
+        self.deadline = deadline
+        self.result: Optional[str] = None
+        self.message: Optional[str] = None
+        self.attempts = 0
+
+
+def display_text(message: Optional[str]) -> Optional[List[Dict[str, str]]]:
+    return [{"language": "en", "text": message}] if message else None
+
+
+def command_response(result: str, timeout: int, message: Optional[str] = None) -> Dict[str, Any]:
+    response = {"result": result, "timeout": timeout}
+    if message:
+        response["message"] = display_text(message)
+    return response
+
+
+class CommandTracker:
+    def __init__(
+        self,
+        db,
+        router,
+        workers: int = 16,
+        timeout: float = 60.0,
+        max_timeout: float = 600.0,
+        max_pending: int = 100000,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        delivery_lease: float = 300.0,
+    ):
+        self.db = db
+        # HubRouter: routing table and pooled per-party clients
+        self.router = router
+        self.workers = workers
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        # Longer than a delivery with all its retries takes
+        self.delivery_lease = delivery_lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pending: Dict[str, Command] = {}
+        # Completed here, with the claim not written yet
+        self._claiming: Set[str] = set()
+        self._deadlines: List[Tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self._jobs: "asyncio.Queue[Tuple[str, Command]]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self.accepted = 0
+        self.results: Dict[str, int] = {}
+        self.delivered = 0
+        self.undelivered = 0
+
+    @property
+    def table(self) -> RoutingTable:
+        return self.router.table
+
+    def _track(self, command: Command, deadline: float) -> None:
+        command.deadline = deadline
+        self._pending[command.id] = command
+        if not self._deadlines or deadline < self._deadlines[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._deadlines, (deadline, command.id))
+        # Completed commands leave their entries behind; rebuild once they dominate the heap
+        if len(self._deadlines) > 2 * len(self._pending) + 1000:
+            self._deadlines = [(c.deadline, c.id) for c in self._pending.values()]
+            heapq.heapify(self._deadlines)
+
+    async def submit(
+        self, command: str, body: Dict[str, Any], sender: Route, receiver: Route, callback_url: str
+    ) -> Dict[str, Any]:
+        """Store and queue a command; returns the CommandResponse for the eMSP.
+
+        ``callback_url`` is the hub endpoint taking the CPO's result, without the command id.
+        """
+        if len(self._pending) >= self.max_pending:
+            return command_response("REJECTED", 0, "Too many pending commands at the hub")
+        command_id = str(uuid.uuid4())
+        forwarded = {**body, "response_url": f"{callback_url}/{command_id}"}
+        deadline = time.time() + self.timeout
+        now = datetime.now(timezone.utc)
+        await self.db[COMMANDS_COLLECTION].insert_one({
+            "id": command_id,
+            "command": command,
+            "status": "PENDING",
+            "body": forwarded,
+            "response_url": body["response_url"],
+            "sender_id": sender.organization_id,
+            "receiver_id": receiver.organization_id,
+            "expires_at": datetime.fromtimestamp(deadline, timezone.utc),
+            "created_at": now,
+            "updated_at": now,
+        })
+        item = Command(command_id, command, forwarded, body["response_url"], sender, receiver, deadline)
+        self._track(item, deadline)
+        self._jobs.put_nowait(("forward", item))
+        self.accepted += 1
+        return command_response("ACCEPTED", int(self.timeout))
+
+    def _complete(self, command: Command, result: str, message: Optional[str] = None) -> None:
+        if self._pending.pop(command.id, None) is None:
+            return
+        command.result = result
+        command.message = message
+        command.attempts = 0
+        self._claiming.add(command.id)
+        self._jobs.put_nowait(("claim", command))
+
+    async def receive_result(self, command_id: str, receiver_id: str, result: Dict[str, Any]) -> bool:
+        """Take a CommandResult posted by the CPO; False if the command is unknown or already done."""
+        command = self._pending.get(command_id)
+        if command is not None:
+            if command.receiver.organization_id != receiver_id:
+                return False
+            self._complete(command, result["result"], self._text(result.get("message")))
+            return True
+        if command_id in self._claiming:
+            # Still PENDING in the database, but this worker already has its result
+            return False
+        # Accepted on another worker (or before a restart): claim it here
+        doc = await self.db[COMMANDS_COLLECTION].find_one_and_update(
+            {"id": command_id, "receiver_id": receiver_id, "status": "PENDING"},
+            {"$set": {
+                "result": result["result"], "message": self._text(result.get("message")), **self._delivery_claim(),
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return False
+        command = self._from_document(doc)
+        if command is None:
+            return False
+        self._count(command.result)
+        self._jobs.put_nowait(("deliver", command))
+        return True
+
+    @staticmethod
+    def _text(message: Any) -> Optional[str]:
+        # CommandResult.message is a list of DisplayText
+        if isinstance(message, list) and message and isinstance(message[0], dict):
+            return message[0].get("text")
+        return None
+
+    def _delivery_claim(self) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        return {
+            "status": "DELIVERING",
+            "delivery_owner": self.owner,
+            "delivery_until": now + timedelta(seconds=self.delivery_lease),
+            "updated_at": now,
+        }
+
+    def _count(self, result: str) -> None:
+        self.results[result] = self.results.get(result, 0) + 1
+
+    def _from_document(self, doc: Dict[str, Any], routes: Optional[Dict[str, Route]] = None) -> Optional[Command]:
+        if routes is None:
+            routes = {route.organization_id: route for route in self.table.routes()}
+        sender, receiver = routes.get(doc["sender_id"]), routes.get(doc["receiver_id"])
+        if sender is None or receiver is None:
+            logger.warning("Command %s: parties no longer connected", doc["id"])
+            return None
+        command = Command(
+            doc["id"], doc["command"], doc["body"], doc["response_url"], sender, receiver,
+            doc["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+        )
+        command.result = doc.get("result")
+        command.message = doc.get("message")
+        return command
+
+    async def load(self) -> None:
+        """Resume tracking commands persisted by a previous run; needs a loaded routing table."""
+        routes = {route.organization_id: route for route in self.table.routes()}
+        # Results recorded before delivery claims existed, or whose delivering worker went away
+        undelivered = {"$or": [
+            {"status": "COMPLETED"},
+            {"status": "DELIVERING", "delivery_until": {"$lt": datetime.now(timezone.utc)}},
+        ]}
+        async for doc in self.db[COMMANDS_COLLECTION].find({"$or": [{"status": "PENDING"}, undelivered]}, {"_id": 0}):
+            command = self._from_document(doc, routes)
+            if command is None:
+                continue
+            if doc["status"] == "PENDING":
+                # Overdue ones time out as soon as the timer starts
+                self._track(command, command.deadline)
+                continue
+            # Every worker loads at startup; only the one that claims the delivery sends it
+            claimed = await self.db[COMMANDS_COLLECTION].update_one(
+                {"id": command.id, **undelivered}, {"$set": self._delivery_claim()}
+            )
+            if claimed.modified_count:
+                self._jobs.put_nowait(("deliver", command))
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self.run_timer())]
+            self._tasks += [asyncio.create_task(self.run_worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_timer(self) -> None:
+        while True:
+            now = time.time()
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, command_id = heapq.heappop(self._deadlines)
+                command = self._pending.get(command_id)
+                # Skip entries of completed commands and of deadlines moved since
+                if command is not None and command.deadline == deadline:
+                    self._complete(command, "TIMEOUT", "No result received from the CPO in time")
+            self._wakeup.clear()
+            delay = self._deadlines[0][0] - now if self._deadlines else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_worker(self) -> None:
+        while True:
+            kind, command = await self._jobs.get()
+            try:
+                if kind == "forward":
+                    await self.forward(command)
+                elif kind == "claim":
+                    await self.claim(command)
+                else:
+                    await self.deliver(command)
+            except Exception:
+                logger.exception("Command %s: %s failed", command.id, kind)
+
+    def _retry(self, kind: str, command: Command) -> bool:
+        command.attempts += 1
+        if command.attempts >= self.max_attempts:
+            return False
+        # A timer handle instead of a sleeping worker
+        delay = self.base_delay * 2 ** (command.attempts - 1)
+        asyncio.get_running_loop().call_later(delay, self._jobs.put_nowait, (kind, command))
+        return True
+
+    async def forward(self, command: Command) -> None:
+        if command.id not in self._pending:
+            return
+        route = command.receiver
+        client = self.router.client_for(route)
+        headers = self.router.build_headers([("Content-Type", "application/json")], route, command.sender)
+        try:
+            response = await client.post(
+                f"{route.url}/commands/{command.command}",
+                content=orjson.dumps(command.body, option=ORJSON_OPTIONS),
+                headers=headers,
+            )
+        except RETRYABLE_ERRORS as e:
+            if not self._retry("forward", command):
+                self._complete(command, "FAILED", f"CPO unreachable: {type(e).__name__}")
+            return
+        except httpx.HTTPError as e:
+            self._complete(command, "FAILED", f"Forwarding failed: {type(e).__name__}")
+            return
+        command.attempts = 0
+        try:
+            data = response.json().get("data") or {}
+        except ValueError:
+            data = {}
+        if response.status_code >= 400 or data.get("result") not in ("ACCEPTED", *RESPONSE_RESULTS):
+            self._complete(command, "FAILED", f"Unexpected CPO response (HTTP {response.status_code})")
+            return
+        if data["result"] != "ACCEPTED":
+            self._complete(command, RESPONSE_RESULTS[data["result"]], self._text(data.get("message")))
+            return
+        # The CPO says how long the result may take
+        timeout = min(max(float(data.get("timeout") or self.timeout), 1.0), self.max_timeout)
+        deadline = time.time() + timeout
+        if command.id in self._pending:
+            self._track(command, deadline)
+            await self.db[COMMANDS_COLLECTION].update_one(
+                {"id": command.id, "status": "PENDING"},
+                {"$set": {"expires_at": datetime.fromtimestamp(deadline, timezone.utc),
+                          "updated_at": datetime.now(timezone.utc)}},
+            )
+
+    async def claim(self, command: Command) -> None:
+        try:
+            updated = await self.db[COMMANDS_COLLECTION].update_one(
+                {"id": command.id, "status": "PENDING"},
+                {"$set": {"result": command.result, "message": command.message, **self._delivery_claim()}},
+            )
+        finally:
+            self._claiming.discard(command.id)
+        # Otherwise another worker recorded (and delivers) a result first
+        if updated.modified_count:
+            self._count(command.result)
+            await self.deliver(command)
+
+    async def deliver(self, command: Command) -> None:
+        """POST the CommandResult to the eMSP's response_url."""
+        result = {"result": command.result}
+        if command.message:
+            result["message"] = display_text(command.message)
+        client = self.router.client_for(command.sender)
+        headers = self.router.build_headers([("Content-Type", "application/json")], command.sender, command.receiver)
+        try:
+            response = await client.post(
+                command.response_url, content=orjson.dumps(result, option=ORJSON_OPTIONS), headers=headers
+            )
+            failed = response.status_code == 429 or response.status_code >= 500
+            error = f"HTTP {response.status_code}" if response.status_code >= 400 else None
+        except httpx.HTTPError as e:
+            failed, error = True, f"{type(e).__name__}: {e}"
+        if failed and self._retry("deliver", command):
+            return
+        if error:
+            self.undelivered += 1
+        else:
+            self.delivered += 1
+        now = datetime.now(timezone.utc)
+        # Not recorded if the lease ran out and another worker took the delivery over
+        await self.db[COMMANDS_COLLECTION].update_one(
+            {"id": command.id, "status": "DELIVERING", "delivery_owner": self.owner},
+            {"$set": {"status": "UNDELIVERED" if error else "DELIVERED", "delivery_error": error,
+                      "updated_at": now, "finished_at": now}},
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "deadlines": len(self._deadlines),
+            "queued_jobs": self._jobs.qsize(),
+            "accepted": self.accepted,
+            "results": dict(self.results),
+            "delivered": self.delivered,
+            "undelivered": self.undelivered,
+        }
@@ -0,0 +1,105 @@
+"""Conditional GET support (ETag / If-None-Match / If-Modified-Since).
+
+Every write to a collection served by the OCPI GET endpoints bumps a
+per-collection version document in ``collection_versions``, which records a
+version counter, the highest ``last_updated`` written and the hub time of
+the write. The validators of a response derive from that document alone:
+
+* ``ETag``: strong, a digest of the collection version, its ``last_updated``
+  and everything that selects the response (path, query parameters and the
+  requesting organization);
+* ``Last-Modified``: the hub time of the last write to the collection.
+
+So a conditional request is answered with a 304 after a single point read,
+without fetching or counting documents. Versions are per collection, not
+per document, so any write invalidates every ETag of that collection; that
+keeps validators correct without tracking which pages a write touched.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+VERSIONS_COLLECTION = "collection_versions"
+# Collections whose writers must call bump_version
+VERSIONED_COLLECTIONS = ("locations", "sessions", "cdrs", "tokens", "tariffs")
+
+
+async def bump_version(db, collection: str, last_updated: Optional[datetime] = None) -> None:
+    update: Dict[str, Any] = {
+        "$inc": {"version": 1},
+        "$set": {"modified_at": datetime.now(timezone.utc)},
+    }
+    if last_updated is not None:
+        update["$max"] = {"last_updated": last_updated}
+    await db[VERSIONS_COLLECTION].update_one({"_id": collection}, update, upsert=True)
+
+
+def etag(version: Dict[str, Any], request: Request, scope: str) -> str:
+    last_updated = version.get("last_updated")
+    parts = [
+        version["_id"],
+        str(version.get("version", 0)),
+        last_updated.isoformat() if last_updated else "",
+        scope,
+        request.url.path,
+        # Parameter order does not change the response
+        "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items())),
+    ]
+    return '"' + hashlib.sha256("\n".join(parts).encode()).hexdigest()[:32] + '"'
+
+
+def _matches(if_none_match: str, tag: str) -> bool:
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    # Weak comparison, as required for If-None-Match
+    return "*" in candidates or tag in candidates or f"W/{tag}" in candidates
+
+
+def _not_modified_since(if_modified_since: str, modified_at: Optional[datetime]) -> bool:
+    if modified_at is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if modified_at.tzinfo is None:
+        modified_at = modified_at.replace(tzinfo=timezone.utc)
+    # HTTP dates have second precision
+    return modified_at.replace(microsecond=0) <= since
+
+
+async def not_modified(
+    db,
+    collection: str,
+    request: Request,
+    response: Response,
+    scope: str = "",
+) -> Optional[Response]:
+    """Set ETag/Last-Modified on ``response``; return a 304 when the client copy is current.
+
+    ``scope`` distinguishes callers that see different data at the same URL,
+    e.g. the organization id for role-filtered lists.
+    """
+    version = await db[VERSIONS_COLLECTION].find_one({"_id": collection}) or {"_id": collection}
+    tag = etag(version, request, scope)
+    headers = {"ETag": tag}
+    modified_at = version.get("modified_at")
+    if modified_at is not None:
+        if modified_at.tzinfo is None:
+            modified_at = modified_at.replace(tzinfo=timezone.utc)
+        headers["Last-Modified"] = format_datetime(modified_at, usegmt=True)
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence; If-Modified-Since is then ignored
+        fresh = _matches(if_none_match, tag)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        fresh = if_modified_since is not None and _not_modified_since(if_modified_since, modified_at)
+    return Response(status_code=304, headers=headers) if fresh else None
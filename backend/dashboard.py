@@ -0,0 +1,99 @@
+"""Dashboard statistics.
+
+The React dashboard polls these numbers, so they are computed concurrently,
+use collection metadata estimates for the large totals, and are served from
+a short-TTL cache. Concurrent requests for an expired entry share a single
+recomputation instead of each hitting Mongo. The cache holds at most
+``maxsize`` entries (one per distinct timeseries window), least recently
+used first out.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlightCache:
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._values: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._values.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._values.move_to_end(key)
+            return entry[1]
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another request may have refreshed the entry while we waited
+            entry = self._values.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            value = await compute()
+            self._values[key] = (time.monotonic() + self.ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                oldest, _ = self._values.popitem(last=False)
+                # A lock still held is dropped by the next eviction of its key
+                if oldest in self._locks and not self._locks[oldest].locked():
+                    del self._locks[oldest]
+            return value
+
+    def invalidate(self, key: Hashable = None) -> None:
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
+
+
+async def collect_stats(db) -> Dict[str, Any]:
+    roles, location_count, session_count, active_sessions = await asyncio.gather(
+        db.organizations.aggregate([{"$group": {"_id": "$role", "count": {"$sum": 1}}}]).to_list(None),
+        db.locations.estimated_document_count(),
+        db.sessions.estimated_document_count(),
+        db.sessions.count_documents({"status": "ACTIVE"}),
+    )
+    role_counts = {r["_id"]: r["count"] for r in roles}
+    return {
+        "cpos": role_counts.get("CPO", 0),
+        "emsps": role_counts.get("EMSP", 0),
+        "locations": location_count,
+        "sessions": session_count,
+        "active_sessions": active_sessions,
+    }
+
+
+async def collect_timeseries(db, hours: int, days: int) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    sessions_per_hour, kwh_per_day = await asyncio.gather(
+        db.sessions.aggregate([
+            {"$match": {"start_date_time": {"$gte": now - timedelta(hours=hours)}}},
+            {"$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m-%dT%H:00:00Z", "date": "$start_date_time"}},
+                "sessions": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]).to_list(None),
+        db.sessions.aggregate([
+            {"$match": {"start_date_time": {"$gte": now - timedelta(days=days)}}},
+            {"$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$start_date_time"}},
+                "kwh": {"$sum": "$kwh"},
+                "sessions": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]).to_list(None),
+    )
+    return {
+        "sessions_per_hour": [{"hour": b["_id"], "sessions": b["sessions"]} for b in sessions_per_hour],
+        "kwh_per_day": [
+            {"day": b["_id"], "kwh": round(b["kwh"], 3), "sessions": b["sessions"]} for b in kwh_per_day
+        ],
+    }
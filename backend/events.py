@@ -0,0 +1,160 @@
+"""Internal event bus for writes to the hub's main collections.
+
+Every worker keeps in-memory state derived from Mongo (auth cache, token
+index, dashboard statistics). The bus tells all of them about writes, so
+that state can be invalidated or updated incrementally instead of relying on
+short TTLs.
+
+On a replica set the bus is fed by a Mongo change stream on
+``organizations``, ``locations``, ``sessions`` and ``tokens``: every worker
+sees every write, whichever worker made it. The resume token is saved in
+``event_bus_checkpoints`` every few seconds, so a restarted worker resumes
+the stream where it stopped. Standalone servers do not support change
+streams; there the bus falls back to in-process delivery of the events that
+write paths report through ``notify``, which is complete for a single
+worker. ``notify`` is a no-op while the change stream is active.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS_COLLECTION = "event_bus_checkpoints"
+WATCHED_COLLECTIONS = ("organizations", "locations", "sessions", "tokens")
+
+# Server error codes: change streams unsupported (standalone), resume point no longer in the oplog
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+@dataclass
+class ChangeEvent:
+    collection: str
+    # insert, update, replace or delete; "bulk" for local bulk imports
+    operation: str
+    # Current document when known (change stream lookup, or what the writer passed)
+    document: Optional[Dict[str, Any]] = None
+    updated_fields: Optional[Dict[str, Any]] = None
+    local: bool = False
+
+
+Handler = Callable[[ChangeEvent], Union[None, Awaitable[None]]]
+
+
+class EventBus:
+    def __init__(self, db, name: str = "hub", checkpoint_interval: float = 5.0, retry_interval: float = 5.0):
+        self.db = db
+        self.name = name
+        self.checkpoint_interval = checkpoint_interval
+        self.retry_interval = retry_interval
+        self.mode = "local"
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._resume_token: Optional[Dict[str, Any]] = None
+        self._saved_token: Optional[Dict[str, Any]] = None
+        self._last_checkpoint = 0.0
+        self.delivered = 0
+        self.handler_errors = 0
+
+    def subscribe(self, collection: str, handler: Handler) -> None:
+        self._handlers.setdefault(collection, []).append(handler)
+
+    async def notify(
+        self,
+        collection: str,
+        operation: str,
+        document: Optional[Dict[str, Any]] = None,
+        updated_fields: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Report a write made by this worker; delivered locally unless the change stream will."""
+        if self.mode != "change_stream":
+            await self.dispatch(ChangeEvent(collection, operation, document, updated_fields, local=True))
+
+    async def dispatch(self, event: ChangeEvent) -> None:
+        for handler in self._handlers.get(event.collection, ()):
+            try:
+                result = handler(event)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                self.handler_errors += 1
+                logger.exception("Event handler failed for %s %s", event.collection, event.operation)
+        self.delivered += 1
+
+    async def run(self) -> None:
+        checkpoint = await self.db[CHECKPOINTS_COLLECTION].find_one({"_id": self.name})
+        self._resume_token = self._saved_token = checkpoint.get("resume_token") if checkpoint else None
+        while True:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams are not available; event bus delivers in-process events only")
+                    self.mode = "local"
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.warning("Event bus resume point is gone from the oplog; restarting from now")
+                    self._resume_token = None
+                else:
+                    logger.exception("Event bus change stream failed")
+            except NotImplementedError:
+                # Mock clients without change stream support
+                self.mode = "local"
+                return
+            except asyncio.CancelledError:
+                await self._checkpoint(force=True)
+                raise
+            except Exception:
+                logger.exception("Event bus change stream failed")
+            # Writes made until the stream is back are delivered in-process
+            self.mode = "local"
+            await asyncio.sleep(self.retry_interval)
+
+    async def _watch(self) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": list(WATCHED_COLLECTIONS)}}}]
+        async with self.db.watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after=self._resume_token,
+            max_await_time_ms=1000,
+        ) as stream:
+            while True:
+                change = await stream.try_next()
+                self.mode = "change_stream"
+                if change is not None:
+                    await self.dispatch(ChangeEvent(
+                        collection=change["ns"]["coll"],
+                        operation=change["operationType"],
+                        document=change.get("fullDocument"),
+                        updated_fields=(change.get("updateDescription") or {}).get("updatedFields"),
+                    ))
+                self._resume_token = stream.resume_token
+                await self._checkpoint()
+
+    async def _checkpoint(self, force: bool = False) -> None:
+        if self._resume_token is None or self._resume_token == self._saved_token:
+            return
+        if not force and time.monotonic() - self._last_checkpoint < self.checkpoint_interval:
+            return
+        await self.db[CHECKPOINTS_COLLECTION].update_one(
+            {"_id": self.name},
+            {"$set": {"resume_token": self._resume_token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        self._saved_token = self._resume_token
+        self._last_checkpoint = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "subscriptions": {collection: len(handlers) for collection, handlers in self._handlers.items()},
+            "delivered": self.delivered,
+            "handler_errors": self.handler_errors,
+        }
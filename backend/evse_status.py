@@ -0,0 +1,280 @@
+"""In-memory EVSE status table with write-behind to Mongo.
+
+EVSE ``status`` is the hottest field of the hub: CPOs PATCH it on every plug-in
+and plug-out, and apps poll it. In Mongo it sits inside the ``evses`` array
+of its location. Here every EVSE gets a slot in a few parallel arrays:
+
+* ``array('B')`` with the status as an interned code (index into ``statuses``);
+* ``array('d')`` with the EVSE ``last_updated`` as a POSIX timestamp;
+* a list of ``(country_code, party_id, location_id, evse_uid)`` keys, plus a
+  dict from key to slot.
+
+Slots are only ever appended; an EVSE that goes away keeps its slot, with
+status REMOVED as OCPI intends: a location write that no longer lists an
+EVSE it had marks that EVSE REMOVED. Because of that the key list can be encoded
+once, in fixed blocks, and clients that keep the keys only need the ones
+added since. A snapshot of every status is a single translated copy of the
+code array, one character per EVSE.
+
+Status-only PATCHes update the table, bump the ``locations`` version (reads
+overlay the new status at once) and return. The Mongo write is queued and
+flushed every ``interval`` seconds in one unordered ``bulk_write``, which
+bumps the version again. Every other location write
+still goes to Mongo first and then updates the table. Updates carrying an
+older ``last_updated`` than the slot are ignored, so a reload or a change
+event can never roll a newer status back. ``listener``, when set, is called
+with the key, status and ``last_updated`` of every EVSE whose status
+actually changed, except while loading. Bursts of ``reload`` requests, e.g.
+one per bulk import, share a single reload of the table.
+"""
+
+import asyncio
+import logging
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from pymongo import UpdateOne
+
+from conditional import bump_version
+
+logger = logging.getLogger(__name__)
+
+STATUSES = (
+    "AVAILABLE", "BLOCKED", "CHARGING", "INOPERATIVE", "OUTOFORDER", "PLANNED", "REMOVED", "RESERVED", "UNKNOWN",
+)
+# One character per status code in snapshots; statuses beyond these are stored as UNKNOWN
+CODE_CHARS = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+CODE_TABLE = bytes(CODE_CHARS[i] if i < len(CODE_CHARS) else ord("?") for i in range(256))
+KEY_BLOCK = 65536
+
+EvseKey = Tuple[str, str, str, str]
+LocationKey = Tuple[str, str, str]
+
+
+def timestamp(value: Any) -> float:
+    # Mongo returns naive UTC datetimes, the API aware ones
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    return 0.0
+
+
+class EvseStatusStore:
+    def __init__(self, db, interval: float = 1.0):
+        self.db = db
+        self.interval = interval
+        self.statuses: List[str] = list(STATUSES)
+        self._codes: Dict[str, int] = {status: code for code, status in enumerate(STATUSES)}
+        self._strings: Dict[str, str] = {}
+        self._slots: Dict[EvseKey, int] = {}
+        self._keys: List[EvseKey] = []
+        # Slots of the EVSEs each location has ever listed
+        self._locations: Dict[LocationKey, List[int]] = {}
+        self._status = array("B")
+        self._updated = array("d")
+        # Encoded keys of full KEY_BLOCK-sized blocks; they never change
+        self._key_blocks: List[bytes] = []
+        # Slots whose status still has to be written to Mongo, and those being written
+        self._dirty: Dict[int, None] = {}
+        self._flushing: Dict[int, None] = {}
+        self.listener: Optional[Callable[[EvseKey, str, datetime], None]] = None
+        self.reload_task: Optional[asyncio.Task] = None
+        self._reload_again = False
+        self.ready = False
+        self.version = 0
+        self.deferred_writes = 0
+        self.flushed_writes = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _intern(self, value: str) -> str:
+        # Country codes, party ids and location ids repeat across EVSEs
+        return self._strings.setdefault(value, value)
+
+    def _code(self, status: str) -> int:
+        code = self._codes.get(status)
+        if code is None:
+            if len(self.statuses) >= len(CODE_CHARS):
+                return self._codes["UNKNOWN"]
+            code = self._codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        return code
+
+    def slot(self, country_code: str, party_id: str, location_id: str, evse_uid: str) -> Optional[int]:
+        return self._slots.get((country_code, party_id, location_id, evse_uid))
+
+    def set(self, country_code: str, party_id: str, location_id: str, evse_uid: str,
+            status: str, last_updated: Any, notify: bool = True) -> int:
+        """Record an EVSE status; older than what the slot holds is ignored. Returns the slot."""
+        key = (country_code, party_id, location_id, evse_uid)
+        updated = timestamp(last_updated)
+        code = self._code(status)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self._keys)
+            key = (self._intern(country_code), self._intern(party_id), self._intern(location_id), evse_uid)
+            self._slots[key] = slot
+            self._keys.append(key)
+            self._locations.setdefault(key[:3], []).append(slot)
+            self._status.append(code)
+            self._updated.append(updated)
+        elif updated >= self._updated[slot]:
+            changed = code != self._status[slot]
+            self._status[slot] = code
+            self._updated[slot] = updated
+            if not changed:
+                return slot
+        else:
+            return slot
+        self.version += 1
+        if notify and self.listener is not None:
+            self.listener(self._keys[slot], self.statuses[code], datetime.fromtimestamp(updated, timezone.utc))
+        return slot
+
+    def set_location(self, location: Dict[str, Any], notify: bool = True) -> None:
+        """Record the statuses of a location's full ``evses`` list; EVSEs it no longer lists become REMOVED."""
+        country_code, party_id, location_id = location["country_code"], location["party_id"], location["id"]
+        listed = set()
+        for evse in location.get("evses") or ():
+            if evse.get("uid"):
+                listed.add(evse["uid"])
+                if evse.get("status"):
+                    self.set(country_code, party_id, location_id, evse["uid"], evse["status"], evse.get("last_updated"), notify)
+        for slot in self._locations.get((country_code, party_id, location_id), ()):
+            evse_uid = self._keys[slot][3]
+            if evse_uid not in listed:
+                # Dated by the location write, so it does not override a newer EVSE update
+                self.set(country_code, party_id, location_id, evse_uid, "REMOVED", location.get("last_updated"), notify)
+
+    def defer(self, slot: int) -> None:
+        """Queue the slot's current status for the next flush."""
+        self._dirty[slot] = None
+        self.deferred_writes += 1
+
+    def get(self, slot: int) -> Tuple[str, datetime]:
+        return self.statuses[self._status[slot]], datetime.fromtimestamp(self._updated[slot], timezone.utc)
+
+    def overlay(self, location: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply statuses not flushed yet to a location read from Mongo."""
+        if self._dirty or self._flushing:
+            for evse in location.get("evses") or ():
+                self.overlay_evse(location["country_code"], location["party_id"], location["id"], evse)
+        return location
+
+    def overlay_evse(self, country_code: str, party_id: str, location_id: str, evse: Dict[str, Any]) -> Dict[str, Any]:
+        slot = self._slots.get((country_code, party_id, location_id, evse.get("uid")))
+        if slot is not None and (slot in self._dirty or slot in self._flushing):
+            evse["status"], evse["last_updated"] = self.get(slot)
+        return evse
+
+    async def load(self, batch_size: int = 5000) -> None:
+        """Fill the table from the locations collection."""
+        projection = {"_id": 0, "country_code": 1, "party_id": 1, "id": 1, "last_updated": 1,
+                      "evses.uid": 1, "evses.status": 1, "evses.last_updated": 1}
+        async for location in self.db.locations.find({}, projection).batch_size(batch_size):
+            self.set_location(location, notify=False)
+        self.ready = True
+        logger.info("EVSE status store loaded %d EVSEs", len(self))
+
+    def reload(self) -> None:
+        """Reload the table in the background; requests during a reload add at most one more."""
+        if self.reload_task is not None and not self.reload_task.done():
+            # Writes made after the running reload read their location may be missed by it
+            self._reload_again = True
+            return
+        self.reload_task = asyncio.create_task(self._reload())
+
+    async def _reload(self) -> None:
+        while True:
+            self._reload_again = False
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Failed to reload EVSE statuses")
+            if not self._reload_again:
+                return
+
+    def _encode_keys(self, start: int, end: int) -> bytes:
+        return orjson.dumps(self._keys[start:end])[1:-1]
+
+    def snapshot(self, evses_from: int = 0) -> bytes:
+        """JSON object with every status, and the keys of slots from ``evses_from`` on."""
+        count = len(self._keys)
+        # One character per EVSE; the translation table turns codes into CODE_CHARS
+        codes = self._status.tobytes().translate(CODE_TABLE)
+        evses_from = max(0, min(evses_from, count))
+        while len(self._key_blocks) < count // KEY_BLOCK:
+            start = len(self._key_blocks) * KEY_BLOCK
+            self._key_blocks.append(self._encode_keys(start, start + KEY_BLOCK))
+        parts = []
+        first_block = evses_from // KEY_BLOCK
+        if evses_from % KEY_BLOCK:
+            # Starts inside a block: encode up to the end of that block
+            end = min((first_block + 1) * KEY_BLOCK, count)
+            parts.append(self._encode_keys(evses_from, end))
+            first_block += 1
+        parts.extend(self._key_blocks[first_block:])
+        tail = len(self._key_blocks) * KEY_BLOCK
+        if tail < count and tail >= evses_from:
+            parts.append(self._encode_keys(tail, count))
+        return b"".join((
+            b'{"version":', str(self.version).encode(),
+            b',"count":', str(count).encode(),
+            b',"statuses":', orjson.dumps(self.statuses),
+            b',"evses_from":', str(evses_from).encode(),
+            b',"evses":[', b",".join(part for part in parts if part), b"]",
+            b',"status":"', codes, b'"}',
+        ))
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty = self._flushing = self._dirty
+        self._dirty = {}
+        operations, newest = [], None
+        for slot in dirty:
+            country_code, party_id, location_id, evse_uid = self._keys[slot]
+            status, last_updated = self.get(slot)
+            newest = max(newest, last_updated) if newest else last_updated
+            operations.append(UpdateOne(
+                {"country_code": country_code, "party_id": party_id, "id": location_id, "evses.uid": evse_uid},
+                {
+                    "$set": {"evses.$.status": status, "evses.$.last_updated": last_updated},
+                    "$max": {"last_updated": last_updated},
+                }
+            ))
+        try:
+            await self.db.locations.bulk_write(operations, ordered=False)
+        except Exception:
+            # Written again with whatever status the slots hold by then
+            self._dirty.update(dirty)
+            raise
+        finally:
+            self._flushing = {}
+        await bump_version(self.db, "locations", newest)
+        self.flushed_writes += len(operations)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush EVSE statuses")
+
+    def stats(self) -> Dict[str, Any]:
+        codes = self._status.tobytes()
+        return {
+            "ready": self.ready,
+            "evses": len(self),
+            "version": self.version,
+            "by_status": {status: codes.count(code) for code, status in enumerate(self.statuses)},
+            "pending_writes": len(self._dirty),
+            "deferred_writes": self.deferred_writes,
+            "flushed_writes": self.flushed_writes,
+        }
+
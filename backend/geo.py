@@ -0,0 +1,117 @@
+"""Geospatial search support for locations.
+
+OCPI stores coordinates as decimal-degree strings, which Mongo cannot index.
+Every location write therefore also stores a few derived search fields:
+
+* ``geo``: GeoJSON point backing the 2dsphere index
+* ``connector_standards``: distinct connector standards across all EVSEs
+* ``max_power``: highest connector power in watts
+
+These fields are hub-internal and never part of OCPI responses.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+SEARCH_FIELDS = ("geo", "connector_standards", "max_power")
+
+GEO_INDEX = [("geo", "2dsphere"), ("connector_standards", 1), ("max_power", 1)]
+
+
+def geo_point(coordinates: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not coordinates:
+        return None
+    try:
+        latitude = float(coordinates["latitude"])
+        longitude = float(coordinates["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def connector_power(connector: Dict[str, Any]) -> int:
+    if connector.get("max_electric_power"):
+        return connector["max_electric_power"]
+    return (connector.get("max_voltage") or 0) * (connector.get("max_amperage") or 0)
+
+
+def location_search_fields(location: Dict[str, Any]) -> Dict[str, Any]:
+    """Derived search fields for the parts of ``location`` that are present.
+
+    Partial documents (PATCH bodies) only yield the fields they affect.
+    """
+    fields: Dict[str, Any] = {}
+    if "evses" in location:
+        connectors = [
+            connector
+            for evse in location["evses"] or []
+            for connector in evse.get("connectors") or []
+        ]
+        # model_dump() leaves enum members in place; store their plain values
+        fields["connector_standards"] = sorted({getattr(c["standard"], "value", c["standard"]) for c in connectors})
+        fields["max_power"] = max((connector_power(c) for c in connectors), default=0)
+    if "coordinates" in location:
+        point = geo_point(location["coordinates"])
+        if point:
+            fields["geo"] = point
+    return fields
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise HTTPException(status_code=400, detail="bbox minimum must be below its maximum")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def bbox_filter(bbox: str) -> Dict[str, Any]:
+    min_lon, min_lat, max_lon, max_lat = parse_bbox(bbox)
+    ring = [
+        [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat],
+        [min_lon, max_lat], [min_lon, min_lat],
+    ]
+    return {"geo": {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+
+
+def search_pipeline(
+    latitude: Optional[float],
+    longitude: Optional[float],
+    radius: Optional[float],
+    bbox: Optional[str],
+    connector_types: Optional[List[str]],
+    min_power: Optional[int],
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """Aggregation pipeline for radius, nearest-N and bounding-box searches."""
+    query: Dict[str, Any] = {"publish": True}
+    if connector_types:
+        query["connector_standards"] = {"$in": connector_types}
+    if min_power is not None:
+        query["max_power"] = {"$gte": min_power}
+
+    if latitude is not None and longitude is not None:
+        if bbox:
+            query.update(bbox_filter(bbox))
+        near = {
+            "near": {"type": "Point", "coordinates": [longitude, latitude]},
+            "key": "geo",
+            "distanceField": "distance",
+            "spherical": True,
+            "query": query,
+        }
+        if radius is not None:
+            near["maxDistance"] = radius
+        pipeline = [{"$geoNear": near}]
+    elif bbox:
+        query.update(bbox_filter(bbox))
+        pipeline = [{"$match": query}]
+    else:
+        raise HTTPException(status_code=400, detail="Either latitude/longitude or bbox is required")
+
+    return pipeline + [{"$limit": limit}]
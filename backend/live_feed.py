@@ -0,0 +1,276 @@
+"""Live feed of hub changes over Server-Sent Events and WebSockets.
+
+Dashboards and partners used to poll the dashboard statistics and the
+location and session listings. With the feed, they keep one connection open
+and receive:
+
+* ``evse_status``: an EVSE changed status (everyone);
+* ``session``: a session was created or changed status (its CPO and eMSP);
+* ``counters``: dashboard statistics changed, as new values plus deltas
+  (everyone, also anonymous dashboard clients).
+
+Events are encoded once, when published, into a ring buffer of the last
+``capacity`` events; publishing costs the same with one client or ten
+thousand. Every connection keeps only a cursor into the ring. It wakes up at
+most every ``interval`` seconds, collects the events it may see since its
+cursor and writes them in one frame. Clients at the same cursor see the same
+public events, so such a frame is built once per wake-up and shared. A slow
+client therefore gets bigger batches, not more work for the hub. A client that falls more than
+``capacity`` events behind gets a ``reset`` event and continues from the
+newest event; it should then reload state through the REST endpoints (e.g.
+``/locations/availability``). SSE clients reconnecting with ``Last-Event-ID``
+resume where they left off if those events are still in the ring.
+"""
+
+import asyncio
+import bisect
+import logging
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import orjson
+
+from serialization import ORJSON_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("evse_status", "session", "counters")
+
+# seq, type, audience (None: everyone), JSON text, SSE frame
+Entry = Tuple[int, str, Optional[FrozenSet[str]], str, bytes]
+
+
+def party_key(country_code: str, party_id: str) -> str:
+    return f"{country_code}*{party_id}"
+
+
+class FeedFull(Exception):
+    pass
+
+
+class Batch:
+    """Events written to a client in one go, encoded on first use; empty for a heartbeat."""
+
+    __slots__ = ("entries", "_frame", "_message")
+
+    def __init__(self, entries: List[Entry]):
+        self.entries = entries
+        self._frame: Optional[bytes] = None
+        self._message: Optional[str] = None
+
+    def sse(self) -> bytes:
+        if self._frame is None:
+            self._frame = b"".join(entry[4] for entry in self.entries) if self.entries else b": keep-alive\n\n"
+        return self._frame
+
+    def message(self) -> str:
+        if self._message is None:
+            self._message = "[" + ",".join(entry[3] for entry in self.entries) + "]"
+        return self._message
+
+
+HEARTBEAT = Batch([])
+
+
+class Subscription:
+    __slots__ = ("organization_id", "party", "types", "cursor", "resets", "needs_reset")
+
+    def __init__(self, organization_id: Optional[str], party: Optional[str], types: FrozenSet[str], cursor: int):
+        # No organization: anonymous dashboard client, events for everyone only
+        self.organization_id = organization_id
+        self.party = party
+        self.types = types
+        self.cursor = cursor
+        self.resets = 0
+        # Resumed from an event id this worker cannot replay
+        self.needs_reset = False
+
+    def sees(self, entry: Entry) -> bool:
+        audience = entry[2]
+        return entry[1] in self.types and (
+            audience is None or self.organization_id in audience or self.party in audience
+        )
+
+
+class LiveFeed:
+    def __init__(
+        self,
+        capacity: int = 10000,
+        interval: float = 0.25,
+        heartbeat: float = 15.0,
+        max_subscribers: int = 10000,
+        counters: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+        counters_interval: float = 2.0,
+    ):
+        self.capacity = capacity
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self.counters = counters
+        self.counters_interval = counters_interval
+        # Event ids are only meaningful to the worker that issued them
+        self.epoch = uuid.uuid4().hex[:8]
+        self._ring: List[Optional[Entry]] = [None] * capacity
+        # Sequence numbers of events with an audience, ascending
+        self._restricted: List[int] = []
+        # Batches of public events only, by (cursor, head, types); valid until the head moves
+        self._shared: Dict[Tuple[int, int, FrozenSet[str]], Batch] = {}
+        self._shared_head = 0
+        # Sequence number of the next event
+        self._head = 1
+        self._published = False
+        self._wakeup = asyncio.Event()
+        self._subscriptions: Dict[int, Subscription] = {}
+        self._last_counters: Optional[Dict[str, Any]] = None
+        self.events = 0
+        self.resets = 0
+
+    def publish(self, event_type: str, data: Dict[str, Any], audience: Optional[Iterable[str]] = None) -> int:
+        seq = self._head
+        payload = orjson.dumps({"id": self.event_id(seq), "type": event_type, "data": data}, option=ORJSON_OPTIONS)
+        frame = b"id: %s\nevent: %s\ndata: %s\n\n" % (self.event_id(seq).encode(), event_type.encode(), payload)
+        self._ring[seq % self.capacity] = (
+            seq, event_type, frozenset(a for a in audience if a) if audience is not None else None,
+            payload.decode(), frame
+        )
+        if audience is not None:
+            if len(self._restricted) >= 2 * self.capacity:
+                del self._restricted[:bisect.bisect_left(self._restricted, seq - self.capacity)]
+            self._restricted.append(seq)
+        self._head = seq + 1
+        self._published = True
+        self.events += 1
+        return seq
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def subscribe(
+        self,
+        organization_id: Optional[str] = None,
+        party: Optional[str] = None,
+        types: Iterable[str] = EVENT_TYPES,
+        last_event_id: Optional[str] = None,
+    ) -> Subscription:
+        if len(self._subscriptions) >= self.max_subscribers:
+            raise FeedFull("Too many live feed connections")
+        subscription = Subscription(organization_id, party, frozenset(types) & frozenset(EVENT_TYPES), self._head)
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition("-")
+            if epoch == self.epoch and seq.isdigit() and int(seq) < self._head:
+                # Resume after the last event the client saw; too old means a reset on the first read
+                subscription.cursor = int(seq) + 1
+            else:
+                subscription.needs_reset = True
+        self._subscriptions[id(subscription)] = subscription
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.pop(id(subscription), None)
+
+    async def batches(self, subscription: Subscription) -> AsyncIterator[Batch]:
+        """Events for one subscription, in batches; an empty batch is a heartbeat."""
+        try:
+            if subscription.needs_reset:
+                yield Batch([self._reset_entry(self._head - 1, None)])
+            while True:
+                wakeup = self._wakeup
+                if subscription.cursor >= self._head:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), self.heartbeat)
+                    except asyncio.TimeoutError:
+                        yield HEARTBEAT
+                        continue
+                head = self._head
+                if head - subscription.cursor > self.capacity:
+                    # Fell behind the ring: tell the client to reload instead of sending a gap
+                    subscription.resets += 1
+                    self.resets += 1
+                    dropped = head - subscription.cursor - self.capacity
+                    subscription.cursor = head
+                    yield Batch([self._reset_entry(head - 1, dropped)])
+                    continue
+                batch = self._batch(subscription, head)
+                subscription.cursor = head
+                if batch.entries:
+                    yield batch
+        finally:
+            self.unsubscribe(subscription)
+
+    def _batch(self, subscription: Subscription, head: int) -> Batch:
+        cursor = subscription.cursor
+        restricted = self._restricted
+        index = bisect.bisect_left(restricted, cursor)
+        if index < len(restricted) and restricted[index] < head:
+            # Some events are for a few parties only: filter for this subscription
+            return Batch([entry for entry in self._entries(cursor, head) if subscription.sees(entry)])
+        if self._shared_head != head:
+            self._shared.clear()
+            self._shared_head = head
+        key = (cursor, head, subscription.types)
+        batch = self._shared.get(key)
+        if batch is None:
+            types = subscription.types
+            batch = self._shared[key] = Batch([entry for entry in self._entries(cursor, head) if entry[1] in types])
+        return batch
+
+    def _entries(self, start: int, end: int) -> Iterable[Entry]:
+        ring, capacity = self._ring, self.capacity
+        return (ring[seq % capacity] for seq in range(start, end))
+
+    def _reset_entry(self, seq: int, dropped: Optional[int]) -> Entry:
+        # dropped is None when the number of missed events is unknown
+        payload = orjson.dumps({"id": self.event_id(seq), "type": "reset", "data": {"dropped": dropped}})
+        frame = b"id: %s\nevent: reset\ndata: %s\n\n" % (self.event_id(seq).encode(), payload)
+        return seq, "reset", None, payload.decode(), frame
+
+    async def sse(self, subscription: Subscription) -> AsyncIterator[bytes]:
+        # Tells EventSource clients how long to wait before reconnecting
+        yield b"retry: 5000\n\n"
+        async for batch in self.batches(subscription):
+            yield batch.sse()
+
+    async def websocket_messages(self, subscription: Subscription) -> AsyncIterator[str]:
+        # One JSON array of events per message
+        async for batch in self.batches(subscription):
+            yield batch.message()
+
+    async def run(self) -> None:
+        # Wakes every connection at most once per interval, however many events were published
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._published:
+                self._published = False
+                wakeup, self._wakeup = self._wakeup, asyncio.Event()
+                wakeup.set()
+
+    async def run_counters(self) -> None:
+        while True:
+            await asyncio.sleep(self.counters_interval)
+            if self.counters is None or not self._subscriptions:
+                continue
+            try:
+                values = await self.counters()
+            except Exception:
+                logger.exception("Live feed counters failed")
+                continue
+            previous = self._last_counters
+            if values != previous:
+                self._last_counters = values
+                deltas = {
+                    name: value - previous.get(name, 0)
+                    for name, value in values.items() if previous is not None and isinstance(value, (int, float))
+                }
+                self.publish("counters", {"values": values, "deltas": deltas})
+
+    def stats(self) -> Dict[str, Any]:
+        subscriptions = list(self._subscriptions.values())
+        return {
+            "subscribers": len(subscriptions),
+            "anonymous_subscribers": sum(1 for s in subscriptions if s.organization_id is None),
+            "events": self.events,
+            "head": self._head - 1,
+            "capacity": self.capacity,
+            "max_lag": max((self._head - s.cursor for s in subscriptions), default=0),
+            "resets": self.resets,
+        }
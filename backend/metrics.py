@@ -0,0 +1,181 @@
+"""Prometheus instrumentation for the API.
+
+``MetricsMiddleware`` measures every HTTP request. It breaks the total time
+down into Mongo time, Mongo calls and documents returned (reported by
+``MongoCommandListener``) and JSON serialization time (reported by the
+orjson response path), and it also counts response bytes. Histograms are
+labeled by route template, HTTP method, OCPI module and the requesting
+party.
+
+Per-request numbers are collected in a ``RequestStats`` object held in a
+context variable. Motor runs pymongo in executor threads with a copy of the
+caller's context, so the listener finds the stats of the request that
+issued the command. Commands issued outside a request, from background
+tasks, are still counted per command name.
+
+With ``METRICS_ENABLED=false`` neither the middleware nor the listener is
+installed. The only remaining cost is one context variable lookup per
+serialized response.
+"""
+
+import time
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from pymongo import monitoring
+from starlette.responses import Response
+
+REGISTRY = CollectorRegistry()
+
+REQUEST_LABELS = ("route", "method", "module", "party")
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 5000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUESTS = Counter(
+    "ocpi_requests_total", "HTTP requests", REQUEST_LABELS + ("status",), registry=REGISTRY
+)
+REQUEST_SECONDS = Histogram(
+    "ocpi_request_duration_seconds", "Total request time", REQUEST_LABELS,
+    buckets=TIME_BUCKETS, registry=REGISTRY
+)
+MONGO_SECONDS = Histogram(
+    "ocpi_request_mongo_seconds", "Time spent in Mongo commands per request", REQUEST_LABELS,
+    buckets=TIME_BUCKETS, registry=REGISTRY
+)
+MONGO_CALLS = Histogram(
+    "ocpi_request_mongo_calls", "Mongo commands per request", REQUEST_LABELS,
+    buckets=COUNT_BUCKETS, registry=REGISTRY
+)
+DOCUMENTS = Histogram(
+    "ocpi_request_documents", "Documents returned by Mongo per request", REQUEST_LABELS,
+    buckets=COUNT_BUCKETS, registry=REGISTRY
+)
+SERIALIZATION_SECONDS = Histogram(
+    "ocpi_request_serialization_seconds", "JSON encoding time per request", REQUEST_LABELS,
+    buckets=TIME_BUCKETS, registry=REGISTRY
+)
+RESPONSE_BYTES = Histogram(
+    "ocpi_response_bytes", "Response body size", REQUEST_LABELS,
+    buckets=BYTE_BUCKETS, registry=REGISTRY
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    "ocpi_mongo_command_seconds", "Mongo command time, including background tasks", ("command",),
+    buckets=TIME_BUCKETS, registry=REGISTRY
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "ocpi_mongo_command_failures_total", "Failed Mongo commands", ("command",), registry=REGISTRY
+)
+
+
+class RequestStats:
+    __slots__ = ("party", "mongo", "serialization")
+
+    def __init__(self):
+        self.party = ""
+        # (seconds, documents) per command; list.append is atomic across executor threads
+        self.mongo: List[Tuple[float, int]] = []
+        self.serialization = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("ocpi_request_stats", default=None)
+
+
+def set_party(country_code: str, party_id: str) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.party = f"{country_code}*{party_id}"
+
+
+def detach_request() -> None:
+    """Stop attributing work to the request a background task was started from."""
+    _current.set(None)
+
+
+def record_serialization(seconds: float) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.serialization += seconds
+
+
+def _returned_documents(reply) -> int:
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    return 0
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.labels(event.command_name).observe(seconds)
+        stats = _current.get()
+        if stats is not None:
+            stats.mongo.append((seconds, _returned_documents(event.reply)))
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.labels(event.command_name).observe(seconds)
+        MONGO_COMMAND_FAILURES.labels(event.command_name).inc()
+        stats = _current.get()
+        if stats is not None:
+            stats.mongo.append((seconds, 0))
+
+
+def ocpi_module(route: str) -> str:
+    # /api/ocpi/2.3.0/{module}/... -> module; other API routes are hub-internal
+    parts = route.split("/")
+    if len(parts) > 4 and parts[2] == "ocpi":
+        return parts[4]
+    return "internal"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+        size = 0
+
+        async def send_and_measure(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners cannot explode cardinality
+            template = getattr(route, "path", None) or "unmatched"
+            labels = (template, scope["method"], ocpi_module(template), stats.party)
+            REQUESTS.labels(*labels, str(status)).inc()
+            REQUEST_SECONDS.labels(*labels).observe(elapsed)
+            MONGO_SECONDS.labels(*labels).observe(sum(s for s, _ in stats.mongo))
+            MONGO_CALLS.labels(*labels).observe(len(stats.mongo))
+            DOCUMENTS.labels(*labels).observe(sum(d for _, d in stats.mongo))
+            SERIALIZATION_SECONDS.labels(*labels).observe(stats.serialization)
+            RESPONSE_BYTES.labels(*labels).observe(size)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
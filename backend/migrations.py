@@ -0,0 +1,253 @@
+"""Versioned index bootstrap and schema migrations.
+
+Migrations are applied in version order and recorded in the
+``schema_migrations`` collection, so running them again is a no-op. They run
+on application startup unless ``RUN_MIGRATIONS_ON_STARTUP`` is disabled, in
+which case large deployments apply them as a separate step:
+
+    python migrations.py migrate
+    python migrations.py status
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+from pymongo import UpdateOne
+
+from archive import BATCHES_COLLECTION as ARCHIVE_BATCHES_COLLECTION
+from auth_cache import INVALIDATIONS_COLLECTION
+from commands import COMMANDS_COLLECTION, FINISHED_RETENTION
+from conditional import VERSIONED_COLLECTIONS, bump_version
+from geo import GEO_INDEX, location_search_fields
+from pagination import PAGINATION_INDEXES, SORT_ORDER
+from rate_limit import BUCKETS_COLLECTION
+from session_updates import PERIODS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Any, List[Dict[str, Any]]], Awaitable[None]]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    def register(apply):
+        MIGRATIONS.append(Migration(version, name, apply))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return apply
+    return register
+
+
+async def create_index(collection, keys, report: List[Dict[str, Any]], **kwargs) -> str:
+    """Create an index and record how long the build took."""
+    started = time.perf_counter()
+    name = await collection.create_index(keys, **kwargs)
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    report.append({"collection": collection.name, "index": name, "duration_ms": duration_ms})
+    logger.info("Index %s.%s ready in %.1f ms", collection.name, name, duration_ms)
+    return name
+
+
+@migration(1, "organization lookup indexes")
+async def organization_indexes(db, report):
+    # Every authenticated request looks organizations up by api_token; revoked
+    # organizations have no token, hence the partial filter.
+    await create_index(
+        db.organizations, "api_token", report,
+        unique=True, partialFilterExpression={"api_token": {"$type": "string"}}
+    )
+    # register_organization rejects duplicate country_code + party_id pairs
+    await create_index(db.organizations, [("country_code", 1), ("party_id", 1)], report, unique=True)
+    await create_index(db.organizations, "id", report, unique=True)
+    await create_index(db.partner_credentials, "organization_id", report)
+
+
+@migration(2, "list pagination indexes")
+async def pagination_indexes(db, report):
+    for collection, scopes in PAGINATION_INDEXES.items():
+        for scope in scopes:
+            keys = ([(scope, 1)] if scope else []) + SORT_ORDER
+            await create_index(db[collection], keys, report)
+
+
+@migration(3, "auth invalidation log expiry")
+async def auth_invalidation_expiry(db, report):
+    await create_index(db[INVALIDATIONS_COLLECTION], "created_at", report, expireAfterSeconds=3600)
+
+
+@migration(4, "location geo search fields")
+async def location_geo_search(db, report):
+    # Backfill the derived search fields for locations written before they existed
+    batch = []
+    async for location in db.locations.find({"geo": {"$exists": False}}, {"coordinates": 1, "evses": 1}):
+        batch.append(UpdateOne({"_id": location["_id"]}, {"$set": location_search_fields(location)}))
+        if len(batch) >= 1000:
+            await db.locations.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.locations.bulk_write(batch, ordered=False)
+    await create_index(db.locations, GEO_INDEX, report)
+
+
+@migration(5, "dashboard statistics indexes")
+async def dashboard_indexes(db, report):
+    await create_index(db.organizations, "role", report)
+    await create_index(db.sessions, "status", report)
+    await create_index(db.sessions, "start_date_time", report)
+
+
+@migration(6, "token authorization indexes")
+async def token_indexes(db, report):
+    # Tokens receiver upserts by the OCPI token key
+    await create_index(
+        db.tokens, [("country_code", 1), ("party_id", 1), ("uid", 1), ("type", 1)], report, unique=True
+    )
+    # Authorization requests without OCPI-to-* headers look tokens up by uid/type
+    await create_index(db.tokens, [("uid", 1), ("type", 1)], report)
+
+
+@migration(7, "receiver interface indexes")
+async def receiver_indexes(db, report):
+    # Locations and Sessions receivers upsert by the OCPI object key
+    await create_index(db.locations, [("country_code", 1), ("party_id", 1), ("id", 1)], report, unique=True)
+    await create_index(db.sessions, [("country_code", 1), ("party_id", 1), ("id", 1)], report, unique=True)
+    # Appends target the open bucket of a session; reads load buckets in insertion order
+    await create_index(db[PERIODS_COLLECTION], [("session_key", 1), ("count", 1)], report)
+    await create_index(db[PERIODS_COLLECTION], [("session_key", 1), ("_id", 1)], report)
+
+
+@migration(8, "CDR pipeline and CDR indexes")
+async def cdr_indexes(db, report):
+    # The CDR pipeline walks completed sessions in hub write order
+    await db.sessions.update_many(
+        {"hub_updated_at": {"$exists": False}}, [{"$set": {"hub_updated_at": "$last_updated"}}]
+    )
+    await create_index(db.sessions, [("status", 1), ("hub_updated_at", 1), ("_id", 1)], report)
+    await create_index(db.cdrs, [("country_code", 1), ("party_id", 1), ("id", 1)], report, unique=True)
+    for scope in (None, "location_owner_id", "emsp_id"):
+        await create_index(db.cdrs, ([(scope, 1)] if scope else []) + SORT_ORDER, report)
+
+
+@migration(9, "tariff indexes")
+async def tariff_indexes(db, report):
+    await create_index(db.tariffs, [("country_code", 1), ("party_id", 1), ("id", 1)], report, unique=True)
+    await create_index(db.tariffs, SORT_ORDER, report)
+
+
+@migration(10, "collection version counters")
+async def collection_versions(db, report):
+    # Collections written before versions were tracked get a Last-Modified from now on
+    for collection in VERSIONED_COLLECTIONS:
+        await bump_version(db, collection)
+
+
+@migration(11, "organization listing indexes")
+async def organization_listing_indexes(db, report):
+    # The organization listing is streamed and paged in _id order within its filters
+    await create_index(db.organizations, [("role", 1), ("_id", 1)], report)
+    await create_index(db.organizations, [("country_code", 1), ("role", 1), ("_id", 1)], report)
+
+
+@migration(12, "rate limit bucket expiry")
+async def rate_limit_bucket_expiry(db, report):
+    # Buckets of the shared store disappear once idle
+    await create_index(db[BUCKETS_COLLECTION], "expires_at", report, expireAfterSeconds=0)
+
+
+@migration(13, "command tracking indexes")
+async def command_indexes(db, report):
+    # Results are matched by command id; startup reloads the unfinished ones
+    await create_index(db[COMMANDS_COLLECTION], "id", report, unique=True)
+    await create_index(db[COMMANDS_COLLECTION], "status", report)
+
+
+@migration(14, "session archive indexes")
+async def session_archive_indexes(db, report):
+    # Each archiver run looks for batches a crash left unfinished
+    await create_index(db[ARCHIVE_BATCHES_COLLECTION], "state", report)
+
+
+@migration(15, "finished command expiry")
+async def finished_command_expiry(db, report):
+    # Delivered and undelivered commands are only kept for troubleshooting
+    await create_index(db[COMMANDS_COLLECTION], "finished_at", report, expireAfterSeconds=FINISHED_RETENTION)
+
+
+async def applied_versions(db) -> Dict[int, Dict[str, Any]]:
+    return {
+        doc["_id"]: doc
+        async for doc in db[MIGRATIONS_COLLECTION].find()
+    }
+
+
+async def run_migrations(db) -> List[Dict[str, Any]]:
+    """Apply all pending migrations and return what was applied."""
+    applied = await applied_versions(db)
+    results = []
+    for m in MIGRATIONS:
+        if m.version in applied:
+            continue
+        report: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+        await m.apply(db, report)
+        record = {
+            "_id": m.version,
+            "name": m.name,
+            "applied_at": datetime.now(timezone.utc),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "indexes": report,
+        }
+        # Upsert so concurrently starting workers do not trip over each other
+        await db[MIGRATIONS_COLLECTION].replace_one({"_id": m.version}, record, upsert=True)
+        logger.info("Applied migration %d (%s) in %.1f ms", m.version, m.name, record["duration_ms"])
+        results.append(record)
+    return results
+
+
+if __name__ == "__main__":
+    import typer
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    cli = typer.Typer(help="OCPI Hub index and schema migrations")
+
+    def get_db():
+        return AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+
+    @cli.command()
+    def migrate():
+        """Apply pending migrations."""
+        results = asyncio.run(run_migrations(get_db()))
+        if not results:
+            typer.echo("Database is up to date")
+        for record in results:
+            typer.echo(f"{record['_id']:>4}  {record['name']}  {record['duration_ms']} ms")
+            for index in record["indexes"]:
+                typer.echo(f"        {index['collection']}.{index['index']}  {index['duration_ms']} ms")
+
+    @cli.command()
+    def status():
+        """List migrations and whether they have been applied."""
+        applied = asyncio.run(applied_versions(get_db()))
+        for m in MIGRATIONS:
+            record = applied.get(m.version)
+            state = f"applied {record['applied_at']:%Y-%m-%d %H:%M:%S}" if record else "pending"
+            typer.echo(f"{m.version:>4}  {m.name:<40} {state}")
+
+    cli()
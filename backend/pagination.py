@@ -0,0 +1,113 @@
+"""OCPI list pagination helpers.
+
+Lists are ordered by ``(last_updated, _id)``. Legacy ``offset`` requests still
+work, but the ``Link`` header always points at the next page through an
+opaque keyset ``cursor`` so deep pages do not pay for ``skip()``.
+"""
+
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Request, Response
+
+SORT_ORDER = [("last_updated", 1), ("_id", 1)]
+
+# Compound indexes backing the keyset order, per collection and scope field.
+# They also serve date_from/date_to range filters on last_updated.
+PAGINATION_INDEXES = {
+    "locations": [None],
+    "sessions": [None, "location_owner_id", "emsp_id"],
+    "tokens": ["emsp_id"],
+}
+
+
+def encode_cursor(last_updated: datetime, object_id: ObjectId) -> str:
+    raw = f"{last_updated.isoformat()}|{object_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_updated, object_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(last_updated), ObjectId(object_id)
+    except (ValueError, InvalidId, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def encode_id_cursor(object_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(str(object_id).encode()).decode().rstrip("=")
+
+
+def decode_id_cursor(cursor: str) -> ObjectId:
+    """Cursor of collections paged in plain ``_id`` order, such as organizations."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return ObjectId(base64.urlsafe_b64decode(padded).decode())
+    except (ValueError, InvalidId, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def last_updated_filter(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """OCPI ``date_from`` (inclusive) / ``date_to`` (exclusive) on ``last_updated``."""
+    bounds = {}
+    if date_from is not None:
+        bounds["$gte"] = date_from
+    if date_to is not None:
+        bounds["$lt"] = date_to
+    return {"last_updated": bounds} if bounds else {}
+
+
+def cursor_filter(cursor: str) -> Dict[str, Any]:
+    last_updated, object_id = decode_cursor(cursor)
+    return {"$or": [
+        {"last_updated": {"$gt": last_updated}},
+        {"last_updated": last_updated, "_id": {"$gt": object_id}},
+    ]}
+
+
+async def paginate(
+    collection,
+    query: Dict[str, Any],
+    request: Request,
+    response: Response,
+    offset: int,
+    limit: int,
+    cursor: Optional[str],
+    max_limit: int,
+    projection: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Fetch one page of ``collection`` and set the OCPI pagination headers."""
+    limit = max(1, min(limit, max_limit))
+    page_query = {"$and": [query, cursor_filter(cursor)]} if cursor else query
+
+    find = collection.find(page_query, projection).sort(SORT_ORDER)
+    if not cursor and offset:
+        find = find.skip(offset)
+    # Fetch one extra document to know whether there is a next page
+    documents = await find.limit(limit + 1).to_list(limit + 1)
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+
+    if query:
+        total = await collection.count_documents(query)
+    else:
+        total = await collection.estimated_document_count()
+
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["X-Limit"] = str(max_limit)
+    if has_more:
+        last = documents[-1]
+        next_url = request.url.remove_query_params("offset").include_query_params(
+            cursor=encode_cursor(last["last_updated"], last["_id"]),
+            limit=limit,
+        )
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return documents
+
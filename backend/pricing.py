@@ -0,0 +1,460 @@
+"""Tariff pricing engine.
+
+Each OCPI tariff is compiled once into NumPy arrays (one row per tariff
+element: restriction bounds, and per dimension the price, VAT and step
+size) and kept in an LRU cache. Sessions are priced in batches: all their
+charging periods are flattened into arrays and matched against the compiled
+elements of their tariff with vectorized comparisons, following the OCPI
+rule that for every dimension the first element whose restrictions match
+and that has a price component for that dimension applies.
+
+Dimensions priced per period are ENERGY (kWh), TIME (charging hours) and
+PARKING_TIME (hours); FLAT is charged once per session, from the element
+matching the first period. Step sizes round the session total of a
+dimension up, at the price of the last period that used it. Restrictions on
+time of day, dates and weekdays are evaluated in the location's time zone,
+using its UTC offset at the start of the session.
+
+Command line usage (from the backend directory):
+
+    python pricing.py reprice 2024-01-31
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from conditional import bump_version
+from session_updates import attach_charging_periods, session_key
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ("ENERGY", "TIME", "PARKING_TIME")
+# OCPI step_size units (Wh, seconds, seconds) expressed in the volume units (kWh, hours, hours)
+STEP_UNITS = {"ENERGY": 1 / 1000, "TIME": 1 / 3600, "PARKING_TIME": 1 / 3600}
+WEEKDAYS = ("MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY")
+SECONDS_PER_DAY = 86400
+
+TariffKey = Tuple[str, str, str]
+
+
+@dataclass
+class CompiledTariff:
+    key: TariffKey
+    currency: str
+    # Restriction bounds per element; unrestricted bounds are -inf/inf
+    start_time: np.ndarray
+    end_time: np.ndarray
+    start_day: np.ndarray
+    end_day: np.ndarray
+    min_kwh: np.ndarray
+    max_kwh: np.ndarray
+    min_duration: np.ndarray
+    max_duration: np.ndarray
+    min_power: np.ndarray
+    max_power: np.ndarray
+    weekdays: np.ndarray
+    # Per dimension (including FLAT): price, VAT percentage and step size per element
+    price: Dict[str, np.ndarray]
+    vat: Dict[str, np.ndarray]
+    step: Dict[str, np.ndarray]
+    min_price: Optional[Dict[str, float]]
+    max_price: Optional[Dict[str, float]]
+
+
+def _seconds_of_day(value: Optional[str], default: float) -> float:
+    if not value:
+        return default
+    hours, minutes = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60
+
+
+def _day_number(value: Optional[str], default: float) -> float:
+    if not value:
+        return default
+    return float((date.fromisoformat(value[:10]) - date(1970, 1, 1)).days)
+
+
+def compile_tariff(tariff: Dict[str, Any]) -> CompiledTariff:
+    elements = tariff.get("elements") or []
+    n = len(elements)
+
+    def bounds(field, default, convert=float):
+        return np.array([
+            convert(r[field]) if (r := e.get("restrictions") or {}).get(field) is not None else default
+            for e in elements
+        ], dtype=float)
+
+    restrictions = [e.get("restrictions") or {} for e in elements]
+    price = {d: np.full(n, np.nan) for d in DIMENSIONS + ("FLAT",)}
+    vat = {d: np.zeros(n) for d in price}
+    step = {d: np.ones(n) for d in price}
+    for i, element in enumerate(elements):
+        for component in element.get("price_components") or []:
+            dimension = component["type"]
+            if dimension in price and np.isnan(price[dimension][i]):
+                price[dimension][i] = component["price"]
+                vat[dimension][i] = component.get("vat") or 0
+                step[dimension][i] = component.get("step_size") or 1
+
+    weekdays = np.array([
+        sum(1 << WEEKDAYS.index(d) for d in r["day_of_week"]) if r.get("day_of_week") else 0x7F
+        for r in restrictions
+    ], dtype=np.int64)
+
+    return CompiledTariff(
+        key=(tariff["country_code"], tariff["party_id"], tariff["id"]),
+        currency=tariff["currency"],
+        start_time=np.array([_seconds_of_day(r.get("start_time"), 0) for r in restrictions], dtype=float),
+        end_time=np.array([_seconds_of_day(r.get("end_time"), SECONDS_PER_DAY) for r in restrictions], dtype=float),
+        start_day=np.array([_day_number(r.get("start_date"), -np.inf) for r in restrictions]),
+        end_day=np.array([_day_number(r.get("end_date"), np.inf) for r in restrictions]),
+        min_kwh=bounds("min_kwh", -np.inf),
+        max_kwh=bounds("max_kwh", np.inf),
+        min_duration=bounds("min_duration", -np.inf),
+        max_duration=bounds("max_duration", np.inf),
+        min_power=bounds("min_power", -np.inf),
+        max_power=bounds("max_power", np.inf),
+        weekdays=weekdays,
+        price=price,
+        vat=vat,
+        step=step,
+        min_price=tariff.get("min_price"),
+        max_price=tariff.get("max_price"),
+    )
+
+
+class CompiledTariffCache:
+    """LRU cache of compiled tariffs, keyed by tariff key and last_updated."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[TariffKey, Tuple[Any, CompiledTariff]]" = OrderedDict()
+        self.compilations = 0
+
+    def get(self, tariff: Dict[str, Any]) -> CompiledTariff:
+        key = (tariff["country_code"], tariff["party_id"], tariff["id"])
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == tariff.get("last_updated"):
+            self._entries.move_to_end(key)
+            return entry[1]
+        compiled = compile_tariff(tariff)
+        self.compilations += 1
+        self._entries[key] = (tariff.get("last_updated"), compiled)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return compiled
+
+    def invalidate(self, key: TariffKey) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "compilations": self.compilations}
+
+
+def _to_utc_strings(values: List[Any]) -> List[Optional[str]]:
+    # Mongo returns naive UTC datetimes, OCPI payloads ISO strings
+    return [
+        (v if v.tzinfo else v.replace(tzinfo=timezone.utc)).isoformat() if isinstance(v, datetime) else v
+        for v in values
+    ]
+
+
+def _epoch_seconds(values: List[Any]) -> np.ndarray:
+    timestamps = pd.to_datetime(_to_utc_strings(values), utc=True, format="ISO8601")
+    return timestamps.as_unit("ms").asi8 / 1000.0
+
+
+@dataclass
+class PeriodBatch:
+    session: np.ndarray      # session index of every period
+    first: np.ndarray        # index of the first period of every session
+    local_start: np.ndarray  # local epoch seconds at period start
+    energy: np.ndarray       # kWh
+    time: np.ndarray         # charging hours
+    parking: np.ndarray      # parking hours
+    kwh_before: np.ndarray   # session kWh at period start
+    hours_before: np.ndarray # session duration (hours) at period start
+    power: np.ndarray        # average kW during the period
+
+
+def flatten_periods(sessions: List[Dict[str, Any]], utc_offsets: List[float]) -> PeriodBatch:
+    """Flatten charging periods of ``sessions`` (with an end) into arrays."""
+    session_index, starts, ends, energy, time_dim, parking = [], [], [], [], [], []
+    for s, session in enumerate(sessions):
+        periods = session.get("charging_periods") or [{"start_date_time": session["start_date_time"], "dimensions": [
+            {"type": "ENERGY", "volume": session.get("kwh") or 0}
+        ]}]
+        ends.append(session.get("end_date_time") or session.get("last_updated"))
+        for period in periods:
+            volumes = {d.get("type"): d.get("volume") or 0 for d in period.get("dimensions") or []}
+            session_index.append(s)
+            starts.append(period["start_date_time"])
+            energy.append(volumes.get("ENERGY", 0.0))
+            time_dim.append(volumes.get("TIME", np.nan))
+            parking.append(volumes.get("PARKING_TIME", 0.0))
+
+    session_arr = np.array(session_index, dtype=np.int64)
+    start = _epoch_seconds(starts)
+    # A period ends where the next one of the same session starts, the last one at the session end
+    last_of_session = np.r_[session_arr[1:] != session_arr[:-1], True]
+    stop = np.where(last_of_session, _epoch_seconds(ends)[session_arr], np.r_[start[1:], 0.0])
+    duration_h = np.maximum(stop - start, 0) / 3600
+    energy_arr = np.array(energy, dtype=float)
+    parking_arr = np.array(parking, dtype=float)
+    time_arr = np.array(time_dim, dtype=float)
+    # Without an explicit TIME dimension, charging time is the period minus parking
+    time_arr = np.where(np.isnan(time_arr), np.maximum(duration_h - parking_arr, 0), time_arr)
+
+    first = np.flatnonzero(np.r_[True, session_arr[1:] != session_arr[:-1]])
+    # Running totals restart at the first period of each session
+    cum_kwh = np.cumsum(energy_arr) - energy_arr
+    cum_hours = np.cumsum(duration_h) - duration_h
+    counts = np.diff(np.r_[first, len(session_arr)])
+    kwh_before = cum_kwh - np.repeat(cum_kwh[first], counts)
+    hours_before = cum_hours - np.repeat(cum_hours[first], counts)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        power = np.where(time_arr > 0, energy_arr / time_arr, 0.0)
+
+    return PeriodBatch(
+        session=session_arr,
+        first=first,
+        local_start=start + np.asarray(utc_offsets, dtype=float)[session_arr],
+        energy=energy_arr,
+        time=time_arr,
+        parking=parking_arr,
+        kwh_before=kwh_before,
+        hours_before=hours_before,
+        power=power,
+    )
+
+
+def match_elements(tariff: CompiledTariff, batch: PeriodBatch) -> np.ndarray:
+    """Boolean matrix (elements x periods) of elements whose restrictions hold."""
+    seconds = np.mod(batch.local_start, SECONDS_PER_DAY)[None, :]
+    day = np.floor(batch.local_start / SECONDS_PER_DAY)[None, :]
+    # 1970-01-01 was a Thursday (index 3)
+    weekday = ((day + 3) % 7).astype(np.int64)
+
+    start, end = tariff.start_time[:, None], tariff.end_time[:, None]
+    in_window = np.where(start <= end, (seconds >= start) & (seconds < end), (seconds >= start) | (seconds < end))
+    return (
+        in_window
+        & (day >= tariff.start_day[:, None]) & (day < tariff.end_day[:, None])
+        & (((tariff.weekdays[:, None] >> weekday) & 1) == 1)
+        & (batch.kwh_before[None, :] >= tariff.min_kwh[:, None])
+        & (batch.kwh_before[None, :] < tariff.max_kwh[:, None])
+        & (batch.hours_before[None, :] * 3600 >= tariff.min_duration[:, None])
+        & (batch.hours_before[None, :] * 3600 < tariff.max_duration[:, None])
+        & (batch.power[None, :] >= tariff.min_power[:, None])
+        & (batch.power[None, :] < tariff.max_power[:, None])
+    )
+
+
+def price_batch(tariff: CompiledTariff, sessions: List[Dict[str, Any]], utc_offsets: List[float]) -> List[Dict[str, float]]:
+    """Total cost of every session in ``sessions`` under ``tariff``."""
+    n_sessions = len(sessions)
+    if n_sessions == 0:
+        return []
+    batch = flatten_periods(sessions, utc_offsets)
+    matches = match_elements(tariff, batch)
+    excl = np.zeros(n_sessions)
+    incl = np.zeros(n_sessions)
+
+    volumes = {"ENERGY": batch.energy, "TIME": batch.time, "PARKING_TIME": batch.parking}
+    for dimension, volume in volumes.items():
+        applicable = matches & ~np.isnan(tariff.price[dimension])[:, None]
+        found = applicable.any(axis=0)
+        if not found.any():
+            continue
+        element = applicable.argmax(axis=0)
+        price = np.where(found, tariff.price[dimension][element], 0.0)
+        vat = np.where(found, tariff.vat[dimension][element], 0.0)
+        billed = np.where(found, volume, 0.0)
+
+        # Round each session's billed volume up to the step size of its last priced period
+        totals = np.bincount(batch.session, weights=billed, minlength=n_sessions)
+        last = np.full(n_sessions, -1)
+        found_idx = np.flatnonzero(found)
+        np.maximum.at(last, batch.session[found_idx], found_idx)
+        has_last = last >= 0
+        step = np.ones(n_sessions)
+        step[has_last] = tariff.step[dimension][element[last[has_last]]] * STEP_UNITS[dimension]
+        rounded = np.ceil(np.round(totals / step, 9)) * step
+        extra = np.where(has_last, rounded - totals, 0.0)
+        last_price = np.where(has_last, price[np.maximum(last, 0)], 0.0)
+        last_vat = np.where(has_last, vat[np.maximum(last, 0)], 0.0)
+
+        cost = billed * price
+        excl += np.bincount(batch.session, weights=cost, minlength=n_sessions) + extra * last_price
+        incl += (
+            np.bincount(batch.session, weights=cost * (1 + vat / 100), minlength=n_sessions)
+            + extra * last_price * (1 + last_vat / 100)
+        )
+
+    flat = matches[:, batch.first] & ~np.isnan(tariff.price["FLAT"])[:, None]
+    has_flat = flat.any(axis=0)
+    flat_element = flat.argmax(axis=0)
+    flat_price = np.where(has_flat, tariff.price["FLAT"][flat_element], 0.0)
+    excl += flat_price
+    incl += flat_price * (1 + np.where(has_flat, tariff.vat["FLAT"][flat_element], 0.0) / 100)
+
+    if tariff.min_price:
+        excl = np.maximum(excl, tariff.min_price.get("excl_vat", 0))
+        incl = np.maximum(incl, tariff.min_price.get("incl_vat", tariff.min_price.get("excl_vat", 0)))
+    if tariff.max_price:
+        excl = np.minimum(excl, tariff.max_price.get("excl_vat", np.inf))
+        incl = np.minimum(incl, tariff.max_price.get("incl_vat", np.inf))
+
+    return [
+        {"excl_vat": round(float(e), 4), "incl_vat": round(float(i), 4)}
+        for e, i in zip(excl, incl)
+    ]
+
+
+def utc_offset_seconds(time_zone: Optional[str], at: Any) -> float:
+    """UTC offset of ``time_zone`` at ``at``; 0 for unknown zones."""
+    try:
+        zone = ZoneInfo(time_zone) if time_zone else None
+    except (ZoneInfoNotFoundError, ValueError):
+        zone = None
+    if zone is None:
+        return 0.0
+    moment = at if isinstance(at, datetime) else datetime.fromisoformat(str(at))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(zone).utcoffset().total_seconds()
+
+
+class PricingEngine:
+    def __init__(self, db, cache: Optional[CompiledTariffCache] = None):
+        self.db = db
+        self.cache = cache or CompiledTariffCache()
+
+    async def price_sessions(self, sessions: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """total_cost per session key, for sessions whose connector has a known tariff.
+
+        ``sessions`` must already carry their charging periods.
+        """
+        location_keys = {(s["country_code"], s["party_id"], s["location_id"]) for s in sessions}
+        locations = {
+            (loc["country_code"], loc["party_id"], loc["id"]): loc
+            async for loc in self.db.locations.find(
+                {"$or": [{"country_code": c, "party_id": p, "id": i} for c, p, i in location_keys]},
+                {"_id": 0, "country_code": 1, "party_id": 1, "id": 1, "time_zone": 1,
+                 "evses.uid": 1, "evses.connectors.id": 1, "evses.connectors.tariff_ids": 1}
+            )
+        } if location_keys else {}
+
+        # Group sessions by the first tariff of their connector
+        groups: Dict[TariffKey, List[Tuple[Dict[str, Any], float]]] = {}
+        for session in sessions:
+            location = locations.get((session["country_code"], session["party_id"], session["location_id"]))
+            if not location:
+                continue
+            connector = next((
+                c for e in location.get("evses") or [] if e.get("uid") == session["evse_uid"]
+                for c in e.get("connectors") or [] if c.get("id") == session["connector_id"]
+            ), None)
+            if not connector or not connector.get("tariff_ids"):
+                continue
+            key = (session["country_code"], session["party_id"], connector["tariff_ids"][0])
+            offset = utc_offset_seconds(location.get("time_zone"), session["start_date_time"])
+            groups.setdefault(key, []).append((session, offset))
+
+        tariffs = {
+            (t["country_code"], t["party_id"], t["id"]): t
+            async for t in self.db.tariffs.find(
+                {"$or": [{"country_code": c, "party_id": p, "id": i} for c, p, i in groups]}, {"_id": 0}
+            )
+        } if groups else {}
+
+        prices: Dict[str, Dict[str, Any]] = {}
+        for key, members in groups.items():
+            tariff = tariffs.get(key)
+            if not tariff:
+                continue
+            compiled = self.cache.get(tariff)
+            group_sessions = [s for s, _ in members]
+            costs = price_batch(compiled, group_sessions, [o for _, o in members])
+            for session, cost in zip(group_sessions, costs):
+                prices[session_key(session["country_code"], session["party_id"], session["id"])] = cost
+        return prices
+
+    async def reprice_day(self, day: date, batch_size: int = 5000) -> Dict[str, Any]:
+        """Recompute total_cost of every session started on ``day`` (UTC).
+
+        Costs the CPO sent are kept; only unpriced sessions and those priced by
+        the hub are repriced. Repriced sessions get a new ``hub_updated_at``, so
+        the CDR pipeline regenerates their CDRs.
+        """
+        started = time.perf_counter()
+        start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        query = {
+            "start_date_time": {"$gte": start, "$lt": start + timedelta(days=1)},
+            "$or": [{"total_cost": None}, {"total_cost_source": "TARIFF"}],
+        }
+        processed = priced = 0
+        cursor = self.db.sessions.find(query).batch_size(batch_size)
+        batch = []
+
+        async def flush(sessions):
+            await attach_charging_periods(self.db, sessions)
+            prices = await self.price_sessions(sessions)
+            now = datetime.now(timezone.utc)
+            operations = []
+            for s in sessions:
+                key = session_key(s["country_code"], s["party_id"], s["id"])
+                if key in prices:
+                    operations.append(UpdateOne(
+                        # Not if the CPO sent a cost meanwhile
+                        {"_id": s["_id"], "$or": [{"total_cost": None}, {"total_cost_source": "TARIFF"}]},
+                        {"$set": {"total_cost": prices[key], "total_cost_source": "TARIFF", "hub_updated_at": now}}
+                    ))
+            if operations:
+                await self.db.sessions.bulk_write(operations, ordered=False)
+                await bump_version(self.db, "sessions")
+            return len(operations)
+
+        async for session in cursor:
+            batch.append(session)
+            if len(batch) >= batch_size:
+                priced += await flush(batch)
+                processed += len(batch)
+                batch = []
+        if batch:
+            priced += await flush(batch)
+            processed += len(batch)
+        return {
+            "day": day.isoformat(),
+            "sessions": processed,
+            "priced": priced,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+
+if __name__ == "__main__":
+    import typer
+
+    cli = typer.Typer(help="OCPI Hub tariff pricing")
+
+    @cli.command()
+    def reprice(day: str = typer.Argument(..., help="UTC day, YYYY-MM-DD")):
+        """Recompute total_cost for all sessions started on a day."""
+        import server
+
+        result = asyncio.run(PricingEngine(server.db).reprice_day(date.fromisoformat(day)))
+        typer.echo(result)
+
+    cli()
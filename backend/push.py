@@ -0,0 +1,414 @@
+"""Push fan-out of OCPI object changes to connected partners.
+
+Changes accepted by the receiver interfaces (locations, EVSEs, connectors,
+sessions, tokens) are pushed to the partners that registered credentials
+through ``POST /credentials``. The credentials ``url`` is used as the base of
+the partner's OCPI module endpoints, e.g. ``{url}/locations/{cc}/{pid}/{id}``.
+
+Every partner has its own channel: a bounded queue, a keep-alive
+``httpx.AsyncClient`` whose connection pool caps the requests in flight, and
+a worker that drains the queue in batches. Within a batch, consecutive
+changes to the same object are merged and changes to different objects are
+sent concurrently, while changes to one EVSE, session or token keep their
+order. Failed requests, including HTTP 2xx answers whose OCPI ``status_code``
+is not 1xxx, are retried with exponential backoff; requests that
+keep failing, are rejected by the partner, or do not fit in a full queue are
+stored in ``push_dead_letters``; the latter are written in the background, so
+publishing never waits on Mongo. Channels share nothing, so a slow or
+unreachable partner only ever delays its own deliveries.
+
+Credentials may be registered through any worker, so every worker reloads
+them periodically and opens, or reopens, the channels that changed.
+"""
+
+import asyncio
+import base64
+import logging
+import random
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import httpx
+import orjson
+
+from metrics import detach_request
+from serialization import ORJSON_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTERS_COLLECTION = "push_dead_letters"
+# Dead-letter writes of overflowing events in flight per channel; beyond it they are only logged
+MAX_PENDING_DEAD_LETTERS = 1000
+
+
+@dataclass
+class PushEvent:
+    module: str
+    method: str  # PUT or PATCH
+    path: str    # relative to the module, e.g. "TR/CPO/LOC1/EVSE1"
+    body: Dict[str, Any]
+    # Party the change originates from (OCPI-from-* headers)
+    from_country_code: str
+    from_party_id: str
+    query: Optional[Dict[str, str]] = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @property
+    def object_key(self) -> str:
+        # Changes to an EVSE and its connectors share a key, so they keep their order
+        return f"{self.module}/{'/'.join(self.path.split('/')[:4])}"
+
+    @property
+    def is_barrier(self) -> bool:
+        # A location PUT/PATCH may carry all EVSEs, so it is ordered against everything
+        return self.module == "locations" and self.path.count("/") == 2
+
+
+def merge_events(events: List[PushEvent]) -> "OrderedDict[str, List[PushEvent]]":
+    """Group events per object, merging consecutive changes to the same path."""
+    groups: "OrderedDict[str, List[PushEvent]]" = OrderedDict()
+    for event in events:
+        group = groups.setdefault(event.object_key, [])
+        previous = group[-1] if group else None
+        if previous is None or previous.path != event.path or previous.query != event.query:
+            group.append(event)
+        elif event.method == "PUT":
+            group[-1] = event
+        else:
+            body = dict(previous.body)
+            for key, value in event.body.items():
+                if key == "charging_periods" and event.module == "sessions":
+                    # Periods in a session PATCH are appended to the ones already sent
+                    body[key] = (body.get(key) or []) + value
+                else:
+                    body[key] = value
+            group[-1] = PushEvent(
+                previous.module, previous.method, previous.path, body,
+                previous.from_country_code, previous.from_party_id, previous.query, previous.created_at
+            )
+    return groups
+
+
+def plan_batch(events: List[PushEvent]) -> List["OrderedDict[str, List[PushEvent]]"]:
+    """Split a batch into steps sent one after the other.
+
+    Groups within a step go out concurrently. Location-level changes get steps
+    of their own so they never overtake, or get overtaken by, EVSE changes.
+    """
+    steps, current, current_barrier = [], [], None
+    for event in events:
+        barrier = event.path if event.is_barrier else None
+        if current and barrier != current_barrier:
+            steps.append(merge_events(current))
+            current = []
+        current.append(event)
+        current_barrier = barrier
+    if current:
+        steps.append(merge_events(current))
+    return steps
+
+
+class PushRejected(Exception):
+    """The partner answered with an error that retrying will not fix."""
+
+
+class PushRetry(Exception):
+    """The partner answered with a temporary error."""
+
+
+class PartnerChannel:
+    def __init__(
+        self,
+        db,
+        organization: Dict[str, Any],
+        url: str,
+        token: str,
+        concurrency: int = 8,
+        batch_size: int = 100,
+        queue_size: int = 10000,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        timeout: float = 10.0,
+    ):
+        self.db = db
+        self.organization_id = organization["id"]
+        self.role = organization["role"]
+        self.country_code = organization["country_code"]
+        self.party_id = organization["party_id"]
+        self.url = url.rstrip("/")
+        self.token = token
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.concurrency = concurrency
+        self.queue: "asyncio.Queue[PushEvent]" = asyncio.Queue(maxsize=queue_size)
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            headers={"Authorization": f"Token {base64.b64encode(token.encode()).decode()}"},
+        )
+        self._slots = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+        self._dead_letter_tasks: Set[asyncio.Task] = set()
+        self.sent = 0
+        self.merged = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.dropped = 0
+        self.in_flight = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._dead_letter_tasks:
+            await asyncio.gather(*self._dead_letter_tasks, return_exceptions=True)
+        await self.client.aclose()
+
+    def offer(self, event: PushEvent) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            pass
+        # Called on the request path: store the overflow without waiting for it
+        if len(self._dead_letter_tasks) >= MAX_PENDING_DEAD_LETTERS:
+            self.dropped += 1
+            logger.error("Dropped push to %s: queue and dead-letter backlog are full", self.organization_id)
+            return False
+        task = asyncio.create_task(self.dead_letter(event, "queue full", 0))
+        self._dead_letter_tasks.add(task)
+        task.add_done_callback(self._dead_letter_tasks.discard)
+        return False
+
+    async def run(self) -> None:
+        # Channels opened by POST /credentials outlive that request
+        detach_request()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            steps = plan_batch(batch)
+            self.merged += len(batch) - sum(len(g) for step in steps for g in step.values())
+            try:
+                for groups in steps:
+                    await asyncio.gather(*(self.deliver_group(group) for group in groups.values()))
+            except Exception:
+                logger.exception("Push batch to %s failed", self.organization_id)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def deliver_group(self, events: List[PushEvent]) -> None:
+        # Changes to one object go out in order; each one holds a connection slot
+        for event in events:
+            async with self._slots:
+                await self.deliver(event)
+
+    async def deliver(self, event: PushEvent) -> None:
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.send(event)
+                self.sent += 1
+                return
+            except PushRejected as e:
+                await self.dead_letter(event, str(e), attempt)
+                return
+            except (httpx.HTTPError, PushRetry) as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.max_attempts:
+                self.retries += 1
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, self.base_delay * 2 ** (attempt - 1)))
+        await self.dead_letter(event, error, self.max_attempts)
+
+    async def send(self, event: PushEvent) -> None:
+        request_id = str(uuid.uuid4())
+        self.in_flight += 1
+        try:
+            response = await self.client.request(
+                event.method,
+                f"{self.url}/{event.module}/{event.path}",
+                params=event.query,
+                content=orjson.dumps(event.body, option=ORJSON_OPTIONS),
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Request-ID": request_id,
+                    "X-Correlation-ID": request_id,
+                    "OCPI-from-country-code": event.from_country_code,
+                    "OCPI-from-party-id": event.from_party_id,
+                    "OCPI-to-country-code": self.country_code,
+                    "OCPI-to-party-id": self.party_id,
+                },
+            )
+        finally:
+            self.in_flight -= 1
+        if response.status_code == 429 or response.status_code >= 500:
+            raise PushRetry(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise PushRejected(f"HTTP {response.status_code}: {response.text[:200]}")
+        # OCPI reports errors in the envelope of an HTTP 200 too; only 1xxx means success
+        try:
+            envelope = response.json()
+        except ValueError:
+            return
+        status_code = envelope.get("status_code") if isinstance(envelope, dict) else None
+        if isinstance(status_code, int) and not 1000 <= status_code < 2000:
+            raise PushRetry(f"OCPI status_code {status_code}: {str(envelope.get('status_message'))[:200]}")
+
+    async def dead_letter(self, event: PushEvent, error: Optional[str], attempts: int) -> None:
+        self.dead_lettered += 1
+        try:
+            await self.db[DEAD_LETTERS_COLLECTION].insert_one({
+                "organization_id": self.organization_id,
+                "module": event.module,
+                "method": event.method,
+                "path": event.path,
+                "query": event.query,
+                "body": event.body,
+                "from_country_code": event.from_country_code,
+                "from_party_id": event.from_party_id,
+                "error": error,
+                "attempts": attempts,
+                "event_created_at": event.created_at,
+                "created_at": datetime.now(timezone.utc),
+            })
+        except Exception:
+            logger.exception("Could not store dead letter for %s", self.organization_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "organization_id": self.organization_id,
+            "role": self.role,
+            "url": self.url,
+            "queued": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "merged": self.merged,
+            "retries": self.retries,
+            "dead_lettered": self.dead_lettered,
+            "dropped": self.dropped,
+        }
+
+
+class PushDispatcher:
+    def __init__(self, db, **channel_options):
+        self.db = db
+        self.channel_options = channel_options
+        self.channels: Dict[str, PartnerChannel] = {}
+        self.started = False
+
+    async def load(self) -> None:
+        """Open a channel for every organization whose stored partner credentials changed."""
+        latest: Dict[str, Dict[str, Any]] = {}
+        async for doc in self.db.partner_credentials.find({}, {"_id": 0}).sort("created_at", 1):
+            latest[doc["organization_id"]] = doc["credentials"]
+        organizations = self.db.organizations.find(
+            {"id": {"$in": list(latest)}}, {"_id": 0, "id": 1, "role": 1, "country_code": 1, "party_id": 1}
+        )
+        async for organization in organizations:
+            credentials = latest[organization["id"]]
+            channel = self.channels.get(organization["id"])
+            if channel is not None and (channel.url, channel.token) == (credentials["url"].rstrip("/"), credentials["token"]):
+                continue
+            await self.register(organization, credentials)
+
+    async def run(self, interval: float = 30.0) -> None:
+        # Picks up credentials registered through other workers
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Push channel reload failed")
+
+    async def register(self, organization: Dict[str, Any], credentials: Dict[str, Any]) -> None:
+        """(Re)open the channel of a partner after its credentials changed."""
+        channel = PartnerChannel(self.db, organization, credentials["url"], credentials["token"], **self.channel_options)
+        previous = self.channels.pop(organization["id"], None)
+        if previous is not None:
+            await previous.close()
+            # Undelivered changes follow the partner to its new endpoint
+            while not previous.queue.empty():
+                channel.offer(previous.queue.get_nowait())
+        self.channels[organization["id"]] = channel
+        if self.started:
+            channel.start()
+
+    def start(self) -> None:
+        self.started = True
+        for channel in self.channels.values():
+            channel.start()
+
+    async def close(self) -> None:
+        self.started = False
+        await asyncio.gather(*(channel.close() for channel in self.channels.values()))
+        self.channels.clear()
+
+    async def publish(
+        self,
+        event: PushEvent,
+        roles: Iterable[str] = (),
+        organization_ids: Iterable[Optional[str]] = (),
+    ) -> int:
+        """Queue ``event`` for partners with one of ``roles`` or one of ``organization_ids``.
+
+        Never waits on delivery; returns the number of channels it was queued on.
+        """
+        if not self.started:
+            return 0
+        roles, organization_ids = set(roles), set(organization_ids)
+        queued = 0
+        for channel in list(self.channels.values()):
+            if channel.role in roles or channel.organization_id in organization_ids:
+                queued += channel.offer(event)
+        return queued
+
+    async def replay_dead_letters(self, organization_id: str, limit: int = 1000) -> int:
+        channel = self.channels.get(organization_id)
+        if channel is None:
+            return 0
+        letters = await self.db[DEAD_LETTERS_COLLECTION].find(
+            {"organization_id": organization_id}
+        ).sort("created_at", 1).limit(limit).to_list(limit)
+        replayed = []
+        for letter in letters:
+            event = PushEvent(
+                letter["module"], letter["method"], letter["path"], letter["body"],
+                letter["from_country_code"], letter["from_party_id"], letter.get("query"),
+                letter["event_created_at"]
+            )
+            try:
+                channel.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                break
+            replayed.append(letter["_id"])
+        if replayed:
+            await self.db[DEAD_LETTERS_COLLECTION].delete_many({"_id": {"$in": replayed}})
+        return len(replayed)
+
+    async def drain(self) -> None:
+        """Wait until every queued event has been delivered or dead-lettered."""
+        await asyncio.gather(*(channel.queue.join() for channel in self.channels.values()))
+
+    def stats(self) -> Dict[str, Any]:
+        channels = [channel.stats() for channel in self.channels.values()]
+        return {
+            "partners": len(channels),
+            "queued": sum(c["queued"] for c in channels),
+            "sent": sum(c["sent"] for c in channels),
+            "dead_lettered": sum(c["dead_lettered"] for c in channels),
+            "channels": channels,
+        }
@@ -0,0 +1,167 @@
+"""Per-organization, per-module rate limiting with token buckets.
+
+Every organization gets one bucket per OCPI module and access kind (reads
+are GET/HEAD, everything else is a write). A bucket holds up to ``burst``
+tokens and refills at ``rate`` tokens per second; each request takes one.
+An empty bucket answers 429 with the time until the next token in
+``Retry-After``.
+
+Limits are configured as ``module[.read|.write]=rate/burst`` pairs, e.g.
+``default=20/40,sessions.read=5/10,tokens.write=200/400``. The most specific
+entry wins: ``module.kind``, then ``module``, then ``default``.
+
+Buckets live in a store:
+
+* ``MemoryBucketStore``: in-process and free, but every worker enforces
+  the limit on its own, so N workers allow N times the rate;
+* ``MongoBucketStore``: one shared bucket document per key, refilled and
+  taken in a single atomic pipeline update (MongoDB 4.2+). It costs one
+  round-trip per request.
+
+If the store fails, the request is allowed: the limiter protects Mongo, and
+it must not take the hub down with it.
+"""
+
+import logging
+import math
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_COLLECTION = "rate_limit_buckets"
+DEFAULT_LIMITS = "default=20/40,locations.write=200/400,sessions.write=200/400,tokens=200/400"
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    rate: float
+    burst: float
+
+
+class RateLimited(Exception):
+    def __init__(self, module: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {module}")
+        self.module = module
+        self.retry_after = retry_after
+
+
+def parse_limits(spec: str) -> Dict[str, RateLimit]:
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            name, value = entry.split("=")
+            rate, burst = value.split("/")
+            limits[name.strip()] = RateLimit(float(rate), float(burst))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit '{entry}', expected module=rate/burst")
+    return limits
+
+
+class MemoryBucketStore:
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        # key -> (tokens, monotonic time of the last update)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, limit: RateLimit) -> Tuple[bool, float]:
+        """Take a token; returns (allowed, seconds until a token is available)."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        # Least recently used buckets go first; an evicted bucket simply starts full again
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / limit.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class MongoBucketStore:
+    def __init__(self, db, idle_expiry: float = 3600.0):
+        self.collection = db[BUCKETS_COLLECTION]
+        self.idle_expiry = idle_expiry
+
+    async def take(self, key: str, limit: RateLimit) -> Tuple[bool, float]:
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": {"$min": [
+                    limit.burst,
+                    {"$add": [{"$ifNull": ["$tokens", limit.burst]}, {"$multiply": [elapsed, limit.rate]}]},
+                ]}}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "updated_at": "$$NOW",
+                    # Cleaned up by a TTL index once idle
+                    "expires_at": {"$add": ["$$NOW", int(self.idle_expiry * 1000)]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (1 - bucket["tokens"]) / limit.rate
+
+
+class RateLimiter:
+    def __init__(self, store, limits: Dict[str, RateLimit]):
+        self.store = store
+        self.limits = limits
+        self.allowed = 0
+        self.store_errors = 0
+        # (party, module.kind) -> throttled requests
+        self.throttled: Counter = Counter()
+
+    def limit_for(self, module: str, kind: str) -> Optional[RateLimit]:
+        return self.limits.get(f"{module}.{kind}") or self.limits.get(module) or self.limits.get("default")
+
+    async def check(self, organization_id: str, party: str, module: str, method: str) -> None:
+        """Take a token for the request or raise ``RateLimited``."""
+        kind = "read" if method in ("GET", "HEAD") else "write"
+        limit = self.limit_for(module, kind)
+        if limit is None:
+            return
+        try:
+            allowed, retry_after = await self.store.take(f"{organization_id}:{module}.{kind}", limit)
+        except Exception:
+            self.store_errors += 1
+            logger.exception("Rate limit store failed; allowing the request")
+            return
+        if allowed:
+            self.allowed += 1
+            return
+        self.throttled[(party, f"{module}.{kind}")] += 1
+        raise RateLimited(module, retry_after)
+
+    def stats(self, top: int = 20) -> Dict[str, Any]:
+        return {
+            "store": type(self.store).__name__,
+            # Shared buckets are not counted per worker
+            "buckets": len(self.store) if isinstance(self.store, MemoryBucketStore) else None,
+            "limits": {name: {"rate": limit.rate, "burst": limit.burst} for name, limit in self.limits.items()},
+            "allowed": self.allowed,
+            "throttled": sum(self.throttled.values()),
+            "store_errors": self.store_errors,
+            "top_throttled": [
+                {"party": party, "module": module, "requests": count}
+                for (party, module), count in self.throttled.most_common(top)
+            ],
+        }
+
+
+def retry_after_header(retry_after: float) -> str:
+    # Retry-After takes whole seconds; never tell a client to retry immediately
+    return str(max(1, math.ceil(retry_after)))
@@ -0,0 +1,241 @@
+"""OCPI hub message routing.
+
+Parties reach each other through the hub: a request sent to
+``/api/ocpi/2.3.0/hub/{module}/{path}`` carrying ``OCPI-to-country-code`` and
+``OCPI-to-party-id`` is forwarded to ``{url}/{module}/{path}``, where ``url``
+comes from the credentials the receiving party registered through
+``POST /credentials``. The hub replaces the sender's Authorization header
+with the receiver's token. It also sets the ``OCPI-from-*`` headers from the
+authenticated organization, so senders cannot spoof them.
+
+The routing table maps ``(country_code, party_id)`` to the latest
+credentials and lives in memory. ``POST /credentials`` updates it in place,
+and a periodic reload picks up registrations made on other workers.
+
+Unicast requests are streamed in both directions: the request body goes
+upstream as it arrives and the response body comes back as raw bytes, so
+neither is buffered or parsed. Every receiver gets its own pooled
+``httpx.AsyncClient``, so one slow party cannot starve the connections to
+the others. Write requests without ``OCPI-to-*`` headers are broadcast to
+every connected party except the sender. Their body is read once, and the
+response lists the outcome per receiver.
+"""
+
+import asyncio
+import base64
+import logging
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Hop-by-hop headers (RFC 9110) and headers the hub sets itself
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "host",
+}
+REQUEST_OVERRIDES = {
+    "authorization", "ocpi-from-country-code", "ocpi-from-party-id", "ocpi-to-country-code", "ocpi-to-party-id",
+}
+
+
+@dataclass(frozen=True)
+class Route:
+    organization_id: str
+    country_code: str
+    party_id: str
+    role: str
+    url: str
+    token: str
+
+
+class UnknownReceiver(Exception):
+    pass
+
+
+def make_route(organization: Dict[str, Any], credentials: Dict[str, Any]) -> Route:
+    return Route(
+        organization["id"], organization["country_code"].upper(), organization["party_id"].upper(),
+        organization["role"], credentials["url"].rstrip("/"), credentials["token"]
+    )
+
+
+class RoutingTable:
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], Route] = {}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def update(self, organization: Dict[str, Any], credentials: Dict[str, Any]) -> Route:
+        route = make_route(organization, credentials)
+        self._routes[(route.country_code, route.party_id)] = route
+        return route
+
+    def resolve(self, country_code: str, party_id: str) -> Route:
+        route = self._routes.get((country_code.upper(), party_id.upper()))
+        if route is None:
+            raise UnknownReceiver(f"{country_code}*{party_id} is not connected to the hub")
+        return route
+
+    def routes(self) -> Iterable[Route]:
+        return list(self._routes.values())
+
+    async def load(self, db) -> None:
+        """Rebuild the table from the latest credentials of every organization."""
+        latest: Dict[str, Dict[str, Any]] = {}
+        async for doc in db.partner_credentials.find({}, {"_id": 0}).sort("created_at", 1):
+            latest[doc["organization_id"]] = doc["credentials"]
+        routes: Dict[Tuple[str, str], Route] = {}
+        organizations = db.organizations.find(
+            {"id": {"$in": list(latest)}}, {"_id": 0, "id": 1, "role": 1, "country_code": 1, "party_id": 1}
+        )
+        async for organization in organizations:
+            route = make_route(organization, latest[organization["id"]])
+            routes[(route.country_code, route.party_id)] = route
+        # Swap in one step so lookups never see a half-built table
+        self._routes = routes
+
+
+class HubRouter:
+    def __init__(self, db, connections: int = 32, timeout: float = 30.0):
+        self.db = db
+        self.table = RoutingTable()
+        self.connections = connections
+        self.timeout = timeout
+        # organization id -> (route the client was built for, client)
+        self._clients: Dict[str, Tuple[Route, httpx.AsyncClient]] = {}
+        self.forwarded = 0
+        self.broadcasts = 0
+        self.upstream_errors = 0
+
+    def client_for(self, route: Route) -> httpx.AsyncClient:
+        current = self._clients.get(route.organization_id)
+        if current is not None and current[0] == route:
+            return current[1]
+        client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.connections, max_keepalive_connections=self.connections),
+        )
+        self._clients[route.organization_id] = (route, client)
+        if current is not None:
+            # Credentials changed; requests still streaming through the old client finish first
+            asyncio.create_task(self._close_later(current[1]))
+        return client
+
+    async def _close_later(self, client: httpx.AsyncClient) -> None:
+        await asyncio.sleep(self.timeout)
+        await client.aclose()
+
+    def build_headers(self, headers: Iterable[Tuple[str, str]], route: Route, sender) -> Dict[str, str]:
+        forwarded = {
+            name: value for name, value in headers
+            if name.lower() not in HOP_BY_HOP and name.lower() not in REQUEST_OVERRIDES
+        }
+        forwarded["Authorization"] = f"Token {base64.b64encode(route.token.encode()).decode()}"
+        forwarded["OCPI-from-country-code"] = sender.country_code
+        forwarded["OCPI-from-party-id"] = sender.party_id
+        forwarded["OCPI-to-country-code"] = route.country_code
+        forwarded["OCPI-to-party-id"] = route.party_id
+        request_id = next((v for k, v in forwarded.items() if k.lower() == "x-request-id"), None)
+        if request_id is None:
+            request_id = forwarded["X-Request-ID"] = str(uuid.uuid4())
+        if not any(k.lower() == "x-correlation-id" for k in forwarded):
+            forwarded["X-Correlation-ID"] = request_id
+        return forwarded
+
+    async def forward(
+        self,
+        route: Route,
+        method: str,
+        path: str,
+        query: bytes,
+        headers: Iterable[Tuple[str, str]],
+        body: AsyncIterator[bytes],
+        sender,
+    ) -> httpx.Response:
+        """Send the request upstream; the caller streams the response and closes it."""
+        client = self.client_for(route)
+        request = client.build_request(
+            method,
+            httpx.URL(f"{route.url}/{path}", query=query),
+            headers=self.build_headers(headers, route, sender),
+            # GET/DELETE carry no body; an empty stream would still be sent chunked
+            content=body if method not in ("GET", "HEAD", "DELETE") else None,
+        )
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.HTTPError:
+            self.upstream_errors += 1
+            raise
+        self.forwarded += 1
+        return response
+
+    async def broadcast(
+        self,
+        method: str,
+        path: str,
+        query: bytes,
+        headers: Iterable[Tuple[str, str]],
+        body: bytes,
+        sender,
+    ) -> List[Dict[str, Any]]:
+        """Send one request to every connected party except the sender."""
+        headers = list(headers)
+        self.broadcasts += 1
+
+        async def send(route: Route) -> Dict[str, Any]:
+            outcome = {"country_code": route.country_code, "party_id": route.party_id}
+
+            async def content():
+                yield body
+
+            try:
+                response = await self.forward(route, method, path, query, headers, content(), sender)
+                await response.aclose()
+                outcome["http_status"] = response.status_code
+            except httpx.HTTPError as e:
+                outcome["error"] = f"{type(e).__name__}: {e}"
+            return outcome
+
+        receivers = [route for route in self.table.routes() if route.organization_id != sender.id]
+        return list(await asyncio.gather(*(send(route) for route in receivers)))
+
+    async def run(self, interval: float = 30.0) -> None:
+        # Picks up credentials registered through other workers
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.table.load(self.db)
+            except Exception:
+                logger.exception("Routing table reload failed")
+
+    async def close(self) -> None:
+        clients = [client for _, client in self._clients.values()]
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": len(self.table),
+            "clients": len(self._clients),
+            "forwarded": self.forwarded,
+            "broadcasts": self.broadcasts,
+            "upstream_errors": self.upstream_errors,
+        }
+
+
+def response_headers(headers: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+    return {name: value for name, value in headers if name.lower() not in HOP_BY_HOP}
+
+
+async def relay(response: httpx.Response) -> AsyncIterator[bytes]:
+    """Upstream body as received (still compressed, if it was); closed even if the client goes away."""
+    try:
+        async for chunk in response.aiter_raw():
+            yield chunk
+    finally:
+        await response.aclose()
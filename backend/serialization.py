@@ -0,0 +1,104 @@
+"""Fast JSON response path for OCPI list endpoints.
+
+Documents are validated by pydantic when they are written, so list handlers
+do not need to rebuild models for every page. Instead Mongo projects only the
+fields of the OCPI model and the raw documents are encoded straight to JSON
+bytes with orjson inside the usual OCPI envelope.
+
+Listings without pagination are streamed: ``stream_json_array`` encodes a
+Motor cursor batch by batch, so memory does not grow with the result size.
+"""
+
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Mapping, Optional, Type
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+from metrics import record_serialization
+
+# Mongo returns naive UTC datetimes; OCPI requires them to be marked as UTC
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection containing exactly the fields of ``model``.
+
+    ``_id`` stays included because keyset pagination needs it; use
+    ``strip_ids`` before encoding.
+    """
+    return {name: 1 for name in model.model_fields}
+
+
+def strip_ids(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for document in documents:
+        document.pop("_id", None)
+    return documents
+
+
+def json_documents(documents: List[Dict[str, Any]]) -> bytes:
+    """Comma-separated JSON of ``documents``, without the enclosing brackets."""
+    started = time.perf_counter()
+    content = b",".join(orjson.dumps(document, option=ORJSON_OPTIONS) for document in documents)
+    record_serialization(time.perf_counter() - started)
+    return content
+
+
+async def stream_json_array(documents: AsyncIterable[Dict[str, Any]], batch_size: int = 500) -> AsyncIterator[bytes]:
+    """Encode documents (``_id`` dropped) as one JSON array, ``batch_size`` at a time."""
+    yield b"["
+    batch: List[Dict[str, Any]] = []
+    separator = b""
+    async for document in documents:
+        document.pop("_id", None)
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield separator + json_documents(batch)
+            separator = b","
+            batch = []
+    if batch:
+        yield separator + json_documents(batch)
+    yield b"]"
+
+
+def ocpi_json(
+    data: Any,
+    status_code: int = 1000,
+    status_message: str = "Success",
+) -> bytes:
+    started = time.perf_counter()
+    content = orjson.dumps({
+        "data": data,
+        "status_code": status_code,
+        "status_message": status_message,
+        "timestamp": datetime.now(timezone.utc),
+    }, option=ORJSON_OPTIONS)
+    record_serialization(time.perf_counter() - started)
+    return content
+
+
+def ocpi_envelope(data: bytes, status_code: int = 1000, status_message: str = "Success") -> bytes:
+    """OCPI envelope around ``data`` that is already encoded."""
+    return b"".join((
+        b'{"data":', data,
+        b',"status_code":', str(status_code).encode(),
+        b',"status_message":', orjson.dumps(status_message),
+        b',"timestamp":', orjson.dumps(datetime.now(timezone.utc), option=ORJSON_OPTIONS), b"}",
+    ))
+
+
+def ocpi_json_response(
+    data: Any,
+    headers: Optional[Mapping[str, str]] = None,
+    status_code: int = 1000,
+    status_message: str = "Success",
+    http_status: int = 200,
+) -> Response:
+    return Response(
+        content=ocpi_json(data, status_code, status_message),
+        status_code=http_status,
+        media_type="application/json",
+        headers=dict(headers) if headers else None,
+    )
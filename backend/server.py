@@ -1,25 +1,57 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
+from functools import lru_cache
 import hashlib
 import secrets
+import asyncio
+import httpx
+
+from auth_cache import TokenCache, publish_invalidation, watch_invalidations
+from pagination import paginate, last_updated_filter, encode_id_cursor, decode_id_cursor
+from migrations import run_migrations
+from geo import location_search_fields, search_pipeline
+from serialization import model_projection, strip_ids, ocpi_json_response, ocpi_envelope, json_documents, stream_json_array
+from bulk_ingest import IngestSpec, IngestRejected, ingest, spool_request, file_chunks
+import orjson
+from dashboard import SingleFlightCache, collect_stats, collect_timeseries
+from token_index import TokenIndex, AllowedType, authorization_decision
+from session_updates import SessionUpdateCoalescer, attach_charging_periods, session_key, replace_periods
+from cdrs import CdrPipeline
+from pricing import PricingEngine
+from push import PushDispatcher, PushEvent
+from events import EventBus, ChangeEvent
+from conditional import not_modified, bump_version
+from metrics import MetricsMiddleware, MongoCommandListener, metrics_response, ocpi_module, set_party
+from routing import HubRouter, UnknownReceiver, relay, response_headers
+from commands import CommandTracker, command_response
+from evse_status import EvseStatusStore
+from archive import SessionArchiver, party as archive_party
+from live_feed import EVENT_TYPES, FeedFull, LiveFeed, party_key
+from rate_limit import DEFAULT_LIMITS, MemoryBucketStore, MongoBucketStore, RateLimited, RateLimiter, parse_limits, retry_after_header
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Request/Mongo instrumentation exposed on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandListener()] if METRICS_ENABLED else [])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app
@@ -35,6 +67,97 @@ ocpi_router = APIRouter(prefix="/api/ocpi")
 
 security = HTTPBearer()
 
+# API token -> Organization cache in front of get_current_organization
+auth_cache = TokenCache(
+    maxsize=int(os.environ.get('AUTH_CACHE_MAXSIZE', '10000')),
+    ttl=float(os.environ.get('AUTH_CACHE_TTL', '60'))
+)
+
+# Dashboard statistics cache. Organization changes invalidate it early; location and
+# session writes come steadily, so the statistics catch up with them on the TTL
+dashboard_cache = SingleFlightCache(
+    ttl=float(os.environ.get('DASHBOARD_CACHE_TTL', '30')),
+    maxsize=int(os.environ.get('DASHBOARD_CACHE_MAXSIZE', '256'))
+)
+
+# Writes to the main collections, seen by every worker (change streams when available)
+event_bus = EventBus(db, name=os.environ.get('EVENT_BUS_NAME', 'hub'))
+
+# Tokens pushed by eMSPs, indexed for real-time authorization
+token_index = TokenIndex(
+    maxsize=int(os.environ.get('TOKEN_INDEX_MAXSIZE', '200000')),
+    ttl=float(os.environ.get('TOKEN_INDEX_TTL', '60'))
+)
+
+# High-frequency Session PATCHes are merged in memory and flushed periodically
+session_coalescer = SessionUpdateCoalescer(db, interval=float(os.environ.get('SESSION_FLUSH_INTERVAL', '1')))
+# Sessions known to exist (key -> eMSP organization id), so PATCHes can skip the existence check
+known_sessions = {}
+KNOWN_SESSIONS_MAX = 100000
+
+# EVSE statuses held in memory; status-only PATCHes reach Mongo in periodic bulk writes
+evse_status = EvseStatusStore(db, interval=float(os.environ.get('EVSE_STATUS_FLUSH_INTERVAL', '1')))
+
+# SSE/WebSocket feed of EVSE status, session and dashboard counter changes
+live_feed = LiveFeed(
+    capacity=int(os.environ.get('LIVE_FEED_CAPACITY', '10000')),
+    interval=float(os.environ.get('LIVE_FEED_INTERVAL', '0.25')),
+    max_subscribers=int(os.environ.get('LIVE_FEED_MAX_SUBSCRIBERS', '10000')),
+    counters=lambda: dashboard_cache.get("stats", lambda: collect_stats(db))
+)
+
+# Tariffs compiled to arrays once, used to price sessions without a CPO-provided cost
+pricing_engine = PricingEngine(db)
+
+# Background CDR generation from completed sessions
+cdr_pipeline = CdrPipeline(
+    db,
+    batch_size=int(os.environ.get('CDR_BATCH_SIZE', '1000')),
+    interval=float(os.environ.get('CDR_PIPELINE_INTERVAL', '10')),
+    pricer=pricing_engine.price_sessions
+)
+
+# Changes received from one party are pushed to the subscribed partners
+push_dispatcher = PushDispatcher(
+    db,
+    concurrency=int(os.environ.get('PUSH_CONCURRENCY', '8')),
+    batch_size=int(os.environ.get('PUSH_BATCH_SIZE', '100')),
+    queue_size=int(os.environ.get('PUSH_QUEUE_SIZE', '10000')),
+    max_attempts=int(os.environ.get('PUSH_MAX_ATTEMPTS', '5')),
+    timeout=float(os.environ.get('PUSH_TIMEOUT', '10'))
+)
+
+# Requests between parties are forwarded through the hub using the OCPI-to-* headers
+hub_router = HubRouter(
+    db,
+    connections=int(os.environ.get('ROUTING_CONNECTIONS', '32')),
+    timeout=float(os.environ.get('ROUTING_TIMEOUT', '30'))
+)
+
+# Commands from eMSPs are forwarded to CPOs in the background; results come back through the hub
+command_tracker = CommandTracker(
+    db,
+    hub_router,
+    workers=int(os.environ.get('COMMAND_WORKERS', '16')),
+    timeout=float(os.environ.get('COMMAND_TIMEOUT', '60')),
+    max_pending=int(os.environ.get('COMMAND_MAX_PENDING', '100000'))
+)
+# Public base URL of the hub, used in the response_url handed to CPOs; defaults to the request's
+HUB_URL = os.environ.get('HUB_URL')
+
+# Per-organization, per-module token buckets in front of the OCPI endpoints;
+# the Mongo store shares buckets between workers
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+rate_limiter = RateLimiter(
+    MongoBucketStore(db) if os.environ.get('RATE_LIMIT_STORE', 'memory') == 'mongo' else MemoryBucketStore(),
+    parse_limits(os.environ.get('RATE_LIMITS', DEFAULT_LIMITS))
+)
+
+# Maximum page size advertised to OCPI clients through X-Limit
+MAX_PAGE_LIMIT = int(os.environ.get('OCPI_MAX_PAGE_LIMIT', '1000'))
+# Documents encoded per chunk when the organization listing is streamed
+ORGANIZATION_STREAM_BATCH = int(os.environ.get('ORGANIZATION_STREAM_BATCH', '500'))
+
 # OCPI Enums
 class RoleType(str, Enum):
     CPO = "CPO"
@@ -226,6 +349,142 @@ class Token(BaseModel):
     energy_contract: Optional[Dict[str, Any]] = None
     last_updated: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# CDR Models
+class CDR(BaseModel):
+    country_code: str
+    party_id: str
+    id: str
+    start_date_time: datetime
+    end_date_time: datetime
+    session_id: Optional[str] = None
+    cdr_token: Dict[str, Any]
+    auth_method: str
+    authorization_reference: Optional[str] = None
+    cdr_location: Dict[str, Any]
+    meter_id: Optional[str] = None
+    currency: str
+    tariffs: Optional[List[Dict[str, Any]]] = None
+    charging_periods: List[Dict[str, Any]]
+    total_cost: Dict[str, Any]
+    total_energy: float
+    total_time: float
+    total_parking_time: Optional[float] = None
+    remark: Optional[str] = None
+    last_updated: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Tariff Models
+class TariffDimensionType(str, Enum):
+    ENERGY = "ENERGY"
+    FLAT = "FLAT"
+    PARKING_TIME = "PARKING_TIME"
+    TIME = "TIME"
+
+class PriceComponent(BaseModel):
+    type: TariffDimensionType
+    price: float
+    vat: Optional[float] = None
+    step_size: int = 1
+
+class TariffRestrictions(BaseModel):
+    start_time: Optional[str] = Field(None, pattern=r"^([01][0-9]|2[0-3]):[0-5][0-9]$")
+    end_time: Optional[str] = Field(None, pattern=r"^([01][0-9]|2[0-3]):[0-5][0-9]$")
+    start_date: Optional[str] = Field(None, pattern=r"^[0-9]{4}-[0-9]{2}-[0-9]{2}$")
+    end_date: Optional[str] = Field(None, pattern=r"^[0-9]{4}-[0-9]{2}-[0-9]{2}$")
+    min_kwh: Optional[float] = None
+    max_kwh: Optional[float] = None
+    min_current: Optional[float] = None
+    max_current: Optional[float] = None
+    min_power: Optional[float] = None
+    max_power: Optional[float] = None
+    min_duration: Optional[int] = None
+    max_duration: Optional[int] = None
+    day_of_week: Optional[List[str]] = None
+    reservation: Optional[str] = None
+
+class TariffElement(BaseModel):
+    price_components: List[PriceComponent]
+    restrictions: Optional[TariffRestrictions] = None
+
+class Tariff(BaseModel):
+    country_code: str
+    party_id: str
+    id: str
+    currency: str
+    type: Optional[str] = None
+    tariff_alt_text: Optional[List[Dict[str, Any]]] = None
+    tariff_alt_url: Optional[str] = None
+    min_price: Optional[Dict[str, float]] = None
+    max_price: Optional[Dict[str, float]] = None
+    elements: List[TariffElement]
+    start_date_time: Optional[datetime] = None
+    end_date_time: Optional[datetime] = None
+    energy_mix: Optional[Dict[str, Any]] = None
+    last_updated: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Command Models
+class CommandResultType(str, Enum):
+    ACCEPTED = "ACCEPTED"
+    CANCELED_RESERVATION = "CANCELED_RESERVATION"
+    EVSE_OCCUPIED = "EVSE_OCCUPIED"
+    EVSE_INOPERATIVE = "EVSE_INOPERATIVE"
+    FAILED = "FAILED"
+    NOT_SUPPORTED = "NOT_SUPPORTED"
+    REJECTED = "REJECTED"
+    TIMEOUT = "TIMEOUT"
+    UNKNOWN_RESERVATION = "UNKNOWN_RESERVATION"
+
+class StartSession(BaseModel):
+    response_url: str
+    token: Token
+    location_id: str
+    evse_uid: Optional[str] = None
+    connector_id: Optional[str] = None
+    authorization_reference: Optional[str] = None
+
+class StopSession(BaseModel):
+    response_url: str
+    session_id: str
+
+class ReserveNow(BaseModel):
+    response_url: str
+    token: Token
+    expiry_date: datetime
+    reservation_id: str
+    location_id: str
+    evse_uid: Optional[str] = None
+    authorization_reference: Optional[str] = None
+
+class CommandResult(BaseModel):
+    result: CommandResultType
+    message: Optional[List[Dict[str, Any]]] = None
+
+COMMAND_MODELS = {"START_SESSION": StartSession, "STOP_SESSION": StopSession, "RESERVE_NOW": ReserveNow}
+
+# Mongo projections used by the fast list response path
+ORGANIZATION_PROJECTION = model_projection(Organization)
+LOCATION_PROJECTION = model_projection(Location)
+SESSION_PROJECTION = model_projection(Session)
+TOKEN_PROJECTION = model_projection(Token)
+CDR_PROJECTION = model_projection(CDR)
+TARIFF_PROJECTION = model_projection(Tariff)
+
+# Completed sessions older than SESSION_ARCHIVE_MIN_AGE_DAYS move to Parquet files
+async def on_sessions_archived(keys: List[str]):
+    for key in keys:
+        known_sessions.pop(key, None)
+    await event_bus.notify("sessions", "bulk")
+
+session_archiver = SessionArchiver(
+    db,
+    root=os.environ.get('SESSION_ARCHIVE_DIR', str(ROOT_DIR / 'archive' / 'sessions')),
+    min_age=timedelta(days=float(os.environ.get('SESSION_ARCHIVE_MIN_AGE_DAYS', '90'))),
+    batch_size=int(os.environ.get('SESSION_ARCHIVE_BATCH_SIZE', '5000')),
+    interval=float(os.environ.get('SESSION_ARCHIVE_INTERVAL', '3600')),
+    # Only the OCPI fields are archived, not the hub's bookkeeping
+    fields=tuple(SESSION_PROJECTION),
+    on_archive=on_sessions_archived
+)
+
 # Helper functions
 def generate_token():
     return secrets.token_urlsafe(32)
@@ -236,10 +495,24 @@ def hash_password(password: str) -> str:
 # Authentication
 async def get_current_organization(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
-    org = await db.organizations.find_one({"api_token": token})
+    cached = auth_cache.get(token)
+    if cached is not None:
+        set_party(cached.country_code, cached.party_id)
+        return cached
+    org = await db.organizations.find_one({"api_token": token}, {"_id": 0, "api_token": 0})
     if not org:
         raise HTTPException(status_code=401, detail="Invalid token")
-    return Organization(**org)
+    organization = Organization(**org)
+    auth_cache.set(token, organization.id, organization)
+    set_party(organization.country_code, organization.party_id)
+    return organization
+
+async def enforce_rate_limit(request: Request, current_org: Organization = Depends(get_current_organization)):
+    # Shares the cached get_current_organization result with the endpoint
+    await rate_limiter.check(
+        current_org.id, f"{current_org.country_code}*{current_org.party_id}",
+        ocpi_module(request.scope["route"].path), request.method
+    )
 
 # Organization Management Routes
 # Registration response model that includes the API token
@@ -270,7 +543,15 @@ async def register_organization(org_data: OrganizationCreate):
     org_dict["created_at"] = datetime.now(timezone.utc)
     org_dict["updated_at"] = datetime.now(timezone.utc)
     
-    await db.organizations.insert_one(org_dict)
+    try:
+        await db.organizations.insert_one(org_dict)
+    except DuplicateKeyError:
+        # Lost a race against a concurrent registration of the same party
+        raise HTTPException(
+            status_code=400,
+            detail="Organization with this country_code and party_id already exists"
+        )
+    await event_bus.notify("organizations", "insert", {"id": org_dict["id"]})
     
     # Return organization with API token for one-time display
     org_without_token = Organization(**{k: v for k, v in org_dict.items() if k != "api_token"})
@@ -280,10 +561,90 @@ async def register_organization(org_data: OrganizationCreate):
         api_token=api_token
     )
 
+class TokenRotationResponse(BaseModel):
+    api_token: str
+    warning: str = "This API token will only be shown once. Please copy and store it securely."
+
+@api_router.post("/organizations/{org_id}/token/rotate", response_model=TokenRotationResponse)
+async def rotate_organization_token(
+    org_id: str,
+    current_org: Organization = Depends(get_current_organization)
+):
+    if current_org.id != org_id:
+        raise HTTPException(status_code=403, detail="Organizations can only rotate their own token")
+    
+    api_token = generate_token()
+    await db.organizations.update_one(
+        {"id": org_id},
+        {"$set": {"api_token": api_token, "updated_at": datetime.now(timezone.utc)}}
+    )
+    await publish_invalidation(db, auth_cache, org_id)
+    await event_bus.notify("organizations", "update", {"id": org_id})
+    
+    return TokenRotationResponse(api_token=api_token)
+
+@api_router.delete("/organizations/{org_id}/token")
+async def revoke_organization_token(
+    org_id: str,
+    current_org: Organization = Depends(get_current_organization)
+):
+    if current_org.id != org_id:
+        raise HTTPException(status_code=403, detail="Organizations can only revoke their own token")
+    
+    await db.organizations.update_one(
+        {"id": org_id},
+        {"$unset": {"api_token": ""}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+    )
+    await publish_invalidation(db, auth_cache, org_id)
+    await event_bus.notify("organizations", "update", {"id": org_id})
+    
+    return {"message": "API token revoked"}
+
+def organization_projection(fields: Optional[str]) -> Dict[str, int]:
+    if not fields:
+        return ORGANIZATION_PROJECTION
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in Organization.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown organization fields: {', '.join(unknown)}")
+    return {field: 1 for field in requested}
+
 @api_router.get("/organizations", response_model=List[Organization])
-async def get_organizations():
-    orgs = await db.organizations.find({}, {"api_token": 0}).to_list(1000)
-    return [Organization(**org) for org in orgs]
+async def get_organizations(
+    request: Request,
+    role: Optional[RoleType] = None,
+    country_code: Optional[str] = Query(None, min_length=2, max_length=2),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name,role"),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None
+):
+    # Without limit the whole listing is streamed; with limit one page is returned
+    # and the Link header points at the next one
+    query: Dict[str, Any] = {}
+    if role:
+        query["role"] = role.value
+    if country_code:
+        query["country_code"] = country_code.upper()
+    if cursor:
+        query["_id"] = {"$gt": decode_id_cursor(cursor)}
+    find = db.organizations.find(query, organization_projection(fields)).sort("_id", 1)
+    
+    if limit is None:
+        return StreamingResponse(
+            stream_json_array(find.batch_size(ORGANIZATION_STREAM_BATCH), ORGANIZATION_STREAM_BATCH),
+            media_type="application/json"
+        )
+    
+    limit = min(limit, MAX_PAGE_LIMIT)
+    orgs = await find.limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(orgs) > limit:
+        orgs = orgs[:limit]
+        next_url = request.url.include_query_params(cursor=encode_id_cursor(orgs[-1]["_id"]), limit=limit)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return Response(
+        content=b"[" + json_documents(strip_ids(orgs)) + b"]", media_type="application/json", headers=headers
+    )
 
 @api_router.get("/organizations/{org_id}", response_model=Organization)
 async def get_organization(org_id: str):
@@ -327,6 +688,9 @@ async def post_credentials(
         "credentials": credentials.model_dump(),
         "created_at": datetime.now(timezone.utc)
     })
+    # Pushes and routed requests to this partner go to the new endpoint from now on
+    await push_dispatcher.register(current_org.model_dump(mode="json"), credentials.model_dump())
+    hub_router.table.update(current_org.model_dump(mode="json"), credentials.model_dump())
     
     return OCPIResponse(
         data=credentials.model_dump(),
@@ -337,17 +701,63 @@ async def post_credentials(
 # OCPI Locations endpoint
 @ocpi_router.get("/2.3.0/locations")
 async def get_locations(
+    request: Request,
+    response: Response,
     offset: int = 0,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
     current_org: Organization = Depends(get_current_organization)
 ):
-    locations = await db.locations.find().skip(offset).limit(limit).to_list(limit)
+    unchanged = await not_modified(db, "locations", request, response)
+    if unchanged:
+        return unchanged
+    query = last_updated_filter(date_from, date_to)
+    locations = await paginate(
+        db.locations, query, request, response, offset, limit, cursor, MAX_PAGE_LIMIT, LOCATION_PROJECTION
+    )
+    return ocpi_json_response([evse_status.overlay(loc) for loc in strip_ids(locations)], response.headers)
+
+@ocpi_router.get("/2.3.0/locations/search")
+async def search_locations(
+    latitude: Optional[float] = Query(None, ge=-90, le=90),
+    longitude: Optional[float] = Query(None, ge=-180, le=180),
+    radius: Optional[float] = Query(None, gt=0, description="Search radius in meters"),
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    connector_type: Optional[List[ConnectorType]] = Query(None),
+    min_power: Optional[int] = Query(None, ge=0, description="Minimum connector power in watts"),
+    limit: int = 50,
+    current_org: Organization = Depends(get_current_organization)
+):
+    # Results are ordered nearest first when latitude/longitude are given
+    pipeline = search_pipeline(
+        latitude, longitude, radius, bbox,
+        [c.value for c in connector_type] if connector_type else None,
+        min_power, max(1, min(limit, MAX_PAGE_LIMIT))
+    )
+    locations = await db.locations.aggregate(pipeline).to_list(None)
     return OCPIResponse(
-        data=[Location(**loc) for loc in locations],
+        data=[Location(**evse_status.overlay(loc)) for loc in locations],
         status_code=1000,
         status_message="Success"
     )
 
+@ocpi_router.get("/2.3.0/locations/availability")
+async def get_availability(
+    evses_from: int = Query(0, ge=0, description="Only return EVSE keys from this position on"),
+    current_org: Organization = Depends(get_current_organization)
+):
+    # Current status of every EVSE: data.status has one character per EVSE, an index into
+    # data.statuses, in the order of data.evses. EVSEs keep their position, so clients that
+    # cached the keys pass evses_from=<count they have> and only get the new ones.
+    if not evse_status.ready:
+        return ocpi_json_response(
+            None, headers={"Retry-After": "5"}, status_code=3000,
+            status_message="EVSE statuses are still loading", http_status=503
+        )
+    return Response(content=ocpi_envelope(evse_status.snapshot(evses_from)), media_type="application/json")
+
 @ocpi_router.post("/2.3.0/locations")
 async def create_location(
     location: Location,
@@ -360,8 +770,17 @@ async def create_location(
     location_dict = location.model_dump()
     location_dict["owner_org_id"] = current_org.id
     location_dict["created_at"] = datetime.now(timezone.utc)
+    location_dict.update(location_search_fields(location_dict))
     
     await db.locations.insert_one(location_dict)
+    evse_status.set_location(location_dict)
+    await bump_version(db, "locations", location.last_updated)
+    await event_bus.notify("locations", "insert", location_dict)
+    # Receivers only implement PUT, so a hub-side create reaches them as one
+    await push_change(
+        current_org, "locations", "PUT", [location.country_code, location.party_id, location.id],
+        jsonable_python(location), roles=(RoleType.EMSP,)
+    )
     
     return OCPIResponse(
         data=location,
@@ -369,59 +788,1163 @@ async def create_location(
         status_message="Success"
     )
 
+# OCPI Locations receiver interface (CPO -> Hub)
+def require_location_owner(current_org: Organization, country_code: str, party_id: str):
+    if current_org.role != RoleType.CPO:
+        raise HTTPException(status_code=403, detail="Only CPOs can push locations")
+    if (current_org.country_code, current_org.party_id) != (country_code, party_id):
+        raise HTTPException(status_code=403, detail="Locations can only be pushed by their owning party")
+
+def location_key(country_code: str, party_id: str, location_id: str) -> Dict[str, str]:
+    return {"country_code": country_code, "party_id": party_id, "id": location_id}
+
+@lru_cache(maxsize=None)
+def field_adapter(model, field: str) -> TypeAdapter:
+    # Building an adapter compiles a validator; PATCHes reuse one per model field
+    return TypeAdapter(model.model_fields[field].annotation)
+
+def validate_patch(model, patch: Dict[str, Any], key_fields: tuple) -> Dict[str, Any]:
+    """Validate a partial OCPI object against the fields of ``model``."""
+    values = {}
+    for field, value in patch.items():
+        if field not in model.model_fields or field in key_fields:
+            raise HTTPException(status_code=400, detail=f"Field '{field}' cannot be patched")
+        try:
+            values[field] = field_adapter(model, field).validate_python(value)
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid value for '{field}': {e.errors()[0]['msg']}")
+    values.setdefault("last_updated", datetime.now(timezone.utc))
+    return jsonable_python(values)
+
+def jsonable_python(value):
+    # Plain Mongo-storable values: nested models become dicts, enums their values
+    if isinstance(value, BaseModel):
+        return jsonable_python(value.model_dump())
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, dict):
+        return {k: jsonable_python(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [jsonable_python(v) for v in value]
+    return value
+
+async def push_change(
+    current_org: Organization,
+    module: str,
+    method: str,
+    path: List[str],
+    body: Dict[str, Any],
+    roles: tuple = (),
+    organization_ids: tuple = (),
+    query: Optional[Dict[str, str]] = None
+):
+    await push_dispatcher.publish(
+        PushEvent(module, method, "/".join(path), body, current_org.country_code, current_org.party_id, query),
+        roles=roles,
+        organization_ids=organization_ids
+    )
+
+async def refresh_location_search_fields(key: Dict[str, str]):
+    # EVSE/connector structure changed; recompute connector_standards/max_power
+    location = await db.locations.find_one(key, {"evses": 1})
+    if location:
+        await db.locations.update_one(key, {"$set": location_search_fields({"evses": location.get("evses")})})
+
+def evse_filters(evse_uid: str, connector_id: Optional[str] = None) -> List[Dict[str, str]]:
+    filters = [{"e.uid": evse_uid}]
+    if connector_id is not None:
+        filters.append({"c.id": connector_id})
+    return filters
+
+@ocpi_router.get("/2.3.0/locations/{country_code}/{party_id}/{location_id}")
+async def get_location_object(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    request: Request,
+    response: Response,
+    current_org: Organization = Depends(get_current_organization)
+):
+    unchanged = await not_modified(db, "locations", request, response)
+    if unchanged:
+        return unchanged
+    location = await db.locations.find_one(location_key(country_code, party_id, location_id), LOCATION_PROJECTION)
+    if not location:
+        raise HTTPException(status_code=404, detail="Location not found")
+    return ocpi_json_response(evse_status.overlay(strip_ids([location])[0]), response.headers)
+
+@ocpi_router.get("/2.3.0/locations/{country_code}/{party_id}/{location_id}/{evse_uid}")
+async def get_evse_object(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    evse_uid: str,
+    request: Request,
+    response: Response,
+    current_org: Organization = Depends(get_current_organization)
+):
+    unchanged = await not_modified(db, "locations", request, response)
+    if unchanged:
+        return unchanged
+    location = await db.locations.find_one(
+        {**location_key(country_code, party_id, location_id), "evses.uid": evse_uid},
+        {"_id": 0, "evses.$": 1}
+    )
+    if not location:
+        raise HTTPException(status_code=404, detail="EVSE not found")
+    return ocpi_json_response(
+        evse_status.overlay_evse(country_code, party_id, location_id, location["evses"][0]), response.headers
+    )
+
+@ocpi_router.get("/2.3.0/locations/{country_code}/{party_id}/{location_id}/{evse_uid}/{connector_id}")
+async def get_connector_object(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    evse_uid: str,
+    connector_id: str,
+    request: Request,
+    response: Response,
+    current_org: Organization = Depends(get_current_organization)
+):
+    unchanged = await not_modified(db, "locations", request, response)
+    if unchanged:
+        return unchanged
+    location = await db.locations.find_one(
+        {**location_key(country_code, party_id, location_id), "evses.uid": evse_uid},
+        {"_id": 0, "evses.$": 1}
+    )
+    connector = next(
+        (c for c in (location["evses"][0]["connectors"] if location else []) if c["id"] == connector_id),
+        None
+    )
+    if not connector:
+        raise HTTPException(status_code=404, detail="Connector not found")
+    return ocpi_json_response(connector, response.headers)
+
+@ocpi_router.put("/2.3.0/locations/{country_code}/{party_id}/{location_id}")
+async def put_location(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    location: Location,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_location_owner(current_org, country_code, party_id)
+    if location_key(location.country_code, location.party_id, location.id) != location_key(country_code, party_id, location_id):
+        raise HTTPException(status_code=400, detail="Location identifiers do not match the URL")
+    
+    location_dict = jsonable_python(location)
+    pushed = dict(location_dict)
+    location_dict.update(location_search_fields(location_dict))
+    location_dict["owner_org_id"] = current_org.id
+    result = await db.locations.update_one(
+        location_key(country_code, party_id, location_id),
+        {"$set": location_dict, "$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    evse_status.set_location(location_dict)
+    await bump_version(db, "locations", location.last_updated)
+    await event_bus.notify("locations", "insert" if result.upserted_id else "replace", location_dict)
+    await push_change(current_org, "locations", "PUT", [country_code, party_id, location_id], pushed, roles=(RoleType.EMSP,))
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.patch("/2.3.0/locations/{country_code}/{party_id}/{location_id}")
+async def patch_location(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    patch: Dict[str, Any],
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_location_owner(current_org, country_code, party_id)
+    values = validate_patch(Location, patch, ("country_code", "party_id", "id"))
+    pushed = dict(values)
+    values.update(location_search_fields(values))
+    
+    result = await db.locations.update_one(location_key(country_code, party_id, location_id), {"$set": values})
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Location not found")
+    if "evses" in values:
+        evse_status.set_location({
+            **location_key(country_code, party_id, location_id),
+            "evses": values["evses"], "last_updated": values["last_updated"]
+        })
+    await bump_version(db, "locations", values["last_updated"])
+    await event_bus.notify("locations", "update", location_key(country_code, party_id, location_id), values)
+    await push_change(current_org, "locations", "PATCH", [country_code, party_id, location_id], pushed, roles=(RoleType.EMSP,))
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.put("/2.3.0/locations/{country_code}/{party_id}/{location_id}/{evse_uid}")
+async def put_evse(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    evse_uid: str,
+    evse: EVSE,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_location_owner(current_org, country_code, party_id)
+    if evse.uid != evse_uid:
+        raise HTTPException(status_code=400, detail="EVSE uid does not match the URL")
+    
+    key = location_key(country_code, party_id, location_id)
+    evse_dict = jsonable_python(evse)
+    # Replace the EVSE in place, or append it when the location does not have it yet
+    result = await db.locations.update_one(
+        {**key, "evses.uid": evse_uid},
+        {"$set": {"evses.$": evse_dict}, "$max": {"last_updated": evse.last_updated}}
+    )
+    if not result.matched_count:
+        # Location.evses is optional; $push needs an array to append to
+        await db.locations.update_one({**key, "evses": None}, {"$set": {"evses": []}})
+        result = await db.locations.update_one(
+            {**key, "evses.uid": {"$ne": evse_uid}},
+            {"$push": {"evses": evse_dict}, "$max": {"last_updated": evse.last_updated}}
+        )
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Location not found")
+    evse_status.set(country_code, party_id, location_id, evse_uid, evse_dict["status"], evse.last_updated)
+    await refresh_location_search_fields(key)
+    await bump_version(db, "locations", evse.last_updated)
+    await event_bus.notify("locations", "update", key)
+    await push_change(
+        current_org, "locations", "PUT", [country_code, party_id, location_id, evse_uid], evse_dict, roles=(RoleType.EMSP,)
+    )
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.patch("/2.3.0/locations/{country_code}/{party_id}/{location_id}/{evse_uid}")
+async def patch_evse(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    evse_uid: str,
+    patch: Dict[str, Any],
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_location_owner(current_org, country_code, party_id)
+    values = validate_patch(EVSE, patch, ("uid",))
+    
+    key = location_key(country_code, party_id, location_id)
+    slot = evse_status.slot(country_code, party_id, location_id, evse_uid)
+    if slot is not None and values.keys() == {"status", "last_updated"}:
+        # Status-only PATCH of a known EVSE: the status store's next flush writes it to Mongo.
+        # Reads already serve it through the overlay, so cached copies are stale now
+        evse_status.set(country_code, party_id, location_id, evse_uid, values["status"], values["last_updated"])
+        evse_status.defer(slot)
+        await bump_version(db, "locations", values["last_updated"])
+    else:
+        # Targeted $set on the EVSE element; status updates never rewrite the location
+        result = await db.locations.update_one(
+            {**key, "evses.uid": evse_uid},
+            {
+                "$set": {f"evses.$.{field}": value for field, value in values.items()},
+                "$max": {"last_updated": values["last_updated"]},
+            }
+        )
+        if not result.matched_count:
+            raise HTTPException(status_code=404, detail="EVSE not found")
+        if "status" in values:
+            evse_status.set(country_code, party_id, location_id, evse_uid, values["status"], values["last_updated"])
+        if "connectors" in values:
+            await refresh_location_search_fields(key)
+        await bump_version(db, "locations", values["last_updated"])
+    await event_bus.notify("locations", "update", key)
+    await push_change(
+        current_org, "locations", "PATCH", [country_code, party_id, location_id, evse_uid], values, roles=(RoleType.EMSP,)
+    )
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.put("/2.3.0/locations/{country_code}/{party_id}/{location_id}/{evse_uid}/{connector_id}")
+async def put_connector(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    evse_uid: str,
+    connector_id: str,
+    connector: Connector,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_location_owner(current_org, country_code, party_id)
+    if connector.id != connector_id:
+        raise HTTPException(status_code=400, detail="Connector id does not match the URL")
+    
+    key = location_key(country_code, party_id, location_id)
+    connector_dict = jsonable_python(connector)
+    parents = {"evses.$[e].last_updated": connector.last_updated, "last_updated": connector.last_updated}
+    result = await db.locations.update_one(
+        {**key, "evses": {"$elemMatch": {"uid": evse_uid, "connectors.id": connector_id}}},
+        {"$set": {"evses.$[e].connectors.$[c]": connector_dict}, "$max": parents},
+        array_filters=evse_filters(evse_uid, connector_id)
+    )
+    if not result.matched_count:
+        # Documents written before validation may lack connectors; $push needs an array
+        await db.locations.update_one(
+            {**key, "evses": {"$elemMatch": {"uid": evse_uid, "connectors": None}}},
+            {"$set": {"evses.$[e].connectors": []}},
+            array_filters=evse_filters(evse_uid)
+        )
+        result = await db.locations.update_one(
+            {**key, "evses": {"$elemMatch": {"uid": evse_uid, "connectors.id": {"$ne": connector_id}}}},
+            {"$push": {"evses.$[e].connectors": connector_dict}, "$max": parents},
+            array_filters=evse_filters(evse_uid)
+        )
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="EVSE not found")
+    await refresh_location_search_fields(key)
+    await bump_version(db, "locations", connector.last_updated)
+    await event_bus.notify("locations", "update", key)
+    await push_change(
+        current_org, "locations", "PUT", [country_code, party_id, location_id, evse_uid, connector_id], connector_dict,
+        roles=(RoleType.EMSP,)
+    )
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.patch("/2.3.0/locations/{country_code}/{party_id}/{location_id}/{evse_uid}/{connector_id}")
+async def patch_connector(
+    country_code: str,
+    party_id: str,
+    location_id: str,
+    evse_uid: str,
+    connector_id: str,
+    patch: Dict[str, Any],
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_location_owner(current_org, country_code, party_id)
+    values = validate_patch(Connector, patch, ("id",))
+    
+    key = location_key(country_code, party_id, location_id)
+    result = await db.locations.update_one(
+        {**key, "evses": {"$elemMatch": {"uid": evse_uid, "connectors.id": connector_id}}},
+        {
+            "$set": {f"evses.$[e].connectors.$[c].{field}": value for field, value in values.items()},
+            "$max": {"evses.$[e].last_updated": values["last_updated"], "last_updated": values["last_updated"]},
+        },
+        array_filters=evse_filters(evse_uid, connector_id)
+    )
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Connector not found")
+    if {"standard", "max_electric_power", "max_voltage", "max_amperage"} & values.keys():
+        await refresh_location_search_fields(key)
+    await bump_version(db, "locations", values["last_updated"])
+    await event_bus.notify("locations", "update", key)
+    await push_change(
+        current_org, "locations", "PATCH", [country_code, party_id, location_id, evse_uid, connector_id], values,
+        roles=(RoleType.EMSP,)
+    )
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+# Bulk NDJSON import
+def prepare_bulk_location(location: Location, owner: Organization) -> Dict[str, Any]:
+    if (location.country_code, location.party_id) != (owner.country_code, owner.party_id):
+        raise IngestRejected("Location belongs to another party")
+    location_dict = jsonable_python(location)
+    location_dict.update(location_search_fields(location_dict))
+    location_dict["owner_org_id"] = owner.id
+    return location_dict
+
+async def push_bulk_locations(documents: List[Dict[str, Any]], owner: Organization):
+    # Each imported location reaches eMSPs as the PUT it stands for, without hub fields.
+    # Queues that overflow dead-letter the rest, to be replayed
+    for document in documents:
+        await push_change(
+            owner, "locations", "PUT", [document["country_code"], document["party_id"], document["id"]],
+            {field: value for field, value in document.items() if field in LOCATION_PROJECTION},
+            roles=(RoleType.EMSP,)
+        )
+
+def prepare_bulk_tariff(tariff: Tariff, owner: Organization) -> Dict[str, Any]:
+    if (tariff.country_code, tariff.party_id) != (owner.country_code, owner.party_id):
+        raise IngestRejected("Tariff belongs to another party")
+    tariff_dict = jsonable_python(tariff)
+    tariff_dict["owner_org_id"] = owner.id
+    return tariff_dict
+
+INGEST_SPECS = {
+    "locations": IngestSpec(
+        collection="locations",
+        model=Location,
+        key_fields=("country_code", "party_id", "id"),
+        prepare=prepare_bulk_location,
+        roles=(RoleType.CPO,),
+        on_written=push_bulk_locations
+    ),
+    "tariffs": IngestSpec(
+        collection="tariffs",
+        model=Tariff,
+        key_fields=("country_code", "party_id", "id"),
+        prepare=prepare_bulk_tariff,
+        roles=(RoleType.CPO,)
+    ),
+}
+
+@api_router.post("/bulk/{kind}")
+async def bulk_import(
+    kind: str,
+    request: Request,
+    batch_size: int = Query(1000, ge=1, le=10000),
+    current_org: Organization = Depends(get_current_organization)
+):
+    # Body is NDJSON (optionally gzip-compressed); the response streams NDJSON progress events
+    spec = INGEST_SPECS.get(kind)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Bulk import is not available for '{kind}'")
+    if current_org.role not in spec.roles:
+        raise HTTPException(status_code=403, detail=f"{current_org.role.value} organizations cannot import {kind}")
+    
+    upload = await spool_request(request.stream())
+    
+    async def events():
+        try:
+            async for event in ingest(db, spec, file_chunks(upload), current_org, batch_size):
+                yield orjson.dumps(event) + b"\n"
+        finally:
+            upload.close()
+            await bump_version(db, spec.collection)
+            await event_bus.notify(spec.collection, "bulk")
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 # OCPI Sessions endpoint
 @ocpi_router.get("/2.3.0/sessions")
 async def get_sessions(
+    request: Request,
+    response: Response,
     offset: int = 0,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
     current_org: Organization = Depends(get_current_organization)
 ):
+    unchanged = await not_modified(db, "sessions", request, response, current_org.id)
+    if unchanged:
+        return unchanged
     # Filter sessions based on organization role
-    query = {}
+    query = last_updated_filter(date_from, date_to)
     if current_org.role == RoleType.CPO:
         query["location_owner_id"] = current_org.id
     elif current_org.role == RoleType.EMSP:
         query["emsp_id"] = current_org.id
     
-    sessions = await db.sessions.find(query).skip(offset).limit(limit).to_list(limit)
-    return OCPIResponse(
-        data=[Session(**session) for session in sessions],
-        status_code=1000,
-        status_message="Success"
+    sessions = await paginate(
+        db.sessions, query, request, response, offset, limit, cursor, MAX_PAGE_LIMIT, SESSION_PROJECTION
+    )
+    return ocpi_json_response(await attach_charging_periods(db, strip_ids(sessions)), response.headers)
+
+@ocpi_router.get("/2.3.0/sessions/archive")
+async def get_archived_sessions(
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: int = 50,
+    date_from: Optional[datetime] = Query(None, description="Sessions started at or after"),
+    date_to: Optional[datetime] = Query(None, description="Sessions started before"),
+    country_code: Optional[str] = None,
+    party_id: Optional[str] = None,
+    current_org: Organization = Depends(get_current_organization)
+):
+    # Read-only: archived sessions never change. Only the month and party
+    # partitions that can match are opened.
+    limit = max(1, min(limit, MAX_PAGE_LIMIT))
+    visible_to = None
+    parties = [archive_party(country_code, party_id)] if country_code and party_id else None
+    if current_org.role == RoleType.CPO:
+        visible_to = ("location_owner_id", current_org.id)
+        # A CPO's sessions are all filed under its own party
+        own = archive_party(current_org.country_code, current_org.party_id)
+        parties = [p for p in parties or [own] if p == own]
+    elif current_org.role == RoleType.EMSP:
+        visible_to = ("emsp_id", current_org.id)
+    total, documents, files = await asyncio.to_thread(
+        session_archiver.archive.query, date_from, date_to, parties, visible_to, offset, limit
+    )
+    headers = {"X-Total-Count": str(total), "X-Limit": str(MAX_PAGE_LIMIT), "X-Archive-Files": str(files)}
+    if offset + limit < total:
+        next_url = request.url.include_query_params(offset=offset + limit, limit=limit)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    data = b"[" + ",".join(documents).encode() + b"]"
+    return Response(content=ocpi_envelope(data), media_type="application/json", headers=headers)
+
+@api_router.get("/sessions/archive/stats")
+async def get_session_archive_stats():
+    return await session_archiver.stats()
+
+# OCPI Sessions receiver interface (CPO -> Hub)
+def require_session_owner(current_org: Organization, country_code: str, party_id: str):
+    if current_org.role != RoleType.CPO:
+        raise HTTPException(status_code=403, detail="Only CPOs can push sessions")
+    if (current_org.country_code, current_org.party_id) != (country_code, party_id):
+        raise HTTPException(status_code=403, detail="Sessions can only be pushed by their owning party")
+
+async def find_emsp_id(cdr_token: Dict[str, Any]) -> Optional[str]:
+    org = await db.organizations.find_one(
+        {"country_code": cdr_token.get("country_code"), "party_id": cdr_token.get("party_id"), "role": RoleType.EMSP.value},
+        {"id": 1}
+    )
+    return org["id"] if org else None
+
+@ocpi_router.get("/2.3.0/sessions/{country_code}/{party_id}/{session_id}")
+async def get_session_object(
+    country_code: str,
+    party_id: str,
+    session_id: str,
+    request: Request,
+    response: Response,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_session_owner(current_org, country_code, party_id)
+    unchanged = await not_modified(db, "sessions", request, response)
+    if unchanged:
+        return unchanged
+    session = await db.sessions.find_one(
+        {"country_code": country_code, "party_id": party_id, "id": session_id}, SESSION_PROJECTION
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return ocpi_json_response((await attach_charging_periods(db, strip_ids([session])))[0], response.headers)
+
+@ocpi_router.put("/2.3.0/sessions/{country_code}/{party_id}/{session_id}")
+async def put_session(
+    country_code: str,
+    party_id: str,
+    session_id: str,
+    session: Session,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_session_owner(current_org, country_code, party_id)
+    if (session.country_code, session.party_id, session.id) != (country_code, party_id, session_id):
+        raise HTTPException(status_code=400, detail="Session identifiers do not match the URL")
+    
+    key = session_key(country_code, party_id, session_id)
+    session_dict = jsonable_python(session)
+    pushed = dict(session_dict)
+    periods = session_dict.pop("charging_periods")
+    session_dict["location_owner_id"] = current_org.id
+    session_dict["emsp_id"] = await find_emsp_id(session.cdr_token)
+    session_dict["hub_updated_at"] = datetime.now(timezone.utc)
+    
+    await session_coalescer.discard(key)
+    result = await db.sessions.update_one(
+        {"country_code": country_code, "party_id": party_id, "id": session_id},
+        {
+            "$set": session_dict,
+            # A CPO-sent session replaces any total_cost the hub computed
+            "$unset": {"charging_periods": "", "total_cost_source": ""},
+            "$setOnInsert": {"created_at": datetime.now(timezone.utc)}
+        },
+        upsert=True
+    )
+    await replace_periods(db, key, periods)
+    known_sessions[key] = session_dict["emsp_id"]
+    await bump_version(db, "sessions", session.last_updated)
+    await event_bus.notify("sessions", "insert" if result.upserted_id else "replace", session_dict)
+    await push_change(
+        current_org, "sessions", "PUT", [country_code, party_id, session_id], pushed,
+        organization_ids=(session_dict["emsp_id"],)
+    )
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.patch("/2.3.0/sessions/{country_code}/{party_id}/{session_id}")
+async def patch_session(
+    country_code: str,
+    party_id: str,
+    session_id: str,
+    patch: Dict[str, Any],
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_session_owner(current_org, country_code, party_id)
+    values = validate_patch(Session, patch, ("country_code", "party_id", "id"))
+    key = session_key(country_code, party_id, session_id)
+    if key not in known_sessions:
+        exists = await db.sessions.find_one(
+            {"country_code": country_code, "party_id": party_id, "id": session_id}, {"emsp_id": 1}
+        )
+        if not exists:
+            raise HTTPException(status_code=404, detail="Session not found")
+        if len(known_sessions) >= KNOWN_SESSIONS_MAX:
+            known_sessions.clear()
+        known_sessions[key] = exists.get("emsp_id")
+    
+    await event_bus.notify(
+        "sessions", "update", {"country_code": country_code, "party_id": party_id, "id": session_id}, values
+    )
+    await push_change(
+        current_org, "sessions", "PATCH", [country_code, party_id, session_id], dict(values),
+        organization_ids=(known_sessions[key],)
+    )
+    # Charging periods in a PATCH are appended (OCPI), everything else is overwritten;
+    # both are coalesced in memory and written on the next flush
+    periods = values.pop("charging_periods", None)
+    if "total_cost" in values:
+        # From now on repricing leaves the CPO's cost alone
+        values["total_cost_source"] = "CPO"
+    session_coalescer.add(key, values, periods)
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@api_router.get("/sessions/coalescer/stats")
+async def get_session_coalescer_stats():
+    return session_coalescer.stats()
+
+# OCPI CDRs endpoint
+@ocpi_router.get("/2.3.0/cdrs")
+async def get_cdrs(
+    request: Request,
+    response: Response,
+    offset: int = 0,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    current_org: Organization = Depends(get_current_organization)
+):
+    unchanged = await not_modified(db, "cdrs", request, response, current_org.id)
+    if unchanged:
+        return unchanged
+    # Same visibility rules as sessions
+    query = last_updated_filter(date_from, date_to)
+    if current_org.role == RoleType.CPO:
+        query["location_owner_id"] = current_org.id
+    elif current_org.role == RoleType.EMSP:
+        query["emsp_id"] = current_org.id
+    
+    cdrs = await paginate(db.cdrs, query, request, response, offset, limit, cursor, MAX_PAGE_LIMIT, CDR_PROJECTION)
+    return ocpi_json_response(strip_ids(cdrs), response.headers)
+
+@api_router.get("/cdrs/pipeline/stats")
+async def get_cdr_pipeline_stats():
+    return await cdr_pipeline.stats()
+
+# OCPI Tariffs endpoint
+@ocpi_router.get("/2.3.0/tariffs")
+async def get_tariffs(
+    request: Request,
+    response: Response,
+    offset: int = 0,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    current_org: Organization = Depends(get_current_organization)
+):
+    unchanged = await not_modified(db, "tariffs", request, response)
+    if unchanged:
+        return unchanged
+    # Tariffs are public to every connected party, like locations
+    query = last_updated_filter(date_from, date_to)
+    tariffs = await paginate(
+        db.tariffs, query, request, response, offset, limit, cursor, MAX_PAGE_LIMIT, TARIFF_PROJECTION
     )
+    return ocpi_json_response(strip_ids(tariffs), response.headers)
+
+# OCPI Tariffs receiver interface (CPO -> Hub)
+def require_tariff_owner(current_org: Organization, country_code: str, party_id: str):
+    if current_org.role != RoleType.CPO:
+        raise HTTPException(status_code=403, detail="Only CPOs can push tariffs")
+    if (current_org.country_code, current_org.party_id) != (country_code, party_id):
+        raise HTTPException(status_code=403, detail="Tariffs can only be pushed by their owning party")
+
+def tariff_db_key(country_code: str, party_id: str, tariff_id: str) -> Dict[str, str]:
+    return {"country_code": country_code, "party_id": party_id, "id": tariff_id}
+
+@ocpi_router.get("/2.3.0/tariffs/{country_code}/{party_id}/{tariff_id}")
+async def get_tariff_object(
+    country_code: str,
+    party_id: str,
+    tariff_id: str,
+    request: Request,
+    response: Response,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_tariff_owner(current_org, country_code, party_id)
+    unchanged = await not_modified(db, "tariffs", request, response)
+    if unchanged:
+        return unchanged
+    tariff = await db.tariffs.find_one(tariff_db_key(country_code, party_id, tariff_id), TARIFF_PROJECTION)
+    if not tariff:
+        raise HTTPException(status_code=404, detail="Tariff not found")
+    return ocpi_json_response(strip_ids([tariff])[0], response.headers)
+
+@ocpi_router.put("/2.3.0/tariffs/{country_code}/{party_id}/{tariff_id}")
+async def put_tariff(
+    country_code: str,
+    party_id: str,
+    tariff_id: str,
+    tariff: Tariff,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_tariff_owner(current_org, country_code, party_id)
+    if (tariff.country_code, tariff.party_id, tariff.id) != (country_code, party_id, tariff_id):
+        raise HTTPException(status_code=400, detail="Tariff identifiers do not match the URL")
+    
+    tariff_dict = jsonable_python(tariff)
+    tariff_dict["owner_org_id"] = current_org.id
+    await db.tariffs.update_one(
+        tariff_db_key(country_code, party_id, tariff_id),
+        {"$set": tariff_dict, "$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    await bump_version(db, "tariffs", tariff.last_updated)
+    pricing_engine.cache.invalidate((country_code, party_id, tariff_id))
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.delete("/2.3.0/tariffs/{country_code}/{party_id}/{tariff_id}")
+async def delete_tariff(
+    country_code: str,
+    party_id: str,
+    tariff_id: str,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_tariff_owner(current_org, country_code, party_id)
+    result = await db.tariffs.delete_one(tariff_db_key(country_code, party_id, tariff_id))
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Tariff not found")
+    await bump_version(db, "tariffs")
+    pricing_engine.cache.invalidate((country_code, party_id, tariff_id))
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@api_router.get("/tariffs/pricing/stats")
+async def get_pricing_stats():
+    return pricing_engine.cache.stats()
 
 # OCPI Tokens endpoint
 @ocpi_router.get("/2.3.0/tokens")
 async def get_tokens(
+    request: Request,
+    response: Response,
     offset: int = 0,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
     current_org: Organization = Depends(get_current_organization)
 ):
     # Only eMSPs can access tokens
     if current_org.role != RoleType.EMSP:
         raise HTTPException(status_code=403, detail="Only eMSPs can access tokens")
+    unchanged = await not_modified(db, "tokens", request, response, current_org.id)
+    if unchanged:
+        return unchanged
     
-    tokens = await db.tokens.find({"emsp_id": current_org.id}).skip(offset).limit(limit).to_list(limit)
-    return OCPIResponse(
-        data=[Token(**token) for token in tokens],
-        status_code=1000,
-        status_message="Success"
+    query = last_updated_filter(date_from, date_to)
+    query["emsp_id"] = current_org.id
+    tokens = await paginate(
+        db.tokens, query, request, response, offset, limit, cursor, MAX_PAGE_LIMIT, TOKEN_PROJECTION
     )
+    return ocpi_json_response(strip_ids(tokens), response.headers)
+
+# OCPI Tokens receiver interface (eMSP -> Hub)
+def require_token_owner(current_org: Organization, country_code: str, party_id: str):
+    if current_org.role != RoleType.EMSP:
+        raise HTTPException(status_code=403, detail="Only eMSPs can push tokens")
+    if (current_org.country_code, current_org.party_id) != (country_code, party_id):
+        raise HTTPException(status_code=403, detail="Tokens can only be pushed by their owning party")
+
+def token_db_key(country_code: str, party_id: str, uid: str, token_type: TokenType) -> Dict[str, str]:
+    return {"country_code": country_code, "party_id": party_id, "uid": uid, "type": token_type.value}
+
+@ocpi_router.get("/2.3.0/tokens/{country_code}/{party_id}/{uid}")
+async def get_token_object(
+    country_code: str,
+    party_id: str,
+    uid: str,
+    request: Request,
+    response: Response,
+    type: TokenType = TokenType.RFID,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_token_owner(current_org, country_code, party_id)
+    unchanged = await not_modified(db, "tokens", request, response)
+    if unchanged:
+        return unchanged
+    token = await db.tokens.find_one(token_db_key(country_code, party_id, uid, type), TOKEN_PROJECTION)
+    if not token:
+        raise HTTPException(status_code=404, detail="Token not found")
+    return ocpi_json_response(strip_ids([token])[0], response.headers)
+
+@ocpi_router.put("/2.3.0/tokens/{country_code}/{party_id}/{uid}")
+async def put_token(
+    country_code: str,
+    party_id: str,
+    uid: str,
+    token: Token,
+    type: TokenType = TokenType.RFID,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_token_owner(current_org, country_code, party_id)
+    key = token_db_key(country_code, party_id, uid, type)
+    token_dict = jsonable_python(token)
+    if {k: token_dict[k] for k in key} != key:
+        raise HTTPException(status_code=400, detail="Token identifiers do not match the URL")
+    
+    pushed = dict(token_dict)
+    token_dict["emsp_id"] = current_org.id
+    await db.tokens.update_one(
+        key,
+        {"$set": token_dict, "$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    token_index.put(token_dict)
+    await bump_version(db, "tokens", token.last_updated)
+    await event_bus.notify("tokens", "replace", token_dict)
+    await push_change(
+        current_org, "tokens", "PUT", [country_code, party_id, uid], pushed,
+        roles=(RoleType.CPO,), query={"type": type.value}
+    )
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+@ocpi_router.patch("/2.3.0/tokens/{country_code}/{party_id}/{uid}")
+async def patch_token(
+    country_code: str,
+    party_id: str,
+    uid: str,
+    patch: Dict[str, Any],
+    type: TokenType = TokenType.RFID,
+    current_org: Organization = Depends(get_current_organization)
+):
+    require_token_owner(current_org, country_code, party_id)
+    values = validate_patch(Token, patch, ("country_code", "party_id", "uid", "type"))
+    token = await db.tokens.find_one_and_update(
+        token_db_key(country_code, party_id, uid, type),
+        {"$set": values},
+        projection=TOKEN_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if not token:
+        raise HTTPException(status_code=404, detail="Token not found")
+    token_index.put(token)
+    await bump_version(db, "tokens", values["last_updated"])
+    await event_bus.notify("tokens", "update", token, values)
+    await push_change(
+        current_org, "tokens", "PATCH", [country_code, party_id, uid], values,
+        roles=(RoleType.CPO,), query={"type": type.value}
+    )
+    return OCPIResponse(status_code=1000, status_message="Success")
+
+# Real-time authorization (CPO -> Hub)
+@ocpi_router.post("/2.3.0/tokens/{uid}/authorize")
+async def authorize_token(
+    uid: str,
+    location: Optional[Dict[str, Any]] = None,
+    type: TokenType = TokenType.RFID,
+    to_country_code: Optional[str] = Header(None, alias="OCPI-to-country-code"),
+    to_party_id: Optional[str] = Header(None, alias="OCPI-to-party-id"),
+    current_org: Organization = Depends(get_current_organization)
+):
+    if current_org.role != RoleType.CPO:
+        raise HTTPException(status_code=403, detail="Only CPOs can request token authorization")
+    
+    if to_country_code and to_party_id:
+        key = (to_country_code, to_party_id, uid, type.value)
+        entry = token_index.get(key)
+        if entry is None:
+            token = await db.tokens.find_one(token_db_key(*key[:3], type), TOKEN_PROJECTION)
+            entry = token_index.put(token) if token else None
+    else:
+        # Without routing headers the uid/type pair has to identify the token on its own
+        entry = token_index.find(uid, type.value)
+        if entry is None:
+            tokens = await db.tokens.find({"uid": uid, "type": type.value}, TOKEN_PROJECTION).to_list(2)
+            if len(tokens) > 1:
+                return ocpi_json_response(
+                    None, status_code=2001,
+                    status_message="Token uid is not unique, OCPI-to-country-code/OCPI-to-party-id headers required",
+                    http_status=400
+                )
+            entry = token_index.put(tokens[0]) if tokens else None
+            if entry is not None:
+                token_index.confirm_unique(uid, type.value)
+    
+    if entry is None:
+        return ocpi_json_response(None, status_code=2004, status_message="Unknown Token", http_status=404)
+    
+    allowed, info = authorization_decision(entry)
+    authorization_info = {"allowed": allowed, "token": entry.token_json}
+    if allowed == AllowedType.ALLOWED:
+        authorization_info["authorization_reference"] = uuid.uuid4().hex
+    if location:
+        authorization_info["location"] = location
+    if info:
+        authorization_info["info"] = {"language": "en", "text": info}
+    return ocpi_json_response(authorization_info)
+
+# OCPI hub routing (party -> hub -> party)
+@ocpi_router.api_route("/2.3.0/hub/{target:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def route_request(
+    target: str,
+    request: Request,
+    to_country_code: Optional[str] = Header(None, alias="OCPI-to-country-code"),
+    to_party_id: Optional[str] = Header(None, alias="OCPI-to-party-id"),
+    current_org: Organization = Depends(get_current_organization)
+):
+    # target is {module}/{path} on the receiving party, e.g. "commands/START_SESSION"
+    query = request.url.query.encode()
+    if not (to_country_code and to_party_id):
+        if request.method == "GET":
+            return ocpi_json_response(
+                None, status_code=2001,
+                status_message="OCPI-to-country-code/OCPI-to-party-id headers required", http_status=400
+            )
+        outcomes = await hub_router.broadcast(
+            request.method, target, query, request.headers.items(), await request.body(), current_org
+        )
+        return ocpi_json_response(outcomes)
+    
+    try:
+        route = hub_router.table.resolve(to_country_code, to_party_id)
+    except UnknownReceiver as e:
+        return ocpi_json_response(None, status_code=4001, status_message=str(e), http_status=404)
+    try:
+        upstream = await hub_router.forward(
+            route, request.method, target, query, request.headers.items(), request.stream(), current_org
+        )
+    except httpx.TimeoutException:
+        return ocpi_json_response(None, status_code=4002, status_message="Timeout on forwarded request", http_status=504)
+    except httpx.HTTPError:
+        return ocpi_json_response(
+            None, status_code=4003, status_message="Connection problem with the receiving party", http_status=502
+        )
+    return StreamingResponse(
+        relay(upstream), status_code=upstream.status_code, headers=response_headers(upstream.headers.items())
+    )
+
+# OCPI Commands (eMSP -> hub -> CPO, CommandResult CPO -> hub -> eMSP)
+@ocpi_router.post("/2.3.0/commands/{command}")
+async def post_command(
+    command: str,
+    request: Request,
+    to_country_code: Optional[str] = Header(None, alias="OCPI-to-country-code"),
+    to_party_id: Optional[str] = Header(None, alias="OCPI-to-party-id"),
+    current_org: Organization = Depends(get_current_organization)
+):
+    if current_org.role != RoleType.EMSP:
+        raise HTTPException(status_code=403, detail="Only eMSPs can send commands")
+    model = COMMAND_MODELS.get(command)
+    if model is None:
+        return ocpi_json_response(command_response("NOT_SUPPORTED", 0, f"{command} is not supported by the hub"))
+    if not (to_country_code and to_party_id):
+        raise HTTPException(status_code=400, detail="OCPI-to-country-code/OCPI-to-party-id headers required")
+    try:
+        body = model.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {command}: {e.errors()[0]['msg']}")
+    
+    try:
+        receiver = hub_router.table.resolve(to_country_code, to_party_id)
+    except UnknownReceiver as e:
+        return ocpi_json_response(None, status_code=4001, status_message=str(e), http_status=404)
+    try:
+        # The result is posted to the eMSP with the token from its own credentials
+        sender = hub_router.table.resolve(current_org.country_code, current_org.party_id)
+    except UnknownReceiver:
+        return ocpi_json_response(
+            None, status_code=2001, status_message="Register credentials with the hub before sending commands",
+            http_status=400
+        )
+    callback_url = f"{HUB_URL or str(request.base_url).rstrip('/')}/api/ocpi/2.3.0/commands/{command}"
+    response = await command_tracker.submit(
+        command, body.model_dump(mode="json", exclude_unset=True), sender, receiver, callback_url
+    )
+    return ocpi_json_response(response)
+
+@ocpi_router.post("/2.3.0/commands/{command}/{command_id}")
+async def post_command_result(
+    command: str,
+    command_id: str,
+    result: CommandResult,
+    current_org: Organization = Depends(get_current_organization)
+):
+    # Only the CPO the command was sent to can answer it
+    if not await command_tracker.receive_result(command_id, current_org.id, result.model_dump(mode="json")):
+        raise HTTPException(status_code=404, detail="Unknown or completed command")
+    return ocpi_json_response(None)
+
+@api_router.get("/commands/stats")
+async def get_command_stats():
+    return command_tracker.stats()
+
+@api_router.get("/routing/stats")
+async def get_routing_stats():
+    return hub_router.stats()
+
+@api_router.get("/tokens/index/stats")
+async def get_token_index_stats():
+    return token_index.stats()
+
+# Push fan-out
+@api_router.get("/push/stats")
+async def get_push_stats():
+    return push_dispatcher.stats()
+
+@api_router.post("/push/dead-letters/{org_id}/replay")
+async def replay_push_dead_letters(
+    org_id: str,
+    limit: int = Query(1000, ge=1, le=10000),
+    current_org: Organization = Depends(get_current_organization)
+):
+    # Partners replay their own dead letters; the hub may replay anyone's
+    if current_org.id != org_id and current_org.role != RoleType.HUB:
+        raise HTTPException(status_code=403, detail="Dead letters can only be replayed by their partner")
+    return {"replayed": await push_dispatcher.replay_dead_letters(org_id, limit)}
+
+# Event bus subscriptions: keep this worker's in-memory state in line with writes from any worker
+def on_organization_change(event: ChangeEvent):
+    if event.document and event.document.get("id"):
+        auth_cache.invalidate_organization(event.document["id"])
+    if event.operation != "update":
+        dashboard_cache.invalidate()
+
+def on_location_change(event: ChangeEvent):
+    # Writes of other workers; older statuses than the store holds are ignored
+    if not event.local and event.document and "evses" in event.document:
+        evse_status.set_location(event.document)
+    elif event.operation == "bulk":
+        evse_status.reload()
+
+def on_session_change(event: ChangeEvent):
+    # Sessions removed by another worker (archived) must not be PATCHed as if they still existed
+    if event.operation in ("bulk", "delete"):
+        known_sessions.clear()
+    # Meter updates are not published; new sessions and status changes are
+    if event.operation != "update" or "status" in (event.updated_fields or {}):
+        publish_session_change(event)
+
+def on_token_change(event: ChangeEvent):
+    if event.operation != "delete" and event.document and "whitelist" in event.document:
+        token_index.put(event.document)
+
+# Live feed events
+SESSION_FEED_FIELDS = ("country_code", "party_id", "id", "location_id", "evse_uid", "connector_id",
+                       "start_date_time", "end_date_time", "status")
+
+def publish_evse_status(key, status: str, last_updated: datetime):
+    country_code, party_id, location_id, evse_uid = key
+    live_feed.publish("evse_status", {
+        "country_code": country_code, "party_id": party_id, "location_id": location_id,
+        "evse_uid": evse_uid, "status": status, "last_updated": last_updated,
+    })
+
+def publish_session_change(event: ChangeEvent):
+    document = dict(event.document or {})
+    document.update(event.updated_fields or {})
+    if not all(document.get(field) for field in ("country_code", "party_id", "id")):
+        return
+    data = {field: document[field] for field in SESSION_FEED_FIELDS if field in document}
+    data["operation"] = event.operation
+    # The CPO (by party, as PATCH events carry no organization ids) and the eMSP of the session
+    emsp_id = document.get("emsp_id") or known_sessions.get(
+        session_key(document["country_code"], document["party_id"], document["id"])
+    )
+    live_feed.publish("session", data, audience=(party_key(document["country_code"], document["party_id"]), emsp_id))
+
+evse_status.listener = publish_evse_status
+
+event_bus.subscribe("organizations", on_organization_change)
+event_bus.subscribe("locations", on_location_change)
+event_bus.subscribe("sessions", on_session_change)
+event_bus.subscribe("tokens", on_token_change)
+
+@api_router.get("/events/stats")
+async def get_event_bus_stats():
+    return event_bus.stats()
 
 # Dashboard endpoints
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats():
-    cpo_count = await db.organizations.count_documents({"role": "CPO"})
-    emsp_count = await db.organizations.count_documents({"role": "EMSP"})
-    location_count = await db.locations.count_documents({})
-    session_count = await db.sessions.count_documents({})
-    
-    return {
-        "cpos": cpo_count,
-        "emsps": emsp_count,
-        "locations": location_count,
-        "sessions": session_count
-    }
+    return await dashboard_cache.get("stats", lambda: collect_stats(db))
+
+@api_router.get("/dashboard/timeseries")
+async def get_dashboard_timeseries(
+    hours: int = Query(24, ge=1, le=168),
+    days: int = Query(30, ge=1, le=366)
+):
+    # Sessions per hour, kWh per day
+    return await dashboard_cache.get(("timeseries", hours, days), lambda: collect_timeseries(db, hours, days))
+
+@api_router.get("/locations/status/stats")
+async def get_evse_status_stats():
+    return evse_status.stats()
+
+# Live feed: SSE for browsers and partners, WebSocket for partners
+def feed_types(types: Optional[str]) -> List[str]:
+    requested = [t for t in (types or "").split(",") if t] or list(EVENT_TYPES)
+    unknown = set(requested) - set(EVENT_TYPES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown event types: {', '.join(sorted(unknown))}")
+    return requested
+
+def sse_response(subscription) -> StreamingResponse:
+    return StreamingResponse(
+        live_feed.sse(subscription), media_type="text/event-stream",
+        # Proxies must pass events through as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/live/events")
+async def get_live_events(
+    types: Optional[str] = Query(None, description="Comma-separated: evse_status,session,counters"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    current_org: Organization = Depends(get_current_organization)
+):
+    try:
+        subscription = live_feed.subscribe(
+            current_org.id, party_key(current_org.country_code, current_org.party_id), feed_types(types), last_event_id
+        )
+    except FeedFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return sse_response(subscription)
+
+@api_router.get("/live/dashboard")
+async def get_live_dashboard(last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    # Anonymous, like /dashboard/stats: counters only
+    try:
+        subscription = live_feed.subscribe(types=("counters",), last_event_id=last_event_id)
+    except FeedFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return sse_response(subscription)
+
+@api_router.websocket("/live/ws")
+async def live_websocket(websocket: WebSocket, token: Optional[str] = None, types: Optional[str] = None):
+    # Browsers cannot set headers on WebSockets, so the token may also come as ?token=
+    authorization = websocket.headers.get("authorization", "")
+    token = token or (authorization[7:] if authorization.lower().startswith("bearer ") else None)
+    try:
+        if not token:
+            raise HTTPException(status_code=401, detail="Missing token")
+        current_org = await get_current_organization(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+        subscription = live_feed.subscribe(
+            current_org.id, party_key(current_org.country_code, current_org.party_id), feed_types(types)
+        )
+    except (HTTPException, FeedFull) as e:
+        await websocket.close(code=1013 if isinstance(e, FeedFull) else 1008)
+        return
+    await websocket.accept()
+    
+    async def send_events():
+        async for message in live_feed.websocket_messages(subscription):
+            await websocket.send_text(message)
+    
+    # Nothing is expected from the client; receiving only notices the disconnect
+    sender = asyncio.create_task(send_events())
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        live_feed.unsubscribe(subscription)
+
+@api_router.get("/live/stats")
+async def get_live_feed_stats():
+    return live_feed.stats()
+
+@api_router.get("/rate-limits/stats")
+async def get_rate_limit_stats():
+    return rate_limiter.stats()
+
+@api_router.get("/auth/cache/stats")
+async def get_auth_cache_stats():
+    return auth_cache.stats()
 
 # Root endpoint
 @api_router.get("/")
@@ -430,7 +1953,21 @@ async def root():
 
 # Include routers
 app.include_router(api_router)
-app.include_router(ocpi_router)
+app.include_router(ocpi_router, dependencies=[Depends(enforce_rate_limit)] if RATE_LIMIT_ENABLED else None)
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return ocpi_json_response(
+        None, headers={"Retry-After": retry_after_header(exc.retry_after)},
+        status_code=2000, status_message=str(exc), http_status=429
+    )
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        return metrics_response()
+
+    app.add_middleware(MetricsMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -448,6 +1985,100 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def apply_migrations():
+    # Large deployments disable this and run `python migrations.py migrate` instead
+    if os.environ.get('RUN_MIGRATIONS_ON_STARTUP', 'true').lower() == 'true':
+        await run_migrations(db)
+
+@app.on_event("startup")
+async def warm_token_index():
+    if os.environ.get('TOKEN_INDEX_WARM', 'false').lower() == 'true':
+        tokens = db.tokens.find({}, TOKEN_PROJECTION).sort("last_updated", -1).limit(token_index.maxsize)
+        token_index.load([token async for token in tokens])
+
+@app.on_event("startup")
+async def start_event_bus():
+    app.state.event_bus_task = asyncio.create_task(event_bus.run())
+
+@app.on_event("startup")
+async def start_auth_cache_invalidation():
+    # Fallback for multi-worker deployments without change streams
+    app.state.auth_invalidation_task = asyncio.create_task(watch_invalidations(
+        db, auth_cache, float(os.environ.get('AUTH_CACHE_POLL_INTERVAL', '2')),
+        needed=lambda: event_bus.mode != "change_stream"
+    ))
+
+@app.on_event("startup")
+async def start_session_coalescer():
+    app.state.session_flush_task = asyncio.create_task(session_coalescer.run())
+
+@app.on_event("startup")
+async def start_evse_status_store():
+    # Loading a large table takes a while; the availability endpoint answers 503 until it is done
+    app.state.evse_status_load_task = asyncio.create_task(evse_status.load())
+    app.state.evse_status_flush_task = asyncio.create_task(evse_status.run())
+
+@app.on_event("startup")
+async def start_live_feed():
+    app.state.live_feed_tasks = [asyncio.create_task(live_feed.run()), asyncio.create_task(live_feed.run_counters())]
+
+@app.on_event("startup")
+async def start_cdr_pipeline():
+    app.state.cdr_pipeline_task = None
+    if os.environ.get('CDR_PIPELINE_ENABLED', 'true').lower() == 'true':
+        app.state.cdr_pipeline_task = asyncio.create_task(cdr_pipeline.run())
+
+@app.on_event("startup")
+async def start_session_archiver():
+    app.state.session_archiver_task = None
+    if os.environ.get('SESSION_ARCHIVE_ENABLED', 'false').lower() == 'true':
+        app.state.session_archiver_task = asyncio.create_task(session_archiver.run())
+
+@app.on_event("startup")
+async def start_push_dispatcher():
+    app.state.push_reload_task = None
+    if os.environ.get('PUSH_ENABLED', 'true').lower() == 'true':
+        await push_dispatcher.load()
+        push_dispatcher.start()
+        app.state.push_reload_task = asyncio.create_task(
+            push_dispatcher.run(float(os.environ.get('PUSH_REFRESH_INTERVAL', '30')))
+        )
+
+@app.on_event("startup")
+async def start_hub_router():
+    await hub_router.table.load(db)
+    app.state.routing_task = asyncio.create_task(
+        hub_router.run(float(os.environ.get('ROUTING_REFRESH_INTERVAL', '30')))
+    )
+
+@app.on_event("startup")
+async def start_command_tracker():
+    # After start_hub_router: reloaded commands need the routing table
+    await command_tracker.load()
+    command_tracker.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.event_bus_task.cancel()
+    app.state.auth_invalidation_task.cancel()
+    app.state.session_flush_task.cancel()
+    if app.state.cdr_pipeline_task:
+        app.state.cdr_pipeline_task.cancel()
+    if app.state.session_archiver_task:
+        app.state.session_archiver_task.cancel()
+    await session_coalescer.flush()
+    for task in app.state.live_feed_tasks:
+        task.cancel()
+    app.state.evse_status_load_task.cancel()
+    if evse_status.reload_task:
+        evse_status.reload_task.cancel()
+    app.state.evse_status_flush_task.cancel()
+    await evse_status.flush()
+    app.state.routing_task.cancel()
+    if app.state.push_reload_task:
+        app.state.push_reload_task.cancel()
+    await push_dispatcher.close()
+    await command_tracker.close()
+    await hub_router.close()
     client.close()
@@ -0,0 +1,248 @@
+"""Session meter-update coalescing and bucketed charging period storage.
+
+CPOs send a Session PATCH with the latest ``kwh`` and new charging periods
+every few seconds per session. Instead of one Mongo round-trip per PATCH,
+updates are merged in memory per session and flushed in one unordered
+``bulk_write`` every ``interval`` seconds.
+
+Charging periods are not embedded in the session document. They are appended
+to side documents in ``session_charging_periods`` holding at most
+``BUCKET_SIZE`` periods each, so a long session never grows or rewrites its
+main document.
+
+Operations that fail are retried on the next flush. Every append records a
+token in its bucket, so an append whose outcome is unknown (e.g. the
+connection dropped) is retried only if its token is not there. A PUT waits
+for a flush already writing the same session, so old values cannot land
+after it.
+"""
+
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from conditional import bump_version
+
+logger = logging.getLogger(__name__)
+
+PERIODS_COLLECTION = "session_charging_periods"
+BUCKET_SIZE = 100
+
+
+def session_key(country_code: str, party_id: str, session_id: str) -> str:
+    return f"{country_code}*{party_id}*{session_id}"
+
+
+def append_periods_operation(key: str, periods: List[Dict[str, Any]], token: str) -> UpdateOne:
+    # Fills the open bucket of the session when the whole chunk fits, or starts a new one.
+    # ``token`` is recorded with the periods, so an append whose outcome is unknown
+    # can be checked before it is retried.
+    return UpdateOne(
+        {"session_key": key, "count": {"$lte": BUCKET_SIZE - len(periods)}},
+        {"$push": {"periods": {"$each": periods}, "tokens": token}, "$inc": {"count": len(periods)}},
+        upsert=True
+    )
+
+
+async def replace_periods(db, key: str, periods: Optional[List[Dict[str, Any]]]) -> None:
+    await db[PERIODS_COLLECTION].delete_many({"session_key": key})
+    if periods:
+        await db[PERIODS_COLLECTION].insert_many([
+            {"session_key": key, "count": len(chunk), "periods": chunk}
+            for chunk in (periods[i:i + BUCKET_SIZE] for i in range(0, len(periods), BUCKET_SIZE))
+        ])
+
+
+async def load_periods(db, keys: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Charging periods of several sessions, in start_date_time order."""
+    periods: Dict[str, List[Dict[str, Any]]] = {}
+    async for bucket in db[PERIODS_COLLECTION].find({"session_key": {"$in": keys}}).sort("_id", 1):
+        periods.setdefault(bucket["session_key"], []).extend(bucket["periods"])
+    for session_periods in periods.values():
+        session_periods.sort(key=lambda p: str(p.get("start_date_time", "")))
+    return periods
+
+
+async def attach_charging_periods(db, sessions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Periods live in bucket documents; sessions written before that keep theirs embedded
+    keys = [session_key(s["country_code"], s["party_id"], s["id"]) for s in sessions]
+    periods = await load_periods(db, keys) if keys else {}
+    for key, session in zip(keys, sessions):
+        if key in periods:
+            session["charging_periods"] = (session.get("charging_periods") or []) + periods[key]
+    return sessions
+
+
+@dataclass
+class PendingUpdate:
+    values: Dict[str, Any] = field(default_factory=dict)
+    periods: List[Dict[str, Any]] = field(default_factory=list)
+    # Period appends of a failed flush that may have been written, by token
+    unconfirmed: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    # Token ``periods`` are being written with
+    token: Optional[str] = None
+
+    def merge(self, newer: "PendingUpdate") -> None:
+        self.values.update(newer.values)
+        self.periods.extend(newer.periods)
+        self.unconfirmed.update(newer.unconfirmed)
+
+
+def failed_indexes(result: Any, count: int) -> Set[int]:
+    """Operations of a bulk_write that certainly did not apply; all of them when unknown."""
+    if isinstance(result, BulkWriteError):
+        return {error["index"] for error in result.details.get("writeErrors", ())}
+    return set(range(count)) if isinstance(result, BaseException) else set()
+
+
+class SessionUpdateCoalescer:
+    def __init__(self, db, interval: float = 1.0):
+        self.db = db
+        self.interval = interval
+        self._pending: Dict[str, PendingUpdate] = {}
+        # The batch being written, and keys a PUT replaced meanwhile
+        self._flushing: Dict[str, PendingUpdate] = {}
+        self._superseded: Set[str] = set()
+        self._flushed = asyncio.Event()
+        self.received = 0
+        self.flushed_writes = 0
+        self.failed_writes = 0
+
+    def add(self, key: str, values: Dict[str, Any], periods: Optional[List[Dict[str, Any]]] = None) -> None:
+        pending = self._pending.setdefault(key, PendingUpdate())
+        last_updated: Optional[datetime] = pending.values.get("last_updated")
+        pending.values.update(values)
+        if last_updated and last_updated > pending.values["last_updated"]:
+            # Out-of-order PATCH: keep the newest timestamp
+            pending.values["last_updated"] = last_updated
+        if periods:
+            pending.periods.extend(periods)
+        self.received += 1
+
+    async def discard(self, key: str) -> None:
+        """Drop updates a full PUT supersedes; waits for a flush already writing them."""
+        self._pending.pop(key, None)
+        if key in self._flushing:
+            # Otherwise the flush could land after the PUT and overwrite it
+            self._superseded.add(key)
+            await self._flushed.wait()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._flushing = pending
+        try:
+            failed = await self._write(pending)
+        except BaseException:
+            # Nothing is known about what was written: retry all of it, periods after a check
+            failed = pending
+            for update in pending.values():
+                if update.token and update.periods:
+                    update.unconfirmed[update.token] = update.periods
+                    update.periods = []
+                update.token = None
+            raise
+        finally:
+            flushed, self._flushed = self._flushed, asyncio.Event()
+            superseded, self._superseded = self._superseded, set()
+            self._flushing = {}
+            flushed.set()
+            if failed:
+                # Put failed updates back in front of those that arrived meanwhile,
+                # except for sessions a PUT replaced
+                retried = {key: update for key, update in failed.items() if key not in superseded}
+                for key, newer in self._pending.items():
+                    retried.setdefault(key, PendingUpdate()).merge(newer)
+                self._pending = retried
+        if failed:
+            raise RuntimeError(f"{len(failed)} coalesced session updates failed and were re-queued")
+
+    async def _written_tokens(self, pending: Dict[str, PendingUpdate]) -> Set[str]:
+        keys = [key for key, update in pending.items() if update.unconfirmed]
+        if not keys:
+            return set()
+        written = set()
+        async for bucket in self.db[PERIODS_COLLECTION].find({"session_key": {"$in": keys}}, {"tokens": 1}):
+            written.update(bucket.get("tokens") or ())
+        return written
+
+    async def _write(self, pending: Dict[str, PendingUpdate]) -> Dict[str, PendingUpdate]:
+        """Write a batch; returns what has to be retried."""
+        written = await self._written_tokens(pending)
+        session_ops, session_keys = [], []
+        # Parallel to period_ops: session key, token and periods of each append
+        period_ops, appends = [], []
+        newest = None
+        for key, update in pending.items():
+            country_code, party_id, session_id = key.split("*", 2)
+            update.unconfirmed = {token: p for token, p in update.unconfirmed.items() if token not in written}
+            if update.periods:
+                update.token = uuid.uuid4().hex
+            for token, periods in [*update.unconfirmed.items(), (update.token, update.periods)]:
+                for i in range(0, len(periods), BUCKET_SIZE):
+                    chunk = periods[i:i + BUCKET_SIZE]
+                    period_ops.append(append_periods_operation(key, chunk, token))
+                    appends.append((key, token, chunk))
+            if not update.values:
+                continue
+            values = dict(update.values)
+            last_updated = values.pop("last_updated")
+            newest = max(newest, last_updated) if newest else last_updated
+            # hub_updated_at is the hub's own write clock (CDR pipeline checkpoint)
+            values["hub_updated_at"] = datetime.now(timezone.utc)
+            session_update = {"$max": {"last_updated": last_updated}, "$set": values}
+            session_ops.append(UpdateOne(
+                {"country_code": country_code, "party_id": party_id, "id": session_id}, session_update
+            ))
+            session_keys.append(key)
+        session_result, period_result = await asyncio.gather(
+            self.db.sessions.bulk_write(session_ops, ordered=False) if session_ops else asyncio.sleep(0),
+            self.db[PERIODS_COLLECTION].bulk_write(period_ops, ordered=False) if period_ops else asyncio.sleep(0),
+            return_exceptions=True
+        )
+
+        # Setting values again is harmless; appending periods again is not, so
+        # appends with an unknown outcome are checked by token on the retry
+        failed: Dict[str, PendingUpdate] = {}
+        for index in failed_indexes(session_result, len(session_ops)):
+            failed.setdefault(session_keys[index], PendingUpdate()).values.update(pending[session_keys[index]].values)
+        for index in failed_indexes(period_result, len(period_ops)):
+            key, token, periods = appends[index]
+            update = failed.setdefault(key, PendingUpdate())
+            if isinstance(period_result, BulkWriteError):
+                update.periods.extend(periods)
+            else:
+                update.unconfirmed.setdefault(token, []).extend(periods)
+        for result in (session_result, period_result):
+            if isinstance(result, BaseException):
+                logger.warning("Session update bulk write failed: %s", result)
+        self.failed_writes += sum(len(failed_indexes(r, n)) for r, n in (
+            (session_result, len(session_ops)), (period_result, len(period_ops))
+        ))
+        self.flushed_writes += len(session_ops) + len(period_ops)
+        if newest:
+            await bump_version(self.db, "sessions", newest)
+        return failed
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush coalesced session updates")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_sessions": len(self._pending),
+            "received_updates": self.received,
+            "flushed_writes": self.flushed_writes,
+            "failed_writes": self.failed_writes,
+        }
@@ -0,0 +1,135 @@
+"""In-memory token index for real-time authorization.
+
+Charge points need an authorize decision in a few milliseconds, so the hub
+answers from an LRU index of the tokens eMSPs pushed to it, keyed by
+``(country_code, party_id, uid, type)``. Entries keep only what a decision
+needs plus the pre-encoded OCPI token object, which is embedded as-is in the
+AuthorizationInfo response. Misses fall back to Mongo and populate the index.
+
+Requests without routing headers look tokens up by ``(uid, type)`` alone.
+The index only holds some tokens, so a single cached match says nothing
+about uncached tokens of other eMSPs; it is trusted only while Mongo has
+recently confirmed the pair to be unique.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+import orjson
+
+from serialization import ORJSON_OPTIONS
+
+TokenKey = Tuple[str, str, str, str]
+
+
+class TokenEntry(NamedTuple):
+    valid: bool
+    whitelist: str
+    token_json: orjson.Fragment
+    expires_at: float
+
+
+class AllowedType:
+    ALLOWED = "ALLOWED"
+    BLOCKED = "BLOCKED"
+    EXPIRED = "EXPIRED"
+    NO_CREDIT = "NO_CREDIT"
+    NOT_ALLOWED = "NOT_ALLOWED"
+
+
+def token_key(token: Dict[str, Any]) -> TokenKey:
+    return token["country_code"], token["party_id"], token["uid"], token["type"]
+
+
+class TokenIndex:
+    def __init__(self, maxsize: int = 200000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[TokenKey, TokenEntry]" = OrderedDict()
+        # (uid, type) -> keys, for requests that do not name the eMSP
+        self._by_uid: Dict[Tuple[str, str], Set[TokenKey]] = {}
+        # (uid, type) -> expiry of Mongo's confirmation that only one token has it
+        self._unique: Dict[Tuple[str, str], float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: TokenKey) -> Optional[TokenEntry]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                self.discard(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def find(self, uid: str, token_type: str) -> Optional[TokenEntry]:
+        """Look a token up by uid/type only; ambiguous or unconfirmed matches count as misses."""
+        keys = self._by_uid.get((uid, token_type))
+        confirmed = self._unique.get((uid, token_type), 0.0) >= time.monotonic()
+        if not keys or len(keys) > 1 or not confirmed:
+            self.misses += 1
+            return None
+        return self.get(next(iter(keys)))
+
+    def confirm_unique(self, uid: str, token_type: str) -> None:
+        """Record that Mongo holds a single token with this uid/type, for ``ttl`` seconds."""
+        self._unique[(uid, token_type)] = time.monotonic() + self.ttl
+
+    def put(self, token: Dict[str, Any]) -> TokenEntry:
+        key = token_key(token)
+        public = {k: v for k, v in token.items() if k not in ("_id", "emsp_id", "created_at")}
+        entry = TokenEntry(
+            valid=token["valid"],
+            whitelist=token["whitelist"],
+            token_json=orjson.Fragment(orjson.dumps(public, option=ORJSON_OPTIONS)),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        keys = self._by_uid.setdefault(key[2:], set())
+        if key not in keys:
+            keys.add(key)
+            if len(keys) > 1:
+                self._unique.pop(key[2:], None)
+        while len(self._entries) > self.maxsize:
+            self.discard(next(iter(self._entries)))
+        return entry
+
+    def load(self, tokens: Iterable[Dict[str, Any]]) -> None:
+        for token in tokens:
+            self.put(token)
+
+    def discard(self, key: TokenKey) -> None:
+        if self._entries.pop(key, None) is not None:
+            keys = self._by_uid.get(key[2:])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_uid[key[2:]]
+                    self._unique.pop(key[2:], None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def authorization_decision(entry: TokenEntry) -> Tuple[str, Optional[str]]:
+    """Allowed value and optional info text for a known token."""
+    if not entry.valid:
+        return AllowedType.BLOCKED, None
+    if entry.whitelist == "NEVER":
+        # The eMSP wants to decide itself; the hub cannot authorize from its copy
+        return AllowedType.NOT_ALLOWED, "Real-time authorization by the eMSP is required for this token"
+    return AllowedType.ALLOWED, None
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Commands module benchmark
+
+Starts the hub, a stub CPO and a stub eMSP (see stub_partner.py) on
+localhost and sends START_SESSION commands from the eMSP through the hub.
+Reports the latency of the hub's synchronous answer and how many commands
+are pending. With --results the CPO posts a CommandResult back for every
+command after --delay seconds, and the benchmark waits until the eMSP has
+received all of them. Without it, commands stay pending until the CPO's
+--command-timeout and then time out. In both cases the number of asyncio
+tasks stays flat, because pending commands are tracked in a heap and not
+by a coroutine each.
+
+Requires a reachable MongoDB (MONGO_URL, default mongodb://localhost:27017).
+The benchmark database is dropped before and after the run.
+
+Usage: python benchmarks/command_tracker_bench.py [--commands 20000] [--concurrency 64] [--results] [--delay 1]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from stub_partner import create_app  # noqa: E402
+
+
+async def serve(app, port):
+    import uvicorn
+
+    # No lifespan: only the command tracker is started, below
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def run(args):
+    import httpx
+    import server
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+    await server.run_migrations(server.db)
+    hub, hub_task = await serve(server.app, args.port)
+    hub_url = f"http://127.0.0.1:{args.port}"
+    servers = [(hub, hub_task)]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def register(party_id, role, port):
+            response = await client.post(f"{hub_url}/api/organizations/register", json={
+                "name": f"Benchmark {role}", "country_code": "TR", "party_id": party_id, "role": role
+            })
+            token = response.json()["api_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            await client.post(f"{hub_url}/api/ocpi/2.3.0/credentials", headers=headers, json={
+                "token": f"{party_id}-token", "url": f"http://127.0.0.1:{port}/ocpi", "roles": []
+            })
+            return token, headers
+
+        cpo_token, _ = await register("BCP", "CPO", args.port + 1)
+        _, emsp = await register("BEM", "EMSP", args.port + 2)
+        cpo_app = create_app(
+            delay=args.delay, command_timeout=args.command_timeout, hub_token=cpo_token if args.results else None
+        )
+        emsp_app = create_app()
+        servers.append(await serve(cpo_app, args.port + 1))
+        servers.append(await serve(emsp_app, args.port + 2))
+        await server.start_command_tracker()
+        tracker = server.command_tracker
+
+        headers = {**emsp, "OCPI-to-country-code": "TR", "OCPI-to-party-id": "BCP"}
+        token = {
+            "country_code": "TR", "party_id": "BEM", "uid": "BENCH", "type": "RFID", "contract_id": "TR-BEM-BENCH",
+            "issuer": "Benchmark", "valid": True, "whitelist": "ALLOWED",
+        }
+        latencies = []
+        errors = 0
+        pending = iter(range(args.commands))
+
+        async def worker():
+            nonlocal errors
+            for i in pending:
+                body = {
+                    "response_url": f"http://127.0.0.1:{args.port + 2}/ocpi/results/{i}",
+                    "token": token, "location_id": f"LOC{i % 1000}",
+                }
+                started = time.perf_counter()
+                response = await client.post(f"{hub_url}/api/ocpi/2.3.0/commands/START_SESSION", headers=headers, json=body)
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code != 200 or response.json()["data"]["result"] != "ACCEPTED"
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        q = statistics.quantiles(latencies, n=100, method="inclusive")
+        print(f"{args.commands} commands, concurrency {args.concurrency}: {args.commands / elapsed:.0f} commands/s")
+        print(f"accept latency ms: p50 {q[49]:.2f}  p95 {q[94]:.2f}  p99 {q[98]:.2f}  errors {errors}")
+        print(f"after submitting: {tracker.stats()['pending']} pending, {len(asyncio.all_tasks())} asyncio tasks")
+
+        # Every command ends with a CommandResult at the eMSP: the CPO's, or TIMEOUT
+        while tracker.delivered + tracker.undelivered < args.commands - errors:
+            await asyncio.sleep(0.1)
+        total = time.perf_counter() - started
+        stats = tracker.stats()
+        print(f"all results delivered after {total:.1f} s: {stats['results']}, undelivered {stats['undelivered']}")
+        print(f"eMSP received {emsp_app.state.received['results']} results, {len(asyncio.all_tasks())} asyncio tasks")
+
+    await tracker.close()
+    await server.hub_router.close()
+    for uv, task in servers:
+        uv.should_exit = True
+        await task
+    await server.client.drop_database(os.environ["DB_NAME"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--commands", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--results", action="store_true", help="the CPO posts a result for every command")
+    parser.add_argument("--delay", type=float, default=1.0, help="seconds before the CPO answers")
+    parser.add_argument("--command-timeout", type=int, default=10, help="timeout the CPO asks for")
+    parser.add_argument("--port", type=int, default=9300)
+    parser.add_argument("--db", default="ocpi_benchmark")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    # Always use a dedicated database: it is dropped before and after the run
+    os.environ["DB_NAME"] = args.db
+    # A single benchmark party would otherwise be throttled
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+EVSE status update throughput benchmark
+
+Seeds a CPO with locations through the OCPI receiver interface, then fires a
+sustained burst of EVSE status updates at the app and reports throughput and
+latency percentiles for:
+
+  patch  PATCH /locations/{cc}/{pid}/{location_id}/{evse_uid}  (status store, flushed to Mongo in bulk)
+  put    PUT   /locations/{cc}/{pid}/{location_id}  (rewrite the whole location)
+
+It then times GET /locations/availability for the seeded EVSEs, and builds
+an in-memory status store of --snapshot-evses EVSEs to time snapshots of a
+large table: cold (keys encoded for the first time), warm, and statuses only.
+
+Requires a reachable MongoDB (MONGO_URL, default mongodb://localhost:27017).
+The benchmark database is dropped before seeding.
+
+Usage: python benchmarks/evse_status_bench.py [--locations 2000] [--evses 6] [--updates 20000] [--concurrency 64]
+                                             [--snapshot-evses 1000000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+STATUSES = ["AVAILABLE", "CHARGING", "BLOCKED", "OUTOFORDER", "RESERVED"]
+
+
+def make_location(i, evses):
+    return {
+        "country_code": "TR",
+        "party_id": "BNC",
+        "id": f"LOC{i:07d}",
+        "address": "Büyükdere Cd. No:1",
+        "city": "Istanbul",
+        "postal_code": "34394",
+        "country": "TUR",
+        "coordinates": {"latitude": f"{40.9 + (i % 1000) / 5000:.5f}", "longitude": f"{28.9 + (i // 1000) / 5000:.5f}"},
+        "time_zone": "Europe/Istanbul",
+        "evses": [
+            {
+                "uid": f"E{i:07d}-{e}",
+                "status": "AVAILABLE",
+                "connectors": [{
+                    "id": "1",
+                    "standard": "IEC_62196_T2_COMBO",
+                    "format": "CABLE",
+                    "power_type": "DC",
+                    "max_voltage": 920,
+                    "max_amperage": 200,
+                    "max_electric_power": 150000,
+                }],
+            }
+            for e in range(evses)
+        ],
+    }
+
+
+def percentile(samples, p):
+    return statistics.quantiles(samples, n=100, method="inclusive")[p - 1] if len(samples) > 1 else samples[0]
+
+
+async def burst(name, client, headers, locations, updates, concurrency):
+    base = "/api/ocpi/2.3.0/locations/TR/BNC"
+    queue = asyncio.Queue()
+    for _ in range(updates):
+        queue.put_nowait((random.choice(locations), random.choice(STATUSES)))
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            location, status = queue.get_nowait()
+            evse = random.choice(location["evses"])
+            now = datetime.now(timezone.utc).isoformat()
+            started = time.perf_counter()
+            if name == "patch":
+                response = await client.patch(
+                    f"{base}/{location['id']}/{evse['uid']}",
+                    json={"status": status, "last_updated": now}, headers=headers
+                )
+            else:
+                evse["status"] = status
+                response = await client.put(f"{base}/{location['id']}", json=location, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += response.status_code != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:>6} {updates:>8} {updates / elapsed:>10.0f} {percentile(latencies, 50):>8.2f} "
+        f"{percentile(latencies, 95):>8.2f} {percentile(latencies, 99):>8.2f} {errors:>7}"
+    )
+
+
+def snapshot_timings(count):
+    from evse_status import EvseStatusStore
+
+    store = EvseStatusStore(None)
+    rng = random.Random(1)
+    started = time.perf_counter()
+    for i in range(count):
+        store.set("TR", "BNC", f"LOC{i // 6:07d}", f"E{i // 6:07d}-{i % 6}", rng.choice(STATUSES), "2024-01-01T00:00:00Z")
+    print(f"status store of {count} EVSEs filled in {time.perf_counter() - started:.1f} s")
+    for name, evses_from in (("cold", 0), ("warm", 0), ("statuses only", count)):
+        started = time.perf_counter()
+        size = len(store.snapshot(evses_from))
+        print(f"  snapshot {name:>13}: {(time.perf_counter() - started) * 1000:8.1f} ms  {size / 1e6:6.1f} MB")
+
+
+async def run(args):
+    import httpx
+    import server
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+    await server.run_migrations(server.db)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        registration = (await client.post("/api/organizations/register", json={
+            "name": "Benchmark CPO", "country_code": "TR", "party_id": "BNC", "role": "CPO"
+        })).json()
+        headers = {"Authorization": f"Bearer {registration['api_token']}"}
+
+        locations = [make_location(i, args.evses) for i in range(args.locations)]
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def seed(location):
+            async with semaphore:
+                await client.put(f"/api/ocpi/2.3.0/locations/TR/BNC/{location['id']}", json=location, headers=headers)
+        await asyncio.gather(*(seed(location) for location in locations))
+
+        print(f"{args.locations} locations x {args.evses} EVSEs, concurrency {args.concurrency}")
+        print(f"{'path':>6} {'updates':>8} {'updates/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        await burst("patch", client, headers, locations, args.updates, args.concurrency)
+        await burst("put", client, headers, locations, args.updates, args.concurrency)
+        await server.evse_status.flush()
+
+        await server.evse_status.load()
+        latencies = []
+        for _ in range(100):
+            started = time.perf_counter()
+            response = await client.get("/api/ocpi/2.3.0/locations/availability", headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(
+            f"availability of {response.json()['data']['count']} EVSEs: "
+            f"p50 {percentile(latencies, 50):.2f} ms, p95 {percentile(latencies, 95):.2f} ms"
+        )
+    await server.client.drop_database(os.environ["DB_NAME"])
+    if args.snapshot_evses:
+        snapshot_timings(args.snapshot_evses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--locations", type=int, default=2000)
+    parser.add_argument("--evses", type=int, default=6)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--snapshot-evses", type=int, default=1000000, help="0 to skip the in-memory snapshot timings")
+    parser.add_argument("--db", default="ocpi_benchmark")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    # Always use a dedicated database: it is dropped before and after the run
+    os.environ["DB_NAME"] = args.db
+    # A single benchmark party would otherwise be throttled
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Live feed fan-out benchmark
+
+Runs the live feed in-process with --subscribers SSE consumers and publishes
+--rate EVSE status events per second for --duration seconds. Every consumer
+pulls frames from its own generator, as the StreamingResponse of
+/api/live/events would. A share of them (--slow) only reads every
+--slow-delay seconds, like a client behind a bad link; they get bigger
+batches or, when they fall a full ring behind, a reset event. Reports the
+CPU time the hub spent per second of wall time, frames and bytes written,
+and resets. No MongoDB is needed.
+
+Usage: python benchmarks/live_feed_bench.py [--subscribers 5000] [--rate 2000] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from live_feed import LiveFeed, party_key  # noqa: E402
+
+
+async def run(args):
+    feed = LiveFeed(capacity=args.capacity, interval=args.interval, max_subscribers=args.subscribers)
+    ticker = asyncio.create_task(feed.run())
+    frames = 0
+    written = 0
+
+    async def consume(i, slow):
+        nonlocal frames, written
+        # Partners see their own sessions; everyone sees EVSE statuses
+        subscription = feed.subscribe(f"org{i}", party_key("TR", f"P{i % 100:02d}"))
+        async for frame in feed.sse(subscription):
+            frames += 1
+            written += len(frame)
+            if slow:
+                await asyncio.sleep(args.slow_delay)
+
+    slow_count = int(args.subscribers * args.slow)
+    consumers = [asyncio.create_task(consume(i, i < slow_count)) for i in range(args.subscribers)]
+    await asyncio.sleep(0.1)
+
+    published = 0
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    while time.perf_counter() - started < args.duration:
+        tick = time.perf_counter()
+        for _ in range(int(args.rate / 10)):
+            published += 1
+            feed.publish("evse_status", {
+                "country_code": "TR", "party_id": f"P{published % 100:02d}", "location_id": f"LOC{published % 5000}",
+                "evse_uid": f"EVSE{published % 5000}", "status": "CHARGING" if published % 2 else "AVAILABLE",
+                "last_updated": datetime.now(timezone.utc),
+            })
+        await asyncio.sleep(max(0.0, 0.1 - (time.perf_counter() - tick)))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    stats = feed.stats()
+
+    print(f"{args.subscribers} subscribers ({slow_count} slow), {published / elapsed:.0f} events/s for {elapsed:.1f} s")
+    print(f"hub CPU: {cpu / elapsed * 100:.0f}% of one core, {cpu / max(published, 1) * 1e6:.1f} us per published event")
+    print(f"written: {frames / elapsed:.0f} frames/s, {written / elapsed / 1e6:.1f} MB/s, "
+          f"{published * args.subscribers / max(frames, 1):.0f} events per frame")
+    print(f"max lag {stats['max_lag']} events, resets {stats['resets']}")
+
+    for task in consumers:
+        task.cancel()
+    ticker.cancel()
+    await asyncio.gather(*consumers, ticker, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--rate", type=int, default=2000, help="published events per second")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between subscriber wake-ups")
+    parser.add_argument("--capacity", type=int, default=10000, help="events kept in the ring")
+    parser.add_argument("--slow", type=float, default=0.05, help="share of slow subscribers")
+    parser.add_argument("--slow-delay", type=float, default=10.0, help="seconds a slow subscriber takes per frame")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
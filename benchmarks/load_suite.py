@@ -0,0 +1,846 @@
+#!/usr/bin/env python3
+"""
+OCPI endpoint load-test suite
+
+Seeds a MongoDB database with a realistic OCPI data set, drives the hub with
+concurrent clients and reports throughput and p50/p95/p99 latency for every
+OCPI endpoint. Results are saved as JSON along with the git commit, the data
+set and the run settings, so runs of different commits can be compared:
+
+    python benchmarks/load_suite.py --scale small
+    git checkout <other commit>
+    python benchmarks/load_suite.py --scale small --compare benchmarks/results/<commit>.json
+
+Data sets (--scale; --locations, --sessions, --tokens, --cdrs, --tariffs
+override single counts), spread over 20 CPOs and 20 eMSPs:
+
+    tiny      200 locations,   2k sessions,  500 tokens,  500 CDRs
+    small      5k locations,  50k sessions,  10k tokens,  20k CDRs
+    medium    50k locations, 500k sessions, 100k tokens, 200k CDRs
+    full     500k locations,   5M sessions,   1M tokens,   2M CDRs
+
+Seeding is deterministic (--seed). Documents are bulk-inserted straight into
+Mongo, and then the migrations build the indexes. The database is kept and
+reused by later runs with the same data set; --reseed forces a new one. Use a
+dedicated --db: a database seeded with other settings is dropped.
+
+Mongo comes from MONGO_URL (default mongodb://localhost:27017). With
+--spawn-mongod, a throwaway mongod from PATH is started on a free port
+(--dbpath keeps its data between runs). By default the app runs in process
+behind httpx's ASGI transport, including its startup and shutdown hooks.
+--url targets a running hub instead; that hub must use the same database.
+--mock runs the in-process app against an in-memory mongomock-motor
+database instead, so the suite needs no mongod, e.g. in CI (default scale
+tiny). Mock timings say nothing about Mongo; use mock runs to catch broken
+scenarios (the suite then exits with status 1 on unexpected responses), and
+compare them only with other mock runs.
+
+For each scenario, --warmup requests are sent first, then --requests are
+timed, spread over --concurrency closed-loop clients. In process, the suite
+also reports the mean number of Mongo commands per request, taken from the
+/metrics instrumentation. That count does not depend on the machine, so it
+reliably flags added queries.
+
+--compare exits with status 1 when any scenario regresses by more than
+--threshold percent:
+- throughput dropped, or
+- p95 latency grew, or
+- the Mongo command count grew.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from geo import location_search_fields  # noqa: E402
+from session_updates import PERIODS_COLLECTION, session_key  # noqa: E402
+
+SCALES = {
+    "tiny": {"locations": 200, "sessions": 2_000, "tokens": 500, "cdrs": 500, "tariffs": 10},
+    "small": {"locations": 5_000, "sessions": 50_000, "tokens": 10_000, "cdrs": 20_000, "tariffs": 50},
+    "medium": {"locations": 50_000, "sessions": 500_000, "tokens": 100_000, "cdrs": 200_000, "tariffs": 200},
+    "full": {"locations": 500_000, "sessions": 5_000_000, "tokens": 1_000_000, "cdrs": 2_000_000, "tariffs": 500},
+}
+# Bump when the generated documents change, so older seeded databases are not reused
+DATASET_VERSION = 1
+PARTIES = 20
+SEED_COLLECTION = "benchmark_seed"
+CHUNK = 5000
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# The last 1% of sessions are still charging
+ACTIVE_SHARE = 0.01
+
+STATUSES = ["AVAILABLE", "AVAILABLE", "AVAILABLE", "CHARGING", "CHARGING", "OUTOFORDER", "BLOCKED"]
+CONNECTORS = [
+    ("IEC_62196_T2", "SOCKET", "AC_3_PHASE", 400, 32, 22000),
+    ("IEC_62196_T2_COMBO", "CABLE", "DC", 920, 200, 150000),
+    ("CHADEMO", "CABLE", "DC", 500, 125, 50000),
+]
+CITIES = [
+    ("Istanbul", "34000", 41.01, 28.97), ("Ankara", "06000", 39.93, 32.86), ("Izmir", "35000", 38.42, 27.14),
+    ("Bursa", "16000", 40.19, 29.06), ("Antalya", "07000", 36.89, 30.71), ("Konya", "42000", 37.87, 32.48),
+]
+
+
+# Parties: CPO n owns every location/session/CDR/tariff whose index is n modulo PARTIES,
+# eMSP n every token whose index is n modulo PARTIES.
+def cpo_party(n: int) -> str:
+    return f"C{n:02d}"
+
+
+def emsp_party(n: int) -> str:
+    return f"E{n:02d}"
+
+
+def organization(role: str, n: int) -> Dict[str, Any]:
+    party = cpo_party(n) if role == "CPO" else emsp_party(n)
+    return {
+        "id": f"bench-{role.lower()}-{n:02d}",
+        "name": f"Benchmark {role} {n}",
+        "country_code": "TR",
+        "party_id": party,
+        "role": role,
+        "business_details": {"name": f"Benchmark {role} {n}"},
+        "api_token": f"bench-{role.lower()}-token-{n:02d}",
+        "created_at": EPOCH,
+        "updated_at": EPOCH,
+    }
+
+
+def location_id(i: int) -> str:
+    return f"LOC{i:07d}"
+
+
+def token_uid(k: int) -> str:
+    return f"{k:014X}"
+
+
+def make_location(i: int, rng: random.Random, counts: Dict[str, int]) -> Dict[str, Any]:
+    owner = i % PARTIES
+    city, postal_code, lat, lon = CITIES[i % len(CITIES)]
+    last_updated = EPOCH + timedelta(seconds=i)
+    tariffs = [t for t in range(owner, counts["tariffs"], PARTIES)]
+    evses = []
+    for e in range(rng.randint(1, 6)):
+        standard, fmt, power_type, voltage, amperage, power = rng.choice(CONNECTORS)
+        evses.append({
+            "uid": f"{location_id(i)}-E{e}",
+            "evse_id": f"TR*{cpo_party(owner)}*E{i:07d}{e}",
+            "status": rng.choice(STATUSES),
+            "capabilities": ["RFID_READER", "REMOTE_START_STOP_CAPABLE"],
+            "connectors": [{
+                "id": "1",
+                "standard": standard,
+                "format": fmt,
+                "power_type": power_type,
+                "max_voltage": voltage,
+                "max_amperage": amperage,
+                "max_electric_power": power,
+                "tariff_ids": [f"TAR{rng.choice(tariffs):04d}"] if tariffs else None,
+                "last_updated": last_updated,
+            }],
+            "last_updated": last_updated,
+        })
+    location = {
+        "country_code": "TR",
+        "party_id": cpo_party(owner),
+        "id": location_id(i),
+        "publish": True,
+        "name": f"{city} Station {i}",
+        "address": f"Benchmark Cd. No:{i % 500 + 1}",
+        "city": city,
+        "postal_code": postal_code,
+        "country": "TUR",
+        "coordinates": {
+            "latitude": f"{lat + rng.uniform(-0.2, 0.2):.6f}",
+            "longitude": f"{lon + rng.uniform(-0.2, 0.2):.6f}",
+        },
+        "parking_type": "ON_STREET",
+        "evses": evses,
+        "facilities": ["CAFE"] if i % 3 == 0 else [],
+        "time_zone": "Europe/Istanbul",
+        "charging_when_closed": True,
+        "last_updated": last_updated,
+        "owner_org_id": organization("CPO", owner)["id"],
+        "created_at": last_updated,
+    }
+    location.update(location_search_fields(location))
+    return location
+
+
+def session_times(j: int, counts: Dict[str, int]) -> Tuple[datetime, bool]:
+    return EPOCH + timedelta(seconds=30 * j), j >= counts["sessions"] * (1 - ACTIVE_SHARE)
+
+
+def session_parts(j: int, rng: random.Random, counts: Dict[str, int]) -> Dict[str, Any]:
+    # Fields shared by a session and its CDR
+    owner, emsp = j % PARTIES, (j // PARTIES) % PARTIES
+    loc = owner + PARTIES * rng.randrange(max(1, (counts["locations"] - owner + PARTIES - 1) // PARTIES))
+    tok = emsp + PARTIES * rng.randrange(max(1, (counts["tokens"] - emsp + PARTIES - 1) // PARTIES))
+    start, active = session_times(j, counts)
+    minutes = rng.randint(10, 180)
+    kwh = round(rng.uniform(3, 80), 3)
+    return {
+        "owner": owner,
+        "emsp": emsp,
+        "location_id": location_id(loc),
+        "evse_uid": f"{location_id(loc)}-E0",
+        "cdr_token": {
+            "country_code": "TR",
+            "party_id": emsp_party(emsp),
+            "uid": token_uid(tok),
+            "type": "RFID",
+            "contract_id": f"TR-{emsp_party(emsp)}-C{tok:08d}",
+        },
+        "start": start,
+        "end": None if active else start + timedelta(minutes=minutes),
+        "active": active,
+        "kwh": kwh,
+        "cost": round(kwh * 7.5, 2),
+    }
+
+
+def make_session(j: int, rng: random.Random, counts: Dict[str, int]) -> Dict[str, Any]:
+    p = session_parts(j, rng, counts)
+    last_updated = p["end"] or p["start"]
+    return {
+        "country_code": "TR",
+        "party_id": cpo_party(p["owner"]),
+        "id": f"S{j:09d}",
+        "start_date_time": p["start"],
+        "end_date_time": p["end"],
+        "kwh": p["kwh"],
+        "cdr_token": p["cdr_token"],
+        "auth_method": "WHITELIST",
+        "location_id": p["location_id"],
+        "evse_uid": p["evse_uid"],
+        "connector_id": "1",
+        "currency": "TRY",
+        "total_cost": None if p["active"] else {"excl_vat": p["cost"], "incl_vat": round(p["cost"] * 1.2, 2)},
+        "status": "ACTIVE" if p["active"] else "COMPLETED",
+        "last_updated": last_updated,
+        "location_owner_id": organization("CPO", p["owner"])["id"],
+        "emsp_id": organization("EMSP", p["emsp"])["id"],
+        "hub_updated_at": last_updated,
+        "created_at": p["start"],
+    }
+
+
+def make_periods(j: int, rng: random.Random, counts: Dict[str, int]) -> Dict[str, Any]:
+    start, _ = session_times(j, counts)
+    periods = [
+        {"start_date_time": start + timedelta(minutes=15 * n), "dimensions": [{"type": "ENERGY", "volume": 4.2}]}
+        for n in range(3)
+    ]
+    return {"session_key": session_key("TR", cpo_party(j % PARTIES), f"S{j:09d}"), "count": len(periods), "periods": periods}
+
+
+def make_cdr(c: int, rng: random.Random, counts: Dict[str, int]) -> Dict[str, Any]:
+    p = session_parts(c, rng, counts)
+    end = p["end"] or p["start"] + timedelta(hours=1)
+    return {
+        "country_code": "TR",
+        "party_id": cpo_party(p["owner"]),
+        "id": f"CDR{c:09d}",
+        "start_date_time": p["start"],
+        "end_date_time": end,
+        "session_id": f"S{c:09d}",
+        "cdr_token": p["cdr_token"],
+        "auth_method": "WHITELIST",
+        "cdr_location": {
+            "id": p["location_id"],
+            "address": "Benchmark Cd.",
+            "city": "Istanbul",
+            "postal_code": "34000",
+            "country": "TUR",
+            "coordinates": {"latitude": "41.010000", "longitude": "28.970000"},
+            "evse_uid": p["evse_uid"],
+            "evse_id": f"TR*{cpo_party(p['owner'])}*{p['evse_uid']}",
+            "connector_id": "1",
+            "connector_standard": "IEC_62196_T2",
+            "connector_format": "SOCKET",
+            "connector_power_type": "AC_3_PHASE",
+        },
+        "currency": "TRY",
+        "charging_periods": [
+            {"start_date_time": p["start"], "dimensions": [{"type": "ENERGY", "volume": p["kwh"]}]}
+        ],
+        "total_cost": {"excl_vat": p["cost"], "incl_vat": round(p["cost"] * 1.2, 2)},
+        "total_energy": p["kwh"],
+        "total_time": round((end - p["start"]).total_seconds() / 3600, 3),
+        "last_updated": end,
+        "location_owner_id": organization("CPO", p["owner"])["id"],
+        "emsp_id": organization("EMSP", p["emsp"])["id"],
+    }
+
+
+def make_token(k: int, rng: random.Random, counts: Dict[str, int]) -> Dict[str, Any]:
+    emsp = k % PARTIES
+    return {
+        "country_code": "TR",
+        "party_id": emsp_party(emsp),
+        "uid": token_uid(k),
+        "type": "RFID",
+        "contract_id": f"TR-{emsp_party(emsp)}-C{k:08d}",
+        "issuer": f"Benchmark EMSP {emsp}",
+        "valid": k % 50 != 0,
+        "whitelist": rng.choice(["ALLOWED", "ALLOWED", "ALLOWED_OFFLINE", "NEVER"]),
+        "last_updated": EPOCH + timedelta(seconds=k),
+        "emsp_id": organization("EMSP", emsp)["id"],
+        "created_at": EPOCH,
+    }
+
+
+def make_tariff(t: int, rng: random.Random, counts: Dict[str, int]) -> Dict[str, Any]:
+    owner = t % PARTIES
+    return {
+        "country_code": "TR",
+        "party_id": cpo_party(owner),
+        "id": f"TAR{t:04d}",
+        "currency": "TRY",
+        "elements": [
+            {"price_components": [{"type": "ENERGY", "price": round(rng.uniform(4, 6), 2), "vat": 20, "step_size": 1}],
+             "restrictions": {"start_time": "23:00", "end_time": "07:00"}},
+            {"price_components": [{"type": "ENERGY", "price": round(rng.uniform(6, 9), 2), "vat": 20, "step_size": 100},
+                                  {"type": "FLAT", "price": 5, "vat": 20, "step_size": 1}]},
+            {"price_components": [{"type": "PARKING_TIME", "price": 12, "vat": 20, "step_size": 300}]},
+        ],
+        "last_updated": EPOCH + timedelta(seconds=t),
+        "owner_org_id": organization("CPO", owner)["id"],
+    }
+
+
+# collection, count key, document builder
+SEED_PLAN = [
+    ("locations", "locations", make_location),
+    ("tariffs", "tariffs", make_tariff),
+    ("tokens", "tokens", make_token),
+    ("sessions", "sessions", make_session),
+    (PERIODS_COLLECTION, "sessions", make_periods),
+    ("cdrs", "cdrs", make_cdr),
+]
+
+
+async def seed_collection(db, name, count, build, counts, seed, writers=4):
+    semaphore = asyncio.Semaphore(writers)
+    tasks = []
+    started = time.perf_counter()
+
+    async def write(docs):
+        async with semaphore:
+            await db[name].insert_many(docs, ordered=False)
+
+    for start in range(0, count, CHUNK):
+        # One generator per chunk keeps the data independent of write concurrency
+        rng = random.Random(f"{seed}:{name}:{start}")
+        docs = [build(i, rng, counts) for i in range(start, min(start + CHUNK, count))]
+        tasks.append(asyncio.create_task(write(docs)))
+        # Bound the number of generated chunks waiting for a writer
+        if len(tasks) >= writers * 2:
+            await tasks.pop(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<26} {count:>10} in {elapsed:7.1f} s ({count / max(elapsed, 1e-9):,.0f}/s)")
+
+
+async def seed(db, client, db_name, counts, seed_value, reseed):
+    """Seed the data set unless the database already holds exactly this one."""
+    from migrations import run_migrations
+
+    dataset = {"version": DATASET_VERSION, "seed": seed_value, "parties": PARTIES, **counts}
+    manifest = await db[SEED_COLLECTION].find_one({"_id": "dataset"})
+    if manifest and manifest["dataset"] == dataset and not reseed:
+        print(f"Reusing seeded database {db_name} (seeded {manifest['seeded_at']:%Y-%m-%d %H:%M})")
+        await run_migrations(db)
+        return dataset
+
+    print(f"Seeding {db_name}: " + ", ".join(f"{counts[k]:,} {k}" for k in ("locations", "sessions", "tokens", "cdrs", "tariffs")))
+    await client.drop_database(db_name)
+    started = time.perf_counter()
+    await db.organizations.insert_many(
+        [organization(role, n) for role in ("CPO", "EMSP") for n in range(PARTIES)]
+    )
+    for name, count_key, build in SEED_PLAN:
+        await seed_collection(db, name, counts[count_key], build, counts, seed_value)
+    # Indexes are cheaper to build once the data is in
+    migrated = time.perf_counter()
+    await run_migrations(db)
+    print(f"  indexes and migrations      {time.perf_counter() - migrated:7.1f} s")
+    await db[SEED_COLLECTION].replace_one(
+        {"_id": "dataset"},
+        {"dataset": dataset, "seeded_at": datetime.now(timezone.utc),
+         "duration_s": round(time.perf_counter() - started, 1)},
+        upsert=True
+    )
+    return dataset
+
+
+# Scenarios
+@dataclass
+class Context:
+    counts: Dict[str, int]
+    headers: Dict[str, Dict[str, str]]
+
+    def owned(self, rng: random.Random, count_key: str, lo: int = 0) -> int:
+        # An index owned by party 0 in [lo, count)
+        first = -(-lo // PARTIES) * PARTIES
+        return first + PARTIES * rng.randrange(max(1, (self.counts[count_key] - first + PARTIES - 1) // PARTIES))
+
+
+Request = Tuple[str, str, Dict[str, str], Optional[Any]]
+
+
+@dataclass
+class Scenario:
+    name: str
+    build: Callable[[random.Random, Context, Any], Request]
+    setup: Optional[Callable[[Any, Context], Any]] = None
+    expect: Tuple[int, ...] = (200,)
+    # Uses queries mongomock does not implement ($geoNear, positional projection)
+    mockable: bool = True
+
+
+OCPI = "/api/ocpi/2.3.0"
+
+
+def get(path: str, role: str, ctx: Context, headers: Optional[Dict[str, str]] = None) -> Request:
+    return "GET", OCPI + path, {**ctx.headers[role], **(headers or {})}, None
+
+
+async def walk_location_pages(client, ctx: Context, pages: int = 20) -> List[str]:
+    urls = []
+    url = f"{OCPI}/locations?limit=50"
+    for _ in range(pages):
+        response = await client.get(url, headers=ctx.headers["emsp"])
+        link = response.headers.get("link")
+        if not link:
+            break
+        url = link[1:link.index(">")]
+        urls.append(url)
+    return urls
+
+
+async def locations_etag(client, ctx: Context) -> str:
+    response = await client.get(f"{OCPI}/locations?limit=50", headers=ctx.headers["emsp"])
+    return response.headers["etag"]
+
+
+def evse(rng: random.Random, ctx: Context) -> Tuple[str, str]:
+    # Every seeded location has at least EVSE 0
+    loc = location_id(ctx.owned(rng, "locations"))
+    return f"/locations/TR/{cpo_party(0)}/{loc}", f"{loc}-E0"
+
+
+def location_search(rng: random.Random, ctx: Context, _) -> Request:
+    _, _, lat, lon = rng.choice(CITIES)
+    return get(f"/locations/search?latitude={lat}&longitude={lon}&radius=5000&limit=20", "emsp", ctx)
+
+
+def evse_patch(rng: random.Random, ctx: Context, _) -> Request:
+    location, evse_uid = evse(rng, ctx)
+    body = {"status": rng.choice(STATUSES), "last_updated": datetime.now(timezone.utc).isoformat()}
+    return "PATCH", f"{OCPI}{location}/{evse_uid}", ctx.headers["cpo"], body
+
+
+def session_patch(rng: random.Random, ctx: Context, _) -> Request:
+    j = ctx.owned(rng, "sessions", int(ctx.counts["sessions"] * (1 - ACTIVE_SHARE)))
+    body = {"kwh": round(rng.uniform(1, 80), 3), "last_updated": datetime.now(timezone.utc).isoformat()}
+    return "PATCH", f"{OCPI}/sessions/TR/{cpo_party(0)}/S{j:09d}", ctx.headers["cpo"], body
+
+
+def token_put(rng: random.Random, ctx: Context, _) -> Request:
+    k = ctx.owned(rng, "tokens")
+    token = make_token(k, rng, ctx.counts)
+    body = {
+        **{f: token[f] for f in ("country_code", "party_id", "uid", "type", "contract_id", "issuer", "valid", "whitelist")},
+        "last_updated": datetime.now(timezone.utc).isoformat(),
+    }
+    return "PUT", f"{OCPI}/tokens/TR/{emsp_party(0)}/{token['uid']}", ctx.headers["emsp"], body
+
+
+def token_authorize(rng: random.Random, ctx: Context, _) -> Request:
+    headers = {**ctx.headers["cpo"], "OCPI-to-country-code": "TR", "OCPI-to-party-id": emsp_party(0)}
+    return "POST", f"{OCPI}/tokens/{token_uid(ctx.owned(rng, 'tokens'))}/authorize", headers, None
+
+
+SCENARIOS = [
+    Scenario("credentials.get", lambda rng, ctx, _: get("/credentials", "cpo", ctx)),
+    Scenario("locations.list", lambda rng, ctx, _: get("/locations?limit=50", "emsp", ctx)),
+    Scenario(
+        "locations.list.cursor",
+        lambda rng, ctx, urls: ("GET", rng.choice(urls), ctx.headers["emsp"], None),
+        setup=walk_location_pages,
+    ),
+    Scenario(
+        "locations.list.304",
+        lambda rng, ctx, tag: get("/locations?limit=50", "emsp", ctx, {"If-None-Match": tag}),
+        setup=locations_etag,
+        expect=(304,),
+    ),
+    Scenario("locations.search", location_search, mockable=False),
+    Scenario("locations.object", lambda rng, ctx, _: get(evse(rng, ctx)[0], "emsp", ctx)),
+    Scenario("locations.evse", lambda rng, ctx, _: get("/".join(evse(rng, ctx)), "emsp", ctx), mockable=False),
+    Scenario(
+        "locations.connector",
+        lambda rng, ctx, _: get("/".join(evse(rng, ctx)) + "/1", "emsp", ctx),
+        mockable=False,
+    ),
+    Scenario("sessions.list", lambda rng, ctx, _: get("/sessions?limit=50", "cpo", ctx)),
+    Scenario(
+        "sessions.object",
+        lambda rng, ctx, _: get(f"/sessions/TR/{cpo_party(0)}/S{ctx.owned(rng, 'sessions'):09d}", "cpo", ctx),
+    ),
+    Scenario("cdrs.list", lambda rng, ctx, _: get("/cdrs?limit=50", "emsp", ctx)),
+    Scenario("tariffs.list", lambda rng, ctx, _: get("/tariffs?limit=50", "emsp", ctx)),
+    Scenario(
+        "tariffs.object",
+        lambda rng, ctx, _: get(f"/tariffs/TR/{cpo_party(0)}/TAR{ctx.owned(rng, 'tariffs'):04d}", "cpo", ctx),
+    ),
+    Scenario("tokens.list", lambda rng, ctx, _: get("/tokens?limit=50", "emsp", ctx)),
+    Scenario(
+        "tokens.object",
+        lambda rng, ctx, _: get(f"/tokens/TR/{emsp_party(0)}/{token_uid(ctx.owned(rng, 'tokens'))}", "emsp", ctx),
+    ),
+    Scenario("tokens.authorize", token_authorize),
+    # Writes last, so they do not invalidate the validators the reads above rely on
+    Scenario("locations.evse.patch", evse_patch),
+    Scenario("sessions.patch", session_patch),
+    Scenario("tokens.put", token_put),
+]
+
+
+def request_mongo_calls() -> Tuple[float, float]:
+    """Sum and count of the per-request Mongo command histogram (in-process runs only)."""
+    import metrics
+
+    total = count = 0.0
+    for family in metrics.REGISTRY.collect():
+        if family.name == "ocpi_request_mongo_calls":
+            for sample in family.samples:
+                if sample.name.endswith("_sum"):
+                    total += sample.value
+                elif sample.name.endswith("_count"):
+                    count += sample.value
+    return total, count
+
+
+async def drive(
+    client, requests: List[Request], concurrency: int, latencies: List[float], statuses: Dict[int, int],
+    failures: List[str]
+):
+    pending = iter(requests)
+
+    async def worker():
+        # Workers share one iterator: each request is sent exactly once
+        for method, url, headers, body in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, headers=headers, json=body)
+                status = response.status_code
+            except Exception as e:
+                # Transport errors, or exceptions raised by the in-process app
+                status = 0
+                failures.append(repr(e))
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_scenario(client, scenario: Scenario, ctx: Context, args, in_process: bool) -> Dict[str, Any]:
+    rng = random.Random(f"{args.seed}:{scenario.name}")
+    data = await scenario.setup(client, ctx) if scenario.setup else None
+    # Requests are built up front so building them is not timed
+    requests = [scenario.build(rng, ctx, data) for _ in range(args.warmup + args.requests)]
+    await drive(client, requests[:args.warmup], args.concurrency, [], {}, [])
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    failures: List[str] = []
+    calls_before = request_mongo_calls() if in_process else None
+    started = time.perf_counter()
+    await drive(client, requests[args.warmup:], args.concurrency, latencies, statuses, failures)
+    elapsed = time.perf_counter() - started
+
+    mongo_calls = None
+    if calls_before is not None:
+        total, count = request_mongo_calls()
+        if count > calls_before[1]:
+            mongo_calls = round((total - calls_before[0]) / (count - calls_before[1]), 2)
+    q = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status not in scenario.expect),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(q[49], 3),
+        "p95_ms": round(q[94], 3),
+        "p99_ms": round(q[98], 3),
+        "max_ms": round(max(latencies), 3),
+        "mongo_calls": mongo_calls,
+        "first_failure": failures[0] if failures else None,
+    }
+
+
+# Results
+def git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def environment(mongo_version: str, target: str) -> Dict[str, Any]:
+    commit = git("rev-parse", "HEAD")
+    return {
+        "commit": commit,
+        "subject": git("log", "-1", "--format=%s"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mongo": mongo_version,
+        "target": target,
+    }
+
+
+def print_table(results: Dict[str, Dict[str, Any]]):
+    print(f"{'scenario':<24} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'errors':>7} {'mongo':>6}")
+    for name, r in results.items():
+        calls = "" if r["mongo_calls"] is None else f"{r['mongo_calls']:.2f}"
+        print(f"{name:<24} {r['requests']:>8} {r['rps']:>8.0f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+              f"{r['p99_ms']:>8.2f} {r['max_ms']:>8.1f} {r['errors']:>7} {calls:>6}")
+
+
+def change(new: float, old: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def compare(run: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> int:
+    base_env, env = baseline["environment"], run["environment"]
+    print(f"\nCompared with {base_env['commit'][:12]} ({base_env['subject']})")
+    for key in ("settings", "dataset"):
+        if baseline[key] != run[key]:
+            print(f"  warning: {key} differ: {baseline[key]} -> {run[key]}")
+    for key in ("cpus", "mongo", "target"):
+        if base_env.get(key) != env.get(key):
+            print(f"  warning: {key} differs: {base_env.get(key)} -> {env.get(key)}")
+
+    regressions = 0
+    print(f"{'scenario':<24} {'req/s':>17} {'Δ':>7} {'p95 ms':>17} {'Δ':>7} {'mongo':>11}")
+    for name, r in run["scenarios"].items():
+        b = baseline["scenarios"].get(name)
+        if b is None:
+            print(f"{name:<24} (new)")
+            continue
+        rps, p95 = change(r["rps"], b["rps"]), change(r["p95_ms"], b["p95_ms"])
+        calls = ""
+        more_calls = False
+        if r["mongo_calls"] is not None and b["mongo_calls"] is not None:
+            calls = f"{b['mongo_calls']:.2f}->{r['mongo_calls']:.2f}"
+            more_calls = r["mongo_calls"] > b["mongo_calls"] * (1 + threshold / 100)
+        regressed = rps < -threshold or p95 > threshold or more_calls
+        regressions += regressed
+        print(f"{name:<24} {b['rps']:>8.0f}->{r['rps']:<8.0f} {rps:>+6.1f}% {b['p95_ms']:>8.2f}->{r['p95_ms']:<8.2f} "
+              f"{p95:>+6.1f}% {calls:>11} {'REGRESSION' if regressed else ''}")
+    return regressions
+
+
+# Mongo
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_mongod(dbpath: str) -> Tuple[subprocess.Popen, str]:
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    binary = os.environ.get("MONGOD", shutil.which("mongod"))
+    if not binary:
+        sys.exit("mongod not found on PATH (or set MONGOD to its path)")
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"mongodb://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            MongoClient(url, serverSelectionTimeoutMS=500).admin.command("ping")
+            return process, url
+        except PyMongoError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                sys.exit(f"mongod did not start (exit code {process.poll()})")
+
+
+async def run(args, counts) -> Dict[str, Any]:
+    import httpx
+
+    in_process = args.url is None
+    if in_process:
+        import logging
+
+        if args.mock:
+            import motor.motor_asyncio
+            from mongomock_motor import AsyncMongoMockClient
+
+            # Picked up by server when it creates its client
+            motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+            # No change streams: the event bus keeps retrying them while it delivers in process
+            logging.getLogger("events").setLevel(logging.CRITICAL)
+        import server
+
+        client, db = server.client, server.db
+        logging.getLogger().setLevel(logging.WARNING)
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db = client[args.db]
+
+    dataset = await seed(db, client, args.db, counts, args.seed, args.reseed)
+    if args.mock:
+        mongo_version = "mongomock"
+    else:
+        mongo_version = (await client.admin.command("buildInfo")).get("version", "unknown")
+    ctx = Context(counts, {
+        "cpo": {"Authorization": f"Bearer {organization('CPO', 0)['api_token']}"},
+        "emsp": {"Authorization": f"Bearer {organization('EMSP', 0)['api_token']}"},
+    })
+    scenarios = [s for s in SCENARIOS if not args.only or any(fnmatch.fnmatch(s.name, p) for p in args.only)]
+    if args.mock:
+        skipped = [s.name for s in scenarios if not s.mockable]
+        scenarios = [s for s in scenarios if s.mockable]
+        if skipped:
+            print(f"Skipped with --mock: {', '.join(skipped)}")
+
+    if in_process:
+        await server.app.router.startup()
+        transport = httpx.ASGITransport(app=server.app)
+        http = httpx.AsyncClient(transport=transport, base_url="http://bench", limits=httpx.Limits(max_connections=None), timeout=60)
+    else:
+        http = httpx.AsyncClient(base_url=args.url, limits=httpx.Limits(max_connections=args.concurrency), timeout=60)
+
+    print(f"\n{len(scenarios)} scenarios, {args.requests} requests each ({args.warmup} warm-up), "
+          f"concurrency {args.concurrency}, {'in process' if in_process else args.url}")
+    results = {}
+    try:
+        async with http:
+            for scenario in scenarios:
+                # mongomock bypasses the command listener, so there are no Mongo calls to count
+                results[scenario.name] = await run_scenario(http, scenario, ctx, args, in_process and not args.mock)
+                r = results[scenario.name]
+                if r["errors"]:
+                    print(f"  {scenario.name}: {r['errors']} unexpected responses {r['statuses']}"
+                          + (f", e.g. {r['first_failure']}" if r["first_failure"] else ""))
+    finally:
+        if in_process:
+            await server.app.router.shutdown()
+        else:
+            client.close()
+
+    return {
+        "environment": environment(mongo_version, "in-process" if in_process else args.url),
+        "settings": {"concurrency": args.concurrency, "requests": args.requests, "warmup": args.warmup},
+        "dataset": dataset,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=SCALES, help="data set size (default: small, tiny with --mock)")
+    for kind in ("locations", "sessions", "tokens", "cdrs", "tariffs"):
+        parser.add_argument(f"--{kind}", type=int, help=f"number of {kind} (overrides --scale)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reseed", action="store_true", help="seed again even if the database matches")
+    parser.add_argument("--db", default="ocpi_load_suite")
+    parser.add_argument("--spawn-mongod", action="store_true", help="start a throwaway mongod from PATH")
+    parser.add_argument("--dbpath", help="data directory for --spawn-mongod (default: temporary)")
+    parser.add_argument("--url", help="benchmark a running hub instead of the in-process app")
+    parser.add_argument("--mock", action="store_true", help="use an in-memory mongomock-motor database")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000, help="timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--only", action="append", help="scenario name pattern, e.g. 'locations.*' (repeatable)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+    if args.mock and (args.url or args.spawn_mongod):
+        parser.error("--mock cannot be combined with --url or --spawn-mongod")
+
+    counts = dict(SCALES[args.scale or ("tiny" if args.mock else "small")])
+    for kind in counts:
+        if getattr(args, kind) is not None:
+            counts[kind] = getattr(args, kind)
+
+    mongod, tmpdir = None, None
+    if args.spawn_mongod:
+        dbpath = args.dbpath or (tmpdir := tempfile.mkdtemp(prefix="ocpi-load-"))
+        os.makedirs(dbpath, exist_ok=True)
+        mongod, os.environ["MONGO_URL"] = spawn_mongod(dbpath)
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ["DB_NAME"] = args.db
+    # Background work that is not part of the request path would only add noise
+    os.environ.setdefault("CDR_PIPELINE_ENABLED", "false")
+    os.environ.setdefault("PUSH_ENABLED", "false")
+    # The suite drives each endpoint from a single party as fast as it can
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+    try:
+        results = asyncio.run(run(args, counts))
+    finally:
+        if mongod:
+            mongod.terminate()
+            mongod.wait()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print()
+    print_table(results["scenarios"])
+    env = results["environment"]
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"{env['commit'][:12] or 'unknown'}{'-dirty' if env['dirty'] else ''}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {os.path.relpath(output)}")
+
+    if args.mock and any(r["errors"] for r in results["scenarios"].values()):
+        # A CI smoke run: the timings do not matter, broken endpoints do
+        sys.exit(1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
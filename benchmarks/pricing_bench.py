@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tariff pricing throughput benchmark
+
+Prices a synthetic day of sessions against a multi-element tariff (time of
+day, kWh, power restrictions and step sizes) and compares the vectorized
+engine with a straightforward per-session, per-period Python loop.
+
+Runs in memory only; no MongoDB needed.
+
+Usage: python benchmarks/pricing_bench.py [--sessions 100000] [--periods 12]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from pricing import CompiledTariffCache, price_batch  # noqa: E402
+
+TARIFF = {
+    "country_code": "TR",
+    "party_id": "BCP",
+    "id": "BENCH",
+    "currency": "TRY",
+    "last_updated": "2024-01-01T00:00:00Z",
+    "elements": [
+        {"price_components": [{"type": "ENERGY", "price": 4.5, "vat": 20, "step_size": 1}],
+         "restrictions": {"start_time": "23:00", "end_time": "07:00"}},
+        {"price_components": [{"type": "ENERGY", "price": 8.9, "vat": 20, "step_size": 100}],
+         "restrictions": {"min_power": 50}},
+        {"price_components": [{"type": "ENERGY", "price": 6.2, "vat": 20, "step_size": 100},
+                              {"type": "FLAT", "price": 5, "vat": 20}]},
+        {"price_components": [{"type": "PARKING_TIME", "price": 12, "vat": 20, "step_size": 300}]},
+    ],
+}
+
+
+def make_sessions(count, periods, seed=1):
+    rng = random.Random(seed)
+    day = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    sessions = []
+    for _ in range(count):
+        start = day + timedelta(seconds=rng.randrange(86400))
+        step = timedelta(minutes=rng.randint(2, 10))
+        power = rng.choice([11, 22, 50, 150])
+        charging_periods = [{
+            "start_date_time": (start + i * step).isoformat(),
+            "dimensions": [{"type": "ENERGY", "volume": round(power * step.total_seconds() / 3600, 3)}]
+        } for i in range(periods)]
+        charging_periods[-1]["dimensions"].append({"type": "PARKING_TIME", "volume": 0.1})
+        sessions.append({
+            "start_date_time": start.isoformat(),
+            "end_date_time": (start + periods * step).isoformat(),
+            "charging_periods": charging_periods,
+        })
+    return sessions
+
+
+def loop_price(session, offset):
+    """Per-period Python loop over the elements (no step sizes), for comparison."""
+    elements = TARIFF["elements"]
+    periods = session["charging_periods"]
+    end = datetime.fromisoformat(session["end_date_time"])
+    totals, flat = {}, None
+    for i, period in enumerate(periods):
+        start = datetime.fromisoformat(period["start_date_time"])
+        stop = datetime.fromisoformat(periods[i + 1]["start_date_time"]) if i + 1 < len(periods) else end
+        hours = (stop - start).total_seconds() / 3600
+        volumes = {d["type"]: d["volume"] for d in period["dimensions"]}
+        power = volumes.get("ENERGY", 0) / hours if hours else 0
+        minute = ((start + timedelta(seconds=offset)).hour * 60 + start.minute)
+        for dimension in ("ENERGY", "PARKING_TIME", "FLAT"):
+            for element in elements:
+                r = element.get("restrictions") or {}
+                if "start_time" in r:
+                    lo = int(r["start_time"][:2]) * 60
+                    hi = int(r["end_time"][:2]) * 60
+                    if not (lo <= minute < hi if lo <= hi else minute >= lo or minute < hi):
+                        continue
+                if power < r.get("min_power", -math.inf):
+                    continue
+                component = next((c for c in element["price_components"] if c["type"] == dimension), None)
+                if component:
+                    if dimension == "FLAT":
+                        flat = flat or (component if i == 0 else None)
+                    else:
+                        totals[dimension] = totals.get(dimension, 0) + volumes.get(dimension, 0) * component["price"]
+                    break
+    return sum(totals.values()) + (flat["price"] if flat else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--periods", type=int, default=12)
+    parser.add_argument("--loop-sample", type=int, default=10000, help="sessions priced by the loop reference")
+    args = parser.parse_args()
+
+    sessions = make_sessions(args.sessions, args.periods)
+    offsets = [10800.0] * len(sessions)
+    cache = CompiledTariffCache()
+    print(f"{args.sessions} sessions x {args.periods} periods")
+
+    started = time.perf_counter()
+    compiled = cache.get(TARIFF)
+    price_batch(compiled, sessions, offsets)
+    elapsed = time.perf_counter() - started
+    print(f"{'vectorized':>11} {elapsed:>8.2f} s {args.sessions / elapsed:>10.0f} sessions/s")
+
+    sample = sessions[:args.loop_sample]
+    started = time.perf_counter()
+    for session in sample:
+        loop_price(session, 10800)
+    loop_elapsed = time.perf_counter() - started
+    rate = len(sample) / loop_elapsed
+    print(f"{'loop':>11} {args.sessions / rate:>8.2f} s {rate:>10.0f} sessions/s (extrapolated from {len(sample)})")
+
+
+if __name__ == "__main__":
+    main()
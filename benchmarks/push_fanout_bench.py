@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Push fan-out benchmark
+
+Starts several stub eMSP partners on localhost (see stub_partner.py), one of
+them slow and unreliable, registers their credentials with the hub and sends
+EVSE status PATCHes from a CPO. Reports per partner how many pushes arrived
+and the delivery latency, showing that the slow partner does not hold back
+the others.
+
+Requires a reachable MongoDB (MONGO_URL, default mongodb://localhost:27017).
+The benchmark database is dropped before and after the run.
+
+Usage: python benchmarks/push_fanout_bench.py [--partners 5] [--updates 5000] [--slow-delay 0.5]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from stub_partner import create_app  # noqa: E402
+
+LOCATION = {
+    "country_code": "TR", "party_id": "BCP", "id": "LOC1", "address": "Benchmark 1", "city": "Istanbul",
+    "postal_code": "34000", "country": "TUR", "coordinates": {"latitude": "41.0", "longitude": "29.0"},
+    "time_zone": "Europe/Istanbul", "evses": [
+        {"uid": f"EVSE{i}", "evse_id": f"TR*BCP*E{i}", "status": "AVAILABLE", "connectors": [
+            {"id": "1", "standard": "IEC_62196_T2", "format": "SOCKET", "power_type": "AC_3_PHASE",
+             "max_voltage": 230, "max_amperage": 32}
+        ]} for i in range(50)
+    ],
+}
+
+
+async def start_stub(port, delay, fail_rate):
+    import uvicorn
+
+    app = create_app(delay, fail_rate, seed=port)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return app, server, task
+
+
+def report(name, app, elapsed):
+    latencies = sorted(app.state.latencies) or [0.0]
+    q = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else [latencies[0]] * 99
+    print(
+        f"{name:>10} {sum(app.state.received.values()):>9} {app.state.failed:>7} "
+        f"{q[49] * 1000:>8.1f} {q[94] * 1000:>8.1f} {q[98] * 1000:>8.1f} {elapsed:>9.2f}"
+    )
+
+
+async def run(args):
+    import httpx
+    import server
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+    await server.run_migrations(server.db)
+    server.push_dispatcher.start()
+    stubs = [
+        await start_stub(args.port + i, args.slow_delay if i == 0 else 0.0, args.slow_fail_rate if i == 0 else 0.0)
+        for i in range(args.partners)
+    ]
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        cpo = (await client.post("/api/organizations/register", json={
+            "name": "Benchmark CPO", "country_code": "TR", "party_id": "BCP", "role": "CPO"
+        })).json()
+        cpo_headers = {"Authorization": f"Bearer {cpo['api_token']}"}
+        for i in range(args.partners):
+            emsp = (await client.post("/api/organizations/register", json={
+                "name": f"Benchmark eMSP {i}", "country_code": "TR", "party_id": f"E{i:02d}", "role": "EMSP"
+            })).json()
+            await client.post("/api/ocpi/2.3.0/credentials", headers={"Authorization": f"Bearer {emsp['api_token']}"}, json={
+                "token": f"partner-token-{i}", "url": f"http://127.0.0.1:{args.port + i}/ocpi", "roles": []
+            })
+        await client.put("/api/ocpi/2.3.0/locations/TR/BCP/LOC1", headers=cpo_headers, json=LOCATION)
+
+        print(f"{args.partners} partners (partner 0: {args.slow_delay}s delay, {args.slow_fail_rate:.0%} failures), "
+              f"{args.updates} EVSE PATCHes")
+        started = time.perf_counter()
+        statuses = ("AVAILABLE", "CHARGING")
+        for n in range(args.updates):
+            await client.patch(
+                f"/api/ocpi/2.3.0/locations/TR/BCP/LOC1/EVSE{n % 50}", headers=cpo_headers,
+                json={"status": statuses[n % 2], "last_updated": datetime.now(timezone.utc).isoformat()}
+            )
+        sent = time.perf_counter() - started
+        print(f"hub accepted {args.updates} updates in {sent:.2f} s ({args.updates / sent:.0f}/s)")
+
+        print(f"{'partner':>10} {'received':>9} {'503s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'drained s':>9}")
+        channels = list(server.push_dispatcher.channels.values())
+        # Fast partners first: their queues must drain regardless of partner 0
+        for i in list(range(1, args.partners)) + [0]:
+            channel = next(c for c in channels if c.url.endswith(f":{args.port + i}/ocpi"))
+            try:
+                await asyncio.wait_for(channel.queue.join(), args.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+            report(f"{'slow ' if i == 0 else ''}{i}", stubs[i][0], time.perf_counter() - started)
+        stats = server.push_dispatcher.stats()
+        print(f"sent {stats['sent']}, dead-lettered {stats['dead_lettered']}, still queued {stats['queued']}")
+
+    await server.push_dispatcher.close()
+    for _, stub, task in stubs:
+        stub.should_exit = True
+        await task
+    await server.client.drop_database(os.environ["DB_NAME"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--partners", type=int, default=5)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    parser.add_argument("--slow-fail-rate", type=float, default=0.2)
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--db", default="ocpi_benchmark")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    # Always use a dedicated database: it is dropped before and after the run
+    os.environ["DB_NAME"] = args.db
+    # A single benchmark party would otherwise be throttled
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Hub routing proxy latency benchmark
+
+Starts a stub CPO (see stub_partner.py) and the hub on localhost, registers
+the CPO's credentials and then sends the same requests from an eMSP twice:
+straight to the stub, and through the hub's routing endpoint
+(/api/ocpi/2.3.0/hub/...) with OCPI-to-* headers. Reports p50/p95/p99 of
+both, and the latency the hub adds, for GETs with growing response payloads
+and PUTs with growing request bodies. Bodies are streamed through the hub,
+so the added latency should barely depend on their size.
+
+Requires a reachable MongoDB (MONGO_URL, default mongodb://localhost:27017).
+The benchmark database is dropped before and after the run.
+
+Usage: python benchmarks/routing_proxy_bench.py [--requests 2000] [--concurrency 16] [--sizes 1024,65536,1048576]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from stub_partner import create_app  # noqa: E402
+
+
+async def serve(app, port):
+    import uvicorn
+
+    # No lifespan: the hub's background workers are not part of the measured path
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def measure(client, method, url, headers, body, requests, concurrency):
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            started = time.perf_counter()
+            response = await client.request(method, url, headers=headers, content=body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += response.status_code != 200
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return statistics.quantiles(latencies, n=100, method="inclusive"), errors
+
+
+async def run(args):
+    import httpx
+    import server
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+    await server.run_migrations(server.db)
+    stub, stub_task = await serve(create_app(), args.port)
+    hub, hub_task = await serve(server.app, args.port + 1)
+    hub_url = f"http://127.0.0.1:{args.port + 1}"
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def register(party_id, role):
+            response = await client.post(f"{hub_url}/api/organizations/register", json={
+                "name": f"Benchmark {role}", "country_code": "TR", "party_id": party_id, "role": role
+            })
+            return {"Authorization": f"Bearer {response.json()['api_token']}"}
+
+        cpo = await register("BCP", "CPO")
+        emsp = await register("BEM", "EMSP")
+        await client.post(f"{hub_url}/api/ocpi/2.3.0/credentials", headers=cpo, json={
+            "token": "stub-token", "url": f"http://127.0.0.1:{args.port}/ocpi", "roles": []
+        })
+        routed = {**emsp, "OCPI-to-country-code": "TR", "OCPI-to-party-id": "BCP"}
+
+        print(f"{args.requests} requests per case, concurrency {args.concurrency}")
+        print(f"{'case':>14} {'direct p50/p95/p99 ms':>24} {'routed p50/p95/p99 ms':>24} {'added p50/p95 ms':>18} {'errors':>7}")
+        for size in args.sizes:
+            body = b'{"uid":"BENCH","pad":"' + b"x" * size + b'"}'
+            cases = [
+                (f"GET {size}", "GET", f"locations/TR/BCP/LOC1?size={size}", None),
+                (f"PUT {size}", "PUT", "tokens/TR/BEM/BENCH", body),
+            ]
+            for name, method, path, content in cases:
+                headers = {"Content-Type": "application/json"} if content else {}
+                direct, direct_errors = await measure(
+                    client, method, f"http://127.0.0.1:{args.port}/ocpi/{path}", headers,
+                    content, args.requests, args.concurrency
+                )
+                via_hub, hub_errors = await measure(
+                    client, method, f"{hub_url}/api/ocpi/2.3.0/hub/{path}", {**routed, **headers},
+                    content, args.requests, args.concurrency
+                )
+                print(
+                    f"{name:>14} {direct[49]:>8.2f}{direct[94]:>8.2f}{direct[98]:>8.2f} "
+                    f"{via_hub[49]:>8.2f}{via_hub[94]:>8.2f}{via_hub[98]:>8.2f} "
+                    f"{via_hub[49] - direct[49]:>9.2f}{via_hub[94] - direct[94]:>9.2f} {direct_errors + hub_errors:>7}"
+                )
+        print(f"routing: {server.hub_router.stats()}")
+
+    await server.hub_router.close()
+    for uv, task in ((hub, hub_task), (stub, stub_task)):
+        uv.should_exit = True
+        await task
+    await server.client.drop_database(os.environ["DB_NAME"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--sizes", type=lambda s: [int(v) for v in s.split(",")], default=[1024, 65536, 1048576])
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--db", default="ocpi_benchmark")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    # Always use a dedicated database: it is dropped before and after the run
+    os.environ["DB_NAME"] = args.db
+    # A single benchmark party would otherwise be throttled
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
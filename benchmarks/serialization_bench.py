@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+OCPI list response serialization benchmark
+
+Compares the validated path (pydantic model per document, OCPIResponse,
+FastAPI jsonable_encoder + json.dumps) with the fast path used by the list
+handlers (projected raw documents encoded with orjson) for a page of
+realistic Location documents. Mongo is not involved: both paths start from
+the documents as Motor returns them.
+
+Usage: python benchmarks/serialization_bench.py [--pages 200] [--sizes 50,500,1000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+# server.py reads these on import; the Motor client connects lazily and is never used here
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "ocpi_benchmark")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from server import Location, OCPIResponse, LOCATION_PROJECTION  # noqa: E402
+from serialization import ocpi_json  # noqa: E402
+
+
+def make_location(i):
+    now = datetime(2024, 1, 1) + timedelta(seconds=i)
+    return {
+        "country_code": "TR",
+        "party_id": "EPS",
+        "id": f"LOC{i:07d}",
+        "publish": True,
+        "name": f"Charging Station {i}",
+        "address": "Büyükdere Cd. No:1",
+        "city": "Istanbul",
+        "postal_code": "34394",
+        "country": "TUR",
+        "coordinates": {"latitude": "41.0766", "longitude": "29.0135"},
+        "parking_type": "ON_STREET",
+        "evses": [
+            {
+                "uid": f"EVSE{i:07d}{e}",
+                "evse_id": f"TR*EPS*E{i:07d}{e}",
+                "status": "AVAILABLE",
+                "capabilities": ["RFID_READER", "REMOTE_START_STOP_CAPABLE"],
+                "connectors": [
+                    {
+                        "id": str(c + 1),
+                        "standard": "IEC_62196_T2",
+                        "format": "SOCKET",
+                        "power_type": "AC_3_PHASE",
+                        "max_voltage": 400,
+                        "max_amperage": 32,
+                        "max_electric_power": 22000,
+                        "tariff_ids": ["AC-STANDARD"],
+                        "last_updated": now,
+                    }
+                    for c in range(2)
+                ],
+                "last_updated": now,
+            }
+            for e in range(3)
+        ],
+        "facilities": ["PARKING_LOT"],
+        "time_zone": "Europe/Istanbul",
+        "charging_when_closed": True,
+        "last_updated": now,
+    }
+
+
+def validated_path(documents):
+    # What get_locations did before: model per document, envelope, FastAPI encoding
+    content = OCPIResponse(data=[Location(**doc) for doc in documents], status_code=1000, status_message="Success")
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast_path(documents):
+    return ocpi_json(documents)
+
+
+def measure(fn, documents, pages):
+    fn(documents)  # warm up
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(pages):
+        body = fn(documents)
+    return (time.perf_counter() - wall) / pages, (time.process_time() - cpu) / pages, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--sizes", default="50,500,1000")
+    args = parser.parse_args()
+
+    print(f"{'page size':>10} {'path':>10} {'ms/page':>10} {'cpu ms/page':>12} {'bytes':>10} {'speedup':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        # Simulate the projection Mongo applies on the fast path
+        documents = [
+            {k: v for k, v in make_location(i).items() if k in LOCATION_PROJECTION}
+            for i in range(size)
+        ]
+        baseline = None
+        for name, fn in (("validated", validated_path), ("fast", fast_path)):
+            wall, cpu, size_bytes = measure(fn, documents, args.pages)
+            baseline = baseline or wall
+            print(f"{size:>10} {name:>10} {wall * 1000:>10.2f} {cpu * 1000:>12.2f} {size_bytes:>10} {baseline / wall:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
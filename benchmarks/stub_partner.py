@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Stub OCPI partner for push fan-out testing
+
+Accepts any PUT/PATCH/POST on ``/ocpi/{module}/...`` and answers with an
+OCPI success envelope after an optional delay, failing a configurable share
+of requests with HTTP 503. Received requests are counted per module and the
+delivery delay (receive time minus the pushed object's ``last_updated``) is
+recorded, so push latency can be measured end to end. GET requests answer
+with a payload of ``?size=`` bytes, for routing benchmarks.
+
+As a CPO, it answers commands with ``ACCEPTED`` and a ``command_timeout``.
+Given ``hub_token``, it then posts ``command_result`` to the command's
+``response_url`` after ``delay``.
+
+Usage: python benchmarks/stub_partner.py [--port 9100] [--delay 0] [--fail-rate 0]
+
+Then register it with the hub through POST /api/ocpi/2.3.0/credentials using
+``"url": "http://127.0.0.1:9100/ocpi"``.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import datetime
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+
+def create_app(
+    delay: float = 0.0,
+    fail_rate: float = 0.0,
+    seed: int = None,
+    command_timeout: int = 30,
+    command_result: str = "ACCEPTED",
+    hub_token: str = None,
+) -> FastAPI:
+    app = FastAPI(title="Stub OCPI partner")
+    rng = random.Random(seed)
+    app.state.received = Counter()
+    app.state.failed = 0
+    app.state.latencies = []
+    app.state.requests = []
+    payloads = {}
+    callbacks = set()
+
+    async def post_result(url):
+        import httpx
+
+        await asyncio.sleep(delay)
+        async with httpx.AsyncClient() as client:
+            await client.post(url, json={"result": command_result}, headers={"Authorization": f"Bearer {hub_token}"})
+
+    @app.api_route("/ocpi/{module}/{path:path}", methods=["PUT", "PATCH", "POST"])
+    async def receive(module: str, path: str, request: Request):
+        body = await request.json()
+        if delay:
+            await asyncio.sleep(delay)
+        if rng.random() < fail_rate:
+            app.state.failed += 1
+            return JSONResponse({"status_code": 3000, "status_message": "Unavailable"}, status_code=503)
+        app.state.received[module] += 1
+        app.state.requests.append((request.method, f"{module}/{path}", body))
+        if body.get("last_updated"):
+            sent = datetime.fromisoformat(body["last_updated"].replace("Z", "+00:00")).timestamp()
+            app.state.latencies.append(time.time() - sent)
+        if module == "commands":
+            if hub_token:
+                task = asyncio.create_task(post_result(body["response_url"]))
+                callbacks.add(task)
+                task.add_done_callback(callbacks.discard)
+            return {"data": {"result": "ACCEPTED", "timeout": command_timeout}, "status_code": 1000,
+                    "status_message": "Success", "timestamp": datetime.utcnow().isoformat() + "Z"}
+        return {"status_code": 1000, "status_message": "Success", "timestamp": datetime.utcnow().isoformat() + "Z"}
+
+    @app.get("/ocpi/{module}/{path:path}")
+    async def send(module: str, path: str, size: int = 1024):
+        if delay:
+            await asyncio.sleep(delay)
+        if size not in payloads:
+            payloads[size] = b'{"data":"' + b"x" * size + b'","status_code":1000,"status_message":"Success"}'
+        app.state.received[module] += 1
+        return Response(payloads[size], media_type="application/json")
+
+    @app.get("/stats")
+    async def stats():
+        return {"received": dict(app.state.received), "failed": app.state.failed}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before answering")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.delay, args.fail_rate), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Real-time token authorization latency benchmark
+
+Seeds an eMSP with tokens through the Tokens receiver interface, then sends
+POST /tokens/{uid}/authorize requests from a CPO at a fixed arrival rate
+(open loop, so slow responses do not lower the offered load) and reports
+p50/p95/p99 latency for:
+
+  cold   first authorization of each token (in-memory index miss -> Mongo)
+  warm   repeated authorizations answered from the in-memory index
+
+Requires a reachable MongoDB (MONGO_URL, default mongodb://localhost:27017).
+The benchmark database is dropped before seeding.
+
+Usage: python benchmarks/token_authorize_bench.py [--tokens 50000] [--rate 5000] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+
+def make_token(i):
+    return {
+        "country_code": "TR",
+        "party_id": "BEM",
+        "uid": f"{i:014X}",
+        "type": "RFID",
+        "contract_id": f"TR-BEM-C{i:08d}",
+        "issuer": "Benchmark eMSP",
+        "valid": i % 50 != 0,
+        "whitelist": "ALLOWED",
+    }
+
+
+def report(name, latencies, elapsed, errors):
+    q = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(
+        f"{name:>6} {len(latencies):>8} {len(latencies) / elapsed:>8.0f} {q[49]:>8.3f} "
+        f"{q[94]:>8.3f} {q[98]:>8.3f} {max(latencies):>8.2f} {errors:>7}"
+    )
+
+
+async def open_loop(client, headers, uids, rate, seconds):
+    """Fire requests at ``rate`` per second for ``seconds``; returns latencies in ms."""
+    latencies = []
+    errors = 0
+    interval = 1 / rate
+    total = int(rate * seconds)
+
+    async def one(uid):
+        nonlocal errors
+        started = time.perf_counter()
+        response = await client.post(f"/api/ocpi/2.3.0/tokens/{uid}/authorize", headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        errors += response.status_code != 200
+
+    tasks = []
+    started = time.perf_counter()
+    for n in range(total):
+        # Sleep until the scheduled send time of request n
+        delay = started + n * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(uids[n % len(uids)])))
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - started, errors
+
+
+async def run(args):
+    import httpx
+    import server
+
+    await server.client.drop_database(os.environ["DB_NAME"])
+    await server.run_migrations(server.db)
+    transport = httpx.ASGITransport(app=server.app)
+    limits = httpx.Limits(max_connections=None)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+        emsp = (await client.post("/api/organizations/register", json={
+            "name": "Benchmark eMSP", "country_code": "TR", "party_id": "BEM", "role": "EMSP"
+        })).json()
+        cpo = (await client.post("/api/organizations/register", json={
+            "name": "Benchmark CPO", "country_code": "TR", "party_id": "BCP", "role": "CPO"
+        })).json()
+        cpo_headers = {
+            "Authorization": f"Bearer {cpo['api_token']}",
+            "OCPI-to-country-code": "TR",
+            "OCPI-to-party-id": "BEM",
+        }
+
+        tokens = [make_token(i) for i in range(args.tokens)]
+        # Seed straight into Mongo: the receiver path would already warm the index
+        await server.db.tokens.insert_many([{**t, "emsp_id": emsp["organization"]["id"]} for t in tokens])
+        uids = [t["uid"] for t in tokens]
+        random.shuffle(uids)
+
+        print(f"{args.tokens} tokens, {args.rate} authorizations/s for {args.seconds} s")
+        print(f"{'phase':>6} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+        cold_seconds = min(args.seconds, args.tokens / args.rate)
+        report("cold", *await open_loop(client, cpo_headers, uids, args.rate, cold_seconds))
+        report("warm", *await open_loop(client, cpo_headers, uids, args.rate, args.seconds))
+        print(f"index: {server.token_index.stats()}")
+    await server.client.drop_database(os.environ["DB_NAME"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tokens", type=int, default=50000)
+    parser.add_argument("--rate", type=int, default=5000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--db", default="ocpi_benchmark")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    # Always use a dedicated database: it is dropped before and after the run
+    os.environ["DB_NAME"] = args.db
+    # A single benchmark party would otherwise be throttled
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
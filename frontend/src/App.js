@@ -163,6 +163,12 @@ const Dashboard = () => {
 
   useEffect(() => {
     loadDashboardData();
+    // Counters are pushed when they change instead of being polled
+    const events = new EventSource(`${API}/live/dashboard`);
+    events.addEventListener('counters', (event) => {
+      setStats(JSON.parse(event.data).data.values);
+    });
+    return () => events.close();
   }, []);
 
   const loadDashboardData = async () => {
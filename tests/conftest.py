@@ -0,0 +1,69 @@
+"""Shared fixtures: the hub app on an in-memory mongomock-motor database.
+
+Motor's client is swapped for mongomock-motor before ``server`` is imported,
+so every module-level service gets the mock database. Startup hooks are not
+run; tests start the pieces they exercise. Each test gets an empty database
+and fresh in-memory state.
+"""
+
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "ocpi_hub_tests")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+import motor.motor_asyncio  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+import server  # noqa: E402
+from evse_status import EvseStatusStore  # noqa: E402
+from session_updates import SessionUpdateCoalescer  # noqa: E402
+from token_index import TokenIndex  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def hub(monkeypatch):
+    """The server module with an empty database and fresh in-memory state."""
+    for name in await server.db.list_collection_names():
+        await server.db.drop_collection(name)
+    server.auth_cache.clear()
+    server.known_sessions.clear()
+    server.dashboard_cache.invalidate()
+    monkeypatch.setattr(server, "token_index", TokenIndex())
+    monkeypatch.setattr(server, "session_coalescer", SessionUpdateCoalescer(server.db, interval=3600))
+    store = EvseStatusStore(server.db, interval=3600)
+    store.listener = server.publish_evse_status
+    monkeypatch.setattr(server, "evse_status", store)
+    return server
+
+
+@pytest.fixture
+async def client(hub):
+    transport = httpx.ASGITransport(app=hub.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://hub") as http:
+        yield http
+
+
+@pytest.fixture
+def register(client):
+    """Register an organization; returns its id and Authorization headers."""
+    async def register(role: str = "CPO", party_id: str = "CPO", country_code: str = "TR"):
+        response = await client.post("/api/organizations/register", json={
+            "name": f"{party_id} {role}", "country_code": country_code, "party_id": party_id, "role": role,
+        })
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return body["organization"]["id"], {"Authorization": f"Bearer {body['api_token']}"}
+    return register
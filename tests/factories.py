@@ -0,0 +1,36 @@
+"""OCPI objects for tests."""
+
+
+LOCATION = {
+    "country_code": "TR", "party_id": "CPO", "id": "LOC1", "address": "Istiklal Cd. 1", "city": "Istanbul",
+    "postal_code": "34430", "country": "TUR", "coordinates": {"latitude": "41.0340", "longitude": "28.9770"},
+    "time_zone": "Europe/Istanbul", "last_updated": "2024-01-01T00:00:00Z",
+}
+
+
+def evse(uid: str, status: str = "AVAILABLE", last_updated: str = "2024-01-01T00:00:00Z"):
+    return {
+        "uid": uid, "evse_id": f"TR*CPO*{uid}", "status": status, "last_updated": last_updated,
+        "connectors": [{
+            "id": "1", "standard": "IEC_62196_T2", "format": "SOCKET", "power_type": "AC_3_PHASE",
+            "max_voltage": 230, "max_amperage": 32, "last_updated": last_updated,
+        }],
+    }
+
+
+def location(location_id: str = "LOC1", evses=(), **fields):
+    return {**LOCATION, "id": location_id, "evses": list(evses), **fields}
+
+
+def session(session_id: str = "S1", status: str = "ACTIVE", **fields):
+    return {
+        "country_code": "TR", "party_id": "CPO", "id": session_id,
+        "start_date_time": "2024-01-01T10:00:00Z", "kwh": 0.0,
+        "cdr_token": {"country_code": "TR", "party_id": "EMS", "uid": "U1", "type": "RFID", "contract_id": "C1"},
+        "auth_method": "WHITELIST", "location_id": "LOC1", "evse_uid": "E1", "connector_id": "1",
+        "currency": "EUR", "status": status, "last_updated": "2024-01-01T10:00:00Z", **fields,
+    }
+
+
+def period(start: str, kwh: float = 1.0):
+    return {"start_date_time": start, "dimensions": [{"type": "ENERGY", "volume": kwh}]}
@@ -0,0 +1,142 @@
+from datetime import timedelta
+
+import pytest
+
+from archive import BATCHES_COLLECTION, SessionArchiver
+from cdrs import CdrPipeline
+from session_updates import PERIODS_COLLECTION
+from tests.factories import period, session
+
+pytestmark = pytest.mark.anyio
+
+SESSIONS = "/api/ocpi/2.3.0/sessions"
+ARCHIVE = "/api/ocpi/2.3.0/sessions/archive"
+COST = {"excl_vat": 4.2}
+
+
+def completed(session_id: str, start: str = "2024-01-01T10:00:00Z", **fields):
+    return session(session_id, status="COMPLETED", start_date_time=start, total_cost=COST, **fields)
+
+
+@pytest.fixture
+def archiver(hub, tmp_path, monkeypatch):
+    archiver = SessionArchiver(
+        hub.db, root=str(tmp_path), fields=tuple(hub.SESSION_PROJECTION), min_age=timedelta(0),
+        on_archive=hub.on_sessions_archived
+    )
+    monkeypatch.setattr(hub, "session_archiver", archiver)
+    return archiver
+
+
+@pytest.fixture
+async def parties(client, register):
+    _, cpo = await register("CPO", "CPO")
+    _, emsp = await register("EMSP", "EMS")
+    _, other = await register("EMSP", "OTH")
+    return cpo, emsp, other
+
+
+async def put_sessions(client, cpo, *sessions):
+    for body in sessions:
+        response = await client.put(f"{SESSIONS}/TR/CPO/{body['id']}", headers=cpo, json=body)
+        assert response.status_code == 200, response.text
+
+
+async def test_sessions_are_archived_only_once_their_cdr_exists(hub, client, parties, archiver):
+    cpo, _, _ = parties
+    await put_sessions(client, cpo, completed("S1"))
+    assert await archiver.run_once() == 0
+
+    await CdrPipeline(hub.db, lag=0).run_once()
+    # Written after the CDR run: stays until the pipeline has processed it
+    await put_sessions(client, cpo, completed("S2"), session("S3"))
+    assert await archiver.run_once() == 1
+    remaining = sorted([doc["id"] async for doc in hub.db.sessions.find({})])
+    assert remaining == ["S2", "S3"]
+
+
+async def test_sessions_the_cdr_pipeline_could_not_price_stay_until_they_get_a_cdr(hub, client, parties, archiver):
+    cpo, _, _ = parties
+    unpriced = session("S1", status="COMPLETED")
+    await put_sessions(client, cpo, unpriced, completed("S2"))
+    # Passes both sessions, and records S1 in cdr_failures
+    pipeline = CdrPipeline(hub.db, lag=0)
+    await pipeline.run_once()
+
+    assert await archiver.run_once() == 1
+    assert [doc["id"] async for doc in hub.db.sessions.find({})] == ["S1"]
+
+    response = await client.patch(f"{SESSIONS}/TR/CPO/S1", headers=cpo, json={"total_cost": COST})
+    assert response.status_code == 200
+    await hub.session_coalescer.flush()
+    await pipeline.run_once()
+    assert await archiver.run_once() == 1
+    assert await hub.db.sessions.count_documents({}) == 0
+
+
+async def test_archived_sessions_are_served_without_hub_fields(hub, client, parties, archiver):
+    cpo, emsp, other = parties
+    periods = [period("2024-01-01T10:00:00Z", 3.0), period("2024-01-01T10:30:00Z", 4.0)]
+    await put_sessions(client, cpo, completed("S1", kwh=7.0, charging_periods=periods))
+    await CdrPipeline(hub.db, lag=0).run_once()
+    assert await archiver.run_once() == 1
+    assert await hub.db.sessions.count_documents({}) == 0
+    assert await hub.db[PERIODS_COLLECTION].count_documents({}) == 0
+
+    response = await client.get(ARCHIVE, headers=emsp)
+    assert response.headers["x-total-count"] == "1"
+    document = response.json()["data"][0]
+    assert (document["id"], document["kwh"], len(document["charging_periods"])) == ("S1", 7.0, 2)
+    assert set(document) <= set(hub.SESSION_PROJECTION)
+    assert not {"_id", "location_owner_id", "emsp_id", "hub_updated_at"} & set(document)
+
+    assert [d["id"] for d in (await client.get(ARCHIVE, headers=cpo)).json()["data"]] == ["S1"]
+    assert (await client.get(ARCHIVE, headers=other)).json()["data"] == []
+
+
+async def test_queries_only_open_the_partitions_that_can_match(hub, client, parties, archiver):
+    cpo, emsp, _ = parties
+    await put_sessions(
+        client, cpo, completed("JAN1"),
+        completed("JAN2", start="2024-01-20T10:00:00Z"), completed("MAR", start="2024-03-05T10:00:00Z"),
+    )
+    await CdrPipeline(hub.db, lag=0).run_once()
+    assert await archiver.run_once() == 3
+
+    response = await client.get(f"{ARCHIVE}?date_from=2024-03-01T00:00:00Z", headers=emsp)
+    assert response.headers["x-archive-files"] == "1"
+    assert [d["id"] for d in response.json()["data"]] == ["MAR"]
+
+    response = await client.get(f"{ARCHIVE}?date_to=2024-01-15T00:00:00Z", headers=emsp)
+    assert response.headers["x-archive-files"] == "1"
+    assert [d["id"] for d in response.json()["data"]] == ["JAN1"]
+
+    response = await client.get(f"{ARCHIVE}?limit=2", headers=emsp)
+    assert response.headers["x-total-count"] == "3" and response.headers["x-archive-files"] == "2"
+    assert [d["id"] for d in response.json()["data"]] == ["JAN1", "JAN2"]
+    assert 'rel="next"' in response.headers["link"]
+
+    response = await client.get(f"{ARCHIVE}?country_code=TR&party_id=OTH", headers=emsp)
+    assert response.headers["x-archive-files"] == "0"
+
+
+async def test_a_batch_interrupted_after_writing_is_completed_on_the_next_run(hub, client, parties, archiver):
+    cpo, emsp, _ = parties
+    await put_sessions(client, cpo, completed("S1"), completed("S2"))
+    await CdrPipeline(hub.db, lag=0).run_once()
+
+    # A worker that stops between writing the files and deleting the sessions; its lease lapses at once
+    crashed = SessionArchiver(hub.db, root=archiver.root, fields=archiver.fields, min_age=timedelta(0), lease=0)
+
+    async def crash(batch):
+        raise RuntimeError("worker stopped")
+    crashed._finish = crash
+    with pytest.raises(RuntimeError):
+        await crashed.run_once()
+    assert await hub.db.sessions.count_documents({}) == 2
+
+    assert await archiver.run_once() == 0
+    assert await hub.db.sessions.count_documents({}) == 0
+    assert await hub.db[BATCHES_COLLECTION].count_documents({"state": {"$ne": "done"}}) == 0
+    response = await client.get(ARCHIVE, headers=emsp)
+    assert [d["id"] for d in response.json()["data"]] == ["S1", "S2"]
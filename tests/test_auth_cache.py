@@ -0,0 +1,87 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from auth_cache import INVALIDATIONS_COLLECTION, TokenCache, watch_invalidations
+
+pytestmark = pytest.mark.anyio
+
+CREDENTIALS = "/api/ocpi/2.3.0/credentials"
+
+
+async def test_repeated_requests_are_served_from_the_cache(hub, client, register):
+    org_id, headers = await register()
+    assert (await client.get(CREDENTIALS, headers=headers)).status_code == 200
+
+    # Gone from Mongo, still known to this worker until invalidated or expired
+    await hub.db.organizations.delete_one({"id": org_id})
+    assert (await client.get(CREDENTIALS, headers=headers)).status_code == 200
+    assert hub.auth_cache.stats()["hits"] >= 1
+
+
+async def test_rotating_a_token_invalidates_the_cached_one(client, register):
+    org_id, headers = await register()
+    assert (await client.get(CREDENTIALS, headers=headers)).status_code == 200
+
+    response = await client.post(f"/api/organizations/{org_id}/token/rotate", headers=headers)
+    assert response.status_code == 200
+    rotated = {"Authorization": f"Bearer {response.json()['api_token']}"}
+
+    assert (await client.get(CREDENTIALS, headers=headers)).status_code == 401
+    assert (await client.get(CREDENTIALS, headers=rotated)).status_code == 200
+
+
+async def test_revoking_a_token_invalidates_it(client, register):
+    org_id, headers = await register()
+    assert (await client.get(CREDENTIALS, headers=headers)).status_code == 200
+
+    assert (await client.delete(f"/api/organizations/{org_id}/token", headers=headers)).status_code == 200
+    assert (await client.get(CREDENTIALS, headers=headers)).status_code == 401
+
+
+async def test_invalidations_from_other_workers_are_applied(hub):
+    cache = TokenCache()
+    cache.set("token", "org-1", object())
+    watcher = asyncio.create_task(watch_invalidations(hub.db, cache, interval=0.01))
+    try:
+        await asyncio.sleep(0.02)
+        await hub.db[INVALIDATIONS_COLLECTION].insert_one({
+            "organization_id": "org-1", "created_at": datetime.now(timezone.utc),
+        })
+        for _ in range(100):
+            if cache.get("token") is None:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        watcher.cancel()
+    assert cache.get("token") is None
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    cache = TokenCache(ttl=10)
+    cache.set("token", "org-1", "value")
+    assert cache.get("token") == "value"
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("token") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TokenCache(maxsize=2)
+    cache.set("a", "org-a", 1)
+    cache.set("b", "org-b", 2)
+    cache.get("a")
+    cache.set("c", "org-c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_tokens_are_not_kept_in_clear_text():
+    cache = TokenCache()
+    cache.set("secret-token", "org-1", "value")
+    assert "secret-token" not in repr(cache._entries)
@@ -0,0 +1,34 @@
+import orjson
+import pytest
+
+from tests.factories import evse, location
+
+pytestmark = pytest.mark.anyio
+
+
+class Publisher:
+    def __init__(self):
+        self.events = []
+
+    async def publish(self, event, roles=(), organization_ids=()):
+        self.events.append((event, tuple(roles)))
+        return 1
+
+
+async def test_imported_locations_are_pushed_to_emsps(hub, client, register, monkeypatch):
+    publisher = Publisher()
+    monkeypatch.setattr(hub, "push_dispatcher", publisher)
+    _, cpo = await register("CPO", "CPO")
+    lines = [location(f"L{i}", evses=[evse("E1")]) for i in range(5)]
+    lines.insert(2, {**location("BAD"), "party_id": "OTH"})
+    body = b"\n".join(orjson.dumps(line) for line in lines)
+
+    response = await client.post("/api/bulk/locations?batch_size=2", headers=cpo, content=body)
+    events = [orjson.loads(line) for line in response.content.splitlines()]
+    assert (events[-1]["written"], events[-1]["failed"]) == (5, 1)
+
+    assert [event.path for event, _ in publisher.events] == [f"TR/CPO/L{i}" for i in range(5)]
+    event, roles = publisher.events[0]
+    assert (event.module, event.method, roles) == ("locations", "PUT", ("EMSP",))
+    assert set(event.body) <= set(hub.LOCATION_PROJECTION) and "owner_org_id" not in event.body
+    assert event.body["evses"][0]["uid"] == "E1"
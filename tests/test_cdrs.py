@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from cdrs import FAILURES_COLLECTION, CdrPipeline
+from tests.factories import evse, location, period, session
+
+pytestmark = pytest.mark.anyio
+
+SESSIONS = "/api/ocpi/2.3.0/sessions/TR/CPO"
+COST = {"excl_vat": 4.2, "incl_vat": 5.04}
+
+
+def completed(session_id: str, **fields):
+    return session(
+        session_id, status="COMPLETED", kwh=7.5, end_date_time="2024-01-01T11:30:00Z",
+        last_updated="2024-01-01T11:30:00Z", **fields
+    )
+
+
+@pytest.fixture
+async def parties(client, register):
+    _, cpo = await register("CPO", "CPO")
+    _, emsp = await register("EMSP", "EMS")
+    response = await client.put("/api/ocpi/2.3.0/locations/TR/CPO/LOC1", headers=cpo, json=location(evses=[evse("E1")]))
+    assert response.status_code == 200
+    return cpo, emsp
+
+
+async def put_session(client, cpo, body):
+    response = await client.put(f"{SESSIONS}/{body['id']}", headers=cpo, json=body)
+    assert response.status_code == 200, response.text
+
+
+async def test_completed_sessions_become_cdrs(hub, client, parties):
+    cpo, emsp = parties
+    periods = [period("2024-01-01T10:00:00Z", 5.0), period("2024-01-01T11:00:00Z", 2.5)]
+    await put_session(client, cpo, completed("S1", total_cost=COST, charging_periods=periods))
+    await put_session(client, cpo, session("S2"))
+
+    assert await CdrPipeline(hub.db, lag=0).run_once() == 1
+
+    cdrs = (await client.get("/api/ocpi/2.3.0/cdrs", headers=emsp)).json()["data"]
+    assert [cdr["id"] for cdr in cdrs] == ["S1"]
+    cdr = cdrs[0]
+    assert cdr["total_cost"] == COST
+    assert cdr["total_energy"] == 7.5
+    assert cdr["total_time"] == 1.5
+    assert cdr["cdr_location"]["evse_id"] == "TR*CPO*E1"
+    assert cdr["cdr_location"]["connector_standard"] == "IEC_62196_T2"
+    assert len(cdr["charging_periods"]) == 2
+
+
+async def test_pipeline_resumes_from_its_checkpoint(hub, client, parties):
+    cpo, _ = parties
+    await put_session(client, cpo, completed("S1", total_cost=COST))
+    pipeline = CdrPipeline(hub.db, lag=0)
+    assert await pipeline.run_once() == 1
+    assert await pipeline.run_once() == 0
+
+    # A session written again is processed again; the CDR is replaced, not duplicated.
+    # Stored datetimes have millisecond precision, and lag=0 leaves no gap otherwise
+    await asyncio.sleep(0.01)
+    await put_session(client, cpo, completed("S1", total_cost={"excl_vat": 9.0}))
+    assert await pipeline.run_once() == 1
+    cdrs = await hub.db.cdrs.find({}).to_list(None)
+    assert [(cdr["id"], cdr["total_cost"]) for cdr in cdrs] == [("S1", {"excl_vat": 9.0})]
+
+
+async def test_unpriced_sessions_are_quarantined_until_they_get_a_price(hub, client, parties):
+    cpo, _ = parties
+    await put_session(client, cpo, completed("S1"))
+    await put_session(client, cpo, completed("S2", total_cost=COST))
+
+    pipeline = CdrPipeline(hub.db, lag=0)
+    assert await pipeline.run_once() == 2
+    assert [cdr["id"] for cdr in await hub.db.cdrs.find({}).to_list(None)] == ["S2"]
+    failure = await hub.db[FAILURES_COLLECTION].find_one({"_id": "TR*CPO*S1"})
+    assert failure["reason"] == "unpriced"
+
+    response = await client.patch(f"{SESSIONS}/S1", headers=cpo, json={"total_cost": COST})
+    assert response.status_code == 200
+    await hub.session_coalescer.flush()
+    assert await pipeline.run_once() == 1
+    assert sorted(cdr["id"] for cdr in await hub.db.cdrs.find({}).to_list(None)) == ["S1", "S2"]
+    assert await hub.db[FAILURES_COLLECTION].count_documents({}) == 0
+
+
+async def test_a_session_the_pricer_fails_on_does_not_block_the_others(hub, client, parties):
+    cpo, _ = parties
+    for session_id in ("S1", "S2", "S3"):
+        await put_session(client, cpo, completed(session_id))
+
+    async def pricer(sessions):
+        if any(s["id"] == "S2" for s in sessions):
+            raise ValueError("malformed tariff")
+        return {f"TR*CPO*{s['id']}": COST for s in sessions}
+
+    pipeline = CdrPipeline(hub.db, lag=0, pricer=pricer)
+    assert await pipeline.run_once() == 3
+    assert sorted(cdr["id"] for cdr in await hub.db.cdrs.find({}).to_list(None)) == ["S1", "S3"]
+    failure = await hub.db[FAILURES_COLLECTION].find_one({"_id": "TR*CPO*S2"})
+    assert failure["reason"] == "failed" and "malformed tariff" in failure["error"]
+    stats = await pipeline.stats()
+    assert (stats["generated_total"], stats["failed_total"], stats["sessions_without_cdr"]) == (2, 1, 1)
+
+
+async def test_only_one_worker_runs_the_pipeline(hub):
+    first, second = CdrPipeline(hub.db), CdrPipeline(hub.db)
+    assert await first.acquire() is not None
+    assert await second.acquire() is None
+    # Renewing its own lease works
+    assert await first.acquire() is not None
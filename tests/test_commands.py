@@ -0,0 +1,184 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from commands import COMMANDS_COLLECTION, CommandTracker
+from routing import HubRouter
+
+pytestmark = pytest.mark.anyio
+
+CALLBACK = "http://hub/api/ocpi/2.3.0/commands/results"
+BODY = {"response_url": "http://emsp.test/results/1", "location_id": "LOC1", "token": {"uid": "U1"}}
+
+
+class Partners:
+    """The eMSP and CPO behind the hub, answering through one mock transport."""
+
+    def __init__(self):
+        self.results = []
+        self.forwarded = []
+        self.cpo_answer = {"result": "ACCEPTED", "timeout": 30}
+        self.release = asyncio.Event()
+        self.release.set()
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host == "emsp.test":
+            self.results.append(httpx.Response(200, content=request.content).json())
+            return httpx.Response(200, json={"status_code": 1000})
+        self.forwarded.append(request)
+        await self.release.wait()
+        return httpx.Response(200, json={"status_code": 1000, "data": self.cpo_answer})
+
+
+@pytest.fixture
+async def partners():
+    partners = Partners()
+    yield partners
+    await partners.client.aclose()
+
+
+@pytest.fixture
+def router(hub, partners):
+    router = HubRouter(hub.db)
+    router.table.update(
+        {"id": "emsp", "country_code": "TR", "party_id": "EMS", "role": "EMSP"},
+        {"url": "http://emsp.test/ocpi", "token": "emsp-token"},
+    )
+    router.table.update(
+        {"id": "cpo", "country_code": "TR", "party_id": "CPO", "role": "CPO"},
+        {"url": "http://cpo.test/ocpi", "token": "cpo-token"},
+    )
+    router.client_for = lambda route: partners.client
+    return router
+
+
+@pytest.fixture
+async def trackers(hub, router):
+    """Build trackers on the shared database, as separate workers would; closed after the test."""
+    started = []
+
+    def tracker(**options):
+        started.append(CommandTracker(hub.db, router, **options))
+        return started[-1]
+    yield tracker
+    for tracker in started:
+        await tracker.close()
+
+
+async def until(condition, timeout: float = 2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+
+async def submit(tracker, router):
+    response = await tracker.submit(
+        "START_SESSION", BODY, router.table.resolve("TR", "EMS"), router.table.resolve("TR", "CPO"), CALLBACK
+    )
+    assert response["result"] == "ACCEPTED"
+    doc = await tracker.db[COMMANDS_COLLECTION].find_one({"status": "PENDING"})
+    return doc["id"]
+
+
+async def test_the_cpo_result_is_passed_on_to_the_emsp(hub, router, partners, trackers):
+    tracker = trackers()
+    tracker.start()
+    command_id = await submit(tracker, router)
+    await until(lambda: partners.forwarded)
+
+    forwarded = partners.forwarded[0]
+    assert forwarded.url == "http://cpo.test/ocpi/commands/START_SESSION"
+    assert httpx.Response(200, content=forwarded.content).json()["response_url"] == f"{CALLBACK}/{command_id}"
+
+    assert await tracker.receive_result(command_id, "emsp", {"result": "ACCEPTED"}) is False
+    assert await tracker.receive_result(command_id, "cpo", {"result": "ACCEPTED"}) is True
+    assert await tracker.receive_result(command_id, "cpo", {"result": "FAILED"}) is False
+    await until(lambda: tracker.delivered)
+    assert partners.results == [{"result": "ACCEPTED"}]
+    doc = await hub.db[COMMANDS_COLLECTION].find_one({"id": command_id})
+    assert doc["status"] == "DELIVERED" and doc["finished_at"] is not None
+
+
+async def test_commands_without_a_result_time_out(hub, router, partners, trackers):
+    # The CPO holds the forward open past the deadline
+    partners.release.clear()
+    tracker = trackers(timeout=0.05, workers=2)
+    tracker.start()
+    command_id = await submit(tracker, router)
+
+    await until(lambda: tracker.delivered)
+    assert partners.results[0]["result"] == "TIMEOUT"
+    # A late acceptance does not bring the command back
+    partners.release.set()
+    await asyncio.sleep(0.05)
+    assert tracker.stats()["pending"] == 0
+    doc = await hub.db[COMMANDS_COLLECTION].find_one({"id": command_id})
+    assert (doc["status"], doc["result"]) == ("DELIVERED", "TIMEOUT")
+
+
+async def test_a_cpo_rejection_is_reported_as_the_result(router, partners, trackers):
+    partners.cpo_answer = {"result": "UNKNOWN_SESSION", "timeout": 30}
+    tracker = trackers()
+    tracker.start()
+    await submit(tracker, router)
+
+    await until(lambda: tracker.delivered)
+    assert partners.results == [{"result": "FAILED"}]
+
+
+async def test_only_the_first_result_recorded_across_workers_is_delivered(hub, router, partners, trackers):
+    accepting, other = trackers(), trackers()
+    command_id = await submit(accepting, router)
+
+    # The CPO's result lands on a worker that never saw the command
+    assert await other.receive_result(command_id, "cpo", {"result": "ACCEPTED"}) is True
+    other.start()
+    await until(lambda: other.delivered)
+
+    # The accepting worker times out or gets a late result; the claim fails and nothing is sent
+    assert await accepting.receive_result(command_id, "cpo", {"result": "FAILED"}) is True
+    accepting.start()
+    await asyncio.sleep(0.05)
+    assert partners.results == [{"result": "ACCEPTED"}]
+    assert accepting.delivered == 0
+
+
+async def test_after_a_restart_one_worker_redelivers_each_result(hub, router, partners, trackers):
+    now = datetime.now(timezone.utc)
+    base = {
+        "command": "START_SESSION", "body": BODY, "response_url": BODY["response_url"], "sender_id": "emsp",
+        "receiver_id": "cpo", "expires_at": now + timedelta(minutes=1), "result": "ACCEPTED",
+    }
+    await hub.db[COMMANDS_COLLECTION].insert_many([
+        {**base, "id": "pending", "status": "PENDING"},
+        {**base, "id": "completed", "status": "COMPLETED"},
+        {**base, "id": "abandoned", "status": "DELIVERING", "delivery_until": now - timedelta(minutes=1)},
+        {**base, "id": "in-flight", "status": "DELIVERING", "delivery_until": now + timedelta(minutes=1)},
+    ])
+
+    first, second = trackers(), trackers()
+    await first.load()
+    await second.load()
+    assert (first.stats()["pending"], first.stats()["queued_jobs"]) == (1, 2)
+    assert (second.stats()["pending"], second.stats()["queued_jobs"]) == (1, 0)
+
+    first.start()
+    await until(lambda: first.delivered == 2)
+    statuses = {doc["id"]: doc["status"] async for doc in hub.db[COMMANDS_COLLECTION].find({})}
+    assert statuses == {
+        "pending": "PENDING", "completed": "DELIVERED", "abandoned": "DELIVERED", "in-flight": "DELIVERING",
+    }
+
+
+async def test_new_commands_are_rejected_when_too_many_are_pending(router, trackers):
+    tracker = trackers(max_pending=1)
+    await submit(tracker, router)
+    response = await tracker.submit(
+        "START_SESSION", BODY, router.table.resolve("TR", "EMS"), router.table.resolve("TR", "CPO"), CALLBACK
+    )
+    assert response["result"] == "REJECTED"
@@ -0,0 +1,34 @@
+import pytest
+
+from dashboard import SingleFlightCache
+from tests.factories import location
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_location_writes_do_not_clear_the_statistics(client, register):
+    _, cpo = await register("CPO", "CPO")
+    assert (await client.get("/api/dashboard/stats")).json()["locations"] == 0
+
+    assert (await client.put("/api/ocpi/2.3.0/locations/TR/CPO/LOC1", headers=cpo, json=location())).status_code == 200
+    # Served from the cache until the TTL runs out
+    assert (await client.get("/api/dashboard/stats")).json()["locations"] == 0
+
+    # New organizations show up straight away
+    await register("EMSP", "EMS")
+    stats = (await client.get("/api/dashboard/stats")).json()
+    assert (stats["emsps"], stats["locations"]) == (1, 1)
+
+
+async def test_the_cache_evicts_the_least_recently_used_entries():
+    cache = SingleFlightCache(ttl=60, maxsize=2)
+    computed = []
+
+    async def compute(key):
+        computed.append(key)
+        return key
+
+    for key in ("a", "b", "a", "c", "a", "b"):
+        await cache.get(key, lambda: compute(key))
+    assert computed == ["a", "b", "c", "b"]
+    assert len(cache) == 2
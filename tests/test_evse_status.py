@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+import pytest
+
+import evse_status as evse_status_module
+from evse_status import EvseStatusStore
+from tests.factories import evse, location
+
+pytestmark = pytest.mark.anyio
+
+AVAILABILITY = "/api/ocpi/2.3.0/locations/availability"
+LOCATION_URL = "/api/ocpi/2.3.0/locations/TR/CPO/LOC1"
+
+
+def decoded(snapshot):
+    """(key, status) pairs of the snapshot slots from ``evses_from`` on."""
+    statuses = [snapshot["statuses"][int(code, 36)] for code in snapshot["status"]]
+    return [(tuple(key), statuses[snapshot["evses_from"] + i]) for i, key in enumerate(snapshot["evses"])]
+
+
+async def test_availability_waits_for_the_store_to_load(hub, client, register):
+    _, cpo = await register("CPO", "CPO")
+    await client.put(LOCATION_URL, headers=cpo, json=location(evses=[evse("E1"), evse("E2", "CHARGING")]))
+
+    response = await client.get(AVAILABILITY, headers=cpo)
+    assert response.status_code == 503 and response.headers["retry-after"] == "5"
+
+    await hub.evse_status.load()
+    snapshot = (await client.get(AVAILABILITY, headers=cpo)).json()["data"]
+    assert snapshot["count"] == 2
+    assert decoded(snapshot) == [(("TR", "CPO", "LOC1", "E1"), "AVAILABLE"), (("TR", "CPO", "LOC1", "E2"), "CHARGING")]
+
+
+async def test_clients_only_fetch_the_keys_they_do_not_have(hub, client, register):
+    _, cpo = await register("CPO", "CPO")
+    await hub.evse_status.load()
+    await client.put(LOCATION_URL, headers=cpo, json=location(evses=[evse("E1"), evse("E2")]))
+    await client.put(
+        "/api/ocpi/2.3.0/locations/TR/CPO/LOC2", headers=cpo, json=location("LOC2", evses=[evse("E3", "CHARGING")])
+    )
+
+    snapshot = (await client.get(f"{AVAILABILITY}?evses_from=2", headers=cpo)).json()["data"]
+    assert (snapshot["count"], snapshot["evses_from"], len(snapshot["status"])) == (3, 2, 3)
+    assert decoded(snapshot) == [(("TR", "CPO", "LOC2", "E3"), "CHARGING")]
+
+
+async def test_evses_a_location_write_no_longer_lists_are_removed(hub, client, register):
+    _, cpo = await register("CPO", "CPO")
+    await hub.evse_status.load()
+    await client.put(LOCATION_URL, headers=cpo, json=location(evses=[evse("E1"), evse("E2")]))
+
+    put = location(evses=[evse("E1")], last_updated="2024-02-01T00:00:00Z")
+    assert (await client.put(LOCATION_URL, headers=cpo, json=put)).status_code == 200
+    store = hub.evse_status
+    assert store.get(store.slot("TR", "CPO", "LOC1", "E2"))[0] == "REMOVED"
+    assert store.stats()["by_status"]["REMOVED"] == 1
+
+    # An EVSE update newer than the location write that dropped it wins
+    store.set("TR", "CPO", "LOC1", "E2", "AVAILABLE", "2024-03-01T00:00:00Z")
+    store.set_location({**put, "last_updated": "2024-02-15T00:00:00Z"})
+    assert store.get(store.slot("TR", "CPO", "LOC1", "E2"))[0] == "AVAILABLE"
+
+
+async def test_older_updates_are_ignored_and_only_changes_are_published(hub):
+    store = EvseStatusStore(hub.db)
+    changes = []
+    store.listener = lambda key, status, last_updated: changes.append((key[3], status))
+
+    store.set("TR", "CPO", "LOC1", "E1", "AVAILABLE", "2024-01-01T00:00:00Z")
+    store.set("TR", "CPO", "LOC1", "E1", "AVAILABLE", "2024-01-02T00:00:00Z")
+    store.set("TR", "CPO", "LOC1", "E1", "CHARGING", "2024-01-03T00:00:00Z")
+    store.set("TR", "CPO", "LOC1", "E1", "AVAILABLE", "2024-01-02T12:00:00Z")
+
+    assert changes == [("E1", "AVAILABLE"), ("E1", "CHARGING")]
+    assert store.get(0)[0] == "CHARGING"
+
+
+@pytest.mark.parametrize("evses_from", [0, 3, 4, 5, 9, 10, 11])
+async def test_snapshot_keys_are_the_same_across_block_boundaries(hub, monkeypatch, evses_from):
+    monkeypatch.setattr(evse_status_module, "KEY_BLOCK", 4)
+    store = EvseStatusStore(hub.db)
+    for i in range(10):
+        store.set("TR", "CPO", f"LOC{i // 3}", f"E{i}", "CHARGING" if i % 2 else "AVAILABLE", None)
+    # Encoded blocks are reused by later snapshots
+    store.snapshot()
+
+    snapshot = json.loads(store.snapshot(evses_from))
+    assert snapshot["evses_from"] == min(evses_from, 10)
+    assert [key[3] for key in snapshot["evses"]] == [f"E{i}" for i in range(evses_from, 10)]
+    assert snapshot["status"] == "".join("2" if i % 2 else "0" for i in range(10))
+
+
+async def test_reload_requests_during_a_reload_share_one_more_load(hub, monkeypatch):
+    store = EvseStatusStore(hub.db)
+    loads, release = [], asyncio.Event()
+
+    async def load():
+        loads.append(None)
+        await release.wait()
+    monkeypatch.setattr(store, "load", load)
+
+    store.reload()
+    await asyncio.sleep(0)
+    for _ in range(5):
+        store.reload()
+    release.set()
+    await store.reload_task
+    assert len(loads) == 2
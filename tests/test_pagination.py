@@ -0,0 +1,93 @@
+import pytest
+
+from tests.factories import location
+
+pytestmark = pytest.mark.anyio
+
+LOCATIONS = "/api/ocpi/2.3.0/locations"
+
+
+async def put_locations(client, headers, ids, last_updated="2024-01-01T00:00:00Z"):
+    for location_id in ids:
+        response = await client.put(
+            f"{LOCATIONS}/TR/CPO/{location_id}", headers=headers, json=location(location_id, last_updated=last_updated)
+        )
+        assert response.status_code == 200, response.text
+
+
+async def walk(client, headers, url):
+    pages = []
+    while url:
+        response = await client.get(url, headers=headers)
+        assert response.status_code == 200
+        pages.append([loc["id"] for loc in response.json()["data"]])
+        link = response.headers.get("link")
+        url = link[1:link.index(">")] if link else None
+    return pages
+
+
+async def test_link_header_walks_every_location_once_in_order(client, register):
+    _, cpo = await register("CPO", "CPO")
+    _, emsp = await register("EMSP", "EMS")
+    # Equal last_updated values: the _id breaks the tie
+    await put_locations(client, cpo, [f"L{i}" for i in range(7)])
+
+    response = await client.get(f"{LOCATIONS}?limit=3", headers=emsp)
+    assert response.headers["x-total-count"] == "7"
+    assert 'rel="next"' in response.headers["link"] and "cursor=" in response.headers["link"]
+
+    pages = await walk(client, emsp, f"{LOCATIONS}?limit=3")
+    assert pages == [["L0", "L1", "L2"], ["L3", "L4", "L5"], ["L6"]]
+
+
+async def test_cursor_pages_do_not_shift_when_documents_are_added(client, register):
+    _, cpo = await register("CPO", "CPO")
+    _, emsp = await register("EMSP", "EMS")
+    await put_locations(client, cpo, ["A", "B", "C", "D"])
+
+    first = await client.get(f"{LOCATIONS}?limit=2", headers=emsp)
+    link = first.headers["link"]
+    # Written after the first page was read; it sorts last
+    await put_locations(client, cpo, ["E"], last_updated="2024-02-01T00:00:00Z")
+
+    pages = await walk(client, emsp, link[1:link.index(">")])
+    assert [loc["id"] for loc in first.json()["data"]] == ["A", "B"]
+    assert pages == [["C", "D"], ["E"]]
+
+
+async def test_offset_requests_still_work_and_continue_with_a_cursor(client, register):
+    _, cpo = await register("CPO", "CPO")
+    _, emsp = await register("EMSP", "EMS")
+    await put_locations(client, cpo, [f"L{i}" for i in range(6)])
+
+    response = await client.get(f"{LOCATIONS}?offset=2&limit=2", headers=emsp)
+    assert [loc["id"] for loc in response.json()["data"]] == ["L2", "L3"]
+    link = response.headers["link"]
+    assert "offset=" not in link and "cursor=" in link
+
+    assert await walk(client, emsp, link[1:link.index(">")]) == [["L4", "L5"]]
+
+
+async def test_date_filters_apply_to_pages_and_total(client, register):
+    _, cpo = await register("CPO", "CPO")
+    _, emsp = await register("EMSP", "EMS")
+    await put_locations(client, cpo, ["OLD"], last_updated="2023-06-01T00:00:00Z")
+    await put_locations(client, cpo, ["NEW1", "NEW2"], last_updated="2024-06-01T00:00:00Z")
+
+    response = await client.get(f"{LOCATIONS}?date_from=2024-01-01T00:00:00Z", headers=emsp)
+    assert response.headers["x-total-count"] == "2"
+    assert [loc["id"] for loc in response.json()["data"]] == ["NEW1", "NEW2"]
+    assert "link" not in response.headers
+
+
+async def test_limit_is_capped_and_reported(hub, client, register):
+    _, emsp = await register("EMSP", "EMS")
+    response = await client.get(f"{LOCATIONS}?limit=1000000", headers=emsp)
+    assert response.status_code == 200
+    assert response.headers["x-limit"] == str(hub.MAX_PAGE_LIMIT)
+
+
+async def test_invalid_cursor_is_rejected(client, register):
+    _, emsp = await register("EMSP", "EMS")
+    response = await client.get(f"{LOCATIONS}?cursor=not-a-cursor", headers=emsp)
+    assert response.status_code == 400
@@ -0,0 +1,114 @@
+import pytest
+
+from tests.factories import evse, location
+
+pytestmark = pytest.mark.anyio
+
+LOCATION_URL = "/api/ocpi/2.3.0/locations/TR/CPO/LOC1"
+
+
+@pytest.fixture
+async def cpo(client, register):
+    _, headers = await register("CPO", "CPO")
+    response = await client.put(LOCATION_URL, headers=headers, json=location(evses=[evse("E1"), evse("E2")]))
+    assert response.status_code == 200
+    return headers
+
+
+async def stored_evses(hub):
+    doc = await hub.db.locations.find_one({"id": "LOC1"})
+    return {e["uid"]: e for e in doc["evses"]}
+
+
+@pytest.mark.parametrize("patch", [
+    {"capabilities": "RESERVABLE"},
+    {"floor_level": 3},
+    {"connectors": [{"id": "1"}]},
+    {"coordinates": {"latitude": "north"}},
+])
+async def test_patch_with_invalid_values_is_rejected(hub, client, cpo, patch):
+    before = await stored_evses(hub)
+    response = await client.patch(f"{LOCATION_URL}/E1", headers=cpo, json=patch)
+    assert response.status_code == 400
+    assert f"'{next(iter(patch))}'" in response.json()["detail"]
+    assert await stored_evses(hub) == before
+
+
+@pytest.mark.parametrize("patch", [{"colour": "red"}, {"uid": "E9"}])
+async def test_unknown_and_key_fields_cannot_be_patched(client, cpo, patch):
+    response = await client.patch(f"{LOCATION_URL}/E1", headers=cpo, json=patch)
+    assert response.status_code == 400
+
+
+async def test_patch_updates_only_the_targeted_evse(hub, client, cpo):
+    response = await client.patch(
+        f"{LOCATION_URL}/E1", headers=cpo, json={"physical_reference": "P-1", "last_updated": "2024-03-01T00:00:00Z"}
+    )
+    assert response.status_code == 200
+
+    evses = await stored_evses(hub)
+    assert evses["E1"]["physical_reference"] == "P-1"
+    assert [c["id"] for c in evses["E1"]["connectors"]] == ["1"]
+    assert evses["E2"].get("physical_reference") is None
+    doc = await hub.db.locations.find_one({"id": "LOC1"})
+    assert doc["last_updated"].isoformat().startswith("2024-03-01")
+
+
+async def test_status_only_patch_is_served_before_it_is_written(hub, client, cpo):
+    response = await client.patch(f"{LOCATION_URL}/E1", headers=cpo, json={"status": "CHARGING"})
+    assert response.status_code == 200
+    assert (await stored_evses(hub))["E1"]["status"] == "AVAILABLE"
+
+    read = await client.get(LOCATION_URL, headers=cpo)
+    assert [e["status"] for e in read.json()["data"]["evses"]] == ["CHARGING", "AVAILABLE"]
+
+    await hub.evse_status.flush()
+    assert (await stored_evses(hub))["E1"]["status"] == "CHARGING"
+
+
+async def test_location_patch_validates_nested_evses(client, cpo):
+    response = await client.patch(LOCATION_URL, headers=cpo, json={"evses": [{"uid": "E1"}]})
+    assert response.status_code == 400
+
+
+async def test_patching_missing_objects_is_not_found(client, cpo):
+    assert (await client.patch(f"{LOCATION_URL}/E9", headers=cpo, json={"floor_level": "1"})).status_code == 404
+    missing = "/api/ocpi/2.3.0/locations/TR/CPO/NOPE"
+    assert (await client.patch(missing, headers=cpo, json={"name": "x"})).status_code == 404
+
+
+async def test_only_the_owning_party_can_patch(client, register, cpo):
+    _, other = await register("CPO", "OTH")
+    response = await client.patch(f"{LOCATION_URL}/E1", headers=other, json={"status": "CHARGING"})
+    assert response.status_code == 403
+
+
+async def test_put_evse_adds_the_first_evse_to_a_location_without_evses(hub, client, register):
+    _, headers = await register("CPO", "CPO")
+    assert (await client.put(LOCATION_URL, headers=headers, json={**location(), "evses": None})).status_code == 200
+
+    response = await client.put(f"{LOCATION_URL}/E1", headers=headers, json=evse("E1"))
+    assert response.status_code == 200
+    assert list(await stored_evses(hub)) == ["E1"]
+
+
+async def test_status_only_patch_invalidates_cached_location_reads(client, cpo):
+    first = await client.get(LOCATION_URL, headers=cpo)
+    etag = first.headers["etag"]
+    assert (await client.get(LOCATION_URL, headers={**cpo, "If-None-Match": etag})).status_code == 304
+
+    response = await client.patch(f"{LOCATION_URL}/E1", headers=cpo, json={"status": "CHARGING"})
+    assert response.status_code == 200
+    read = await client.get(LOCATION_URL, headers={**cpo, "If-None-Match": etag})
+    assert read.status_code == 200
+    assert read.json()["data"]["evses"][0]["status"] == "CHARGING"
+
+
+async def test_search_serves_statuses_not_written_yet(hub, client, cpo, monkeypatch):
+    # mongomock has no geo operators; any search pipeline reads through the same overlay
+    monkeypatch.setattr(hub, "search_pipeline", lambda *args: [{"$match": {}}])
+    await client.patch(f"{LOCATION_URL}/E1", headers=cpo, json={"status": "CHARGING"})
+
+    response = await client.get("/api/ocpi/2.3.0/locations/search?bbox=28,40,30,42", headers=cpo)
+    assert response.status_code == 200
+    assert [e["status"] for e in response.json()["data"][0]["evses"]] == ["CHARGING", "AVAILABLE"]
@@ -0,0 +1,51 @@
+import httpx
+import pytest
+
+from push import DEAD_LETTERS_COLLECTION, PartnerChannel, PushEvent
+
+pytestmark = pytest.mark.anyio
+
+EVENT = PushEvent("locations", "PUT", "TR/CPO/LOC1", {"id": "LOC1"}, "TR", "CPO")
+
+
+@pytest.fixture
+async def channel(hub):
+    """A channel to an eMSP answering with the responses in ``channel.answers``, one per request."""
+    channel = PartnerChannel(
+        hub.db, {"id": "emsp", "role": "EMSP", "country_code": "TR", "party_id": "EMS"},
+        "http://emsp.test/ocpi", "token", max_attempts=3, base_delay=0
+    )
+    channel.answers = []
+    await channel.client.aclose()
+    channel.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: channel.answers.pop(0)))
+    yield channel
+    await channel.close()
+
+
+async def test_an_ocpi_error_in_a_200_response_is_retried(channel):
+    channel.answers = [
+        httpx.Response(200, json={"status_code": 3000, "status_message": "Generic server error"}),
+        httpx.Response(200, json={"status_code": 1000}),
+    ]
+    await channel.deliver(EVENT)
+    assert (channel.sent, channel.retries, channel.dead_lettered) == (1, 1, 0)
+
+
+async def test_an_ocpi_error_that_persists_is_dead_lettered(hub, channel):
+    channel.answers = [httpx.Response(200, json={"status_code": 2003, "status_message": "Unknown location"})] * 3
+    await channel.deliver(EVENT)
+    assert (channel.sent, channel.dead_lettered) == (0, 1)
+    letter = await hub.db[DEAD_LETTERS_COLLECTION].find_one({"organization_id": "emsp"})
+    assert letter["attempts"] == 3 and "2003" in letter["error"]
+
+
+async def test_a_success_without_an_ocpi_body_is_delivered(channel):
+    channel.answers = [httpx.Response(204)]
+    await channel.deliver(EVENT)
+    assert channel.sent == 1
+
+
+async def test_http_client_errors_are_not_retried(channel):
+    channel.answers = [httpx.Response(400, json={"status_code": 2001})]
+    await channel.deliver(EVENT)
+    assert (channel.retries, channel.dead_lettered) == (0, 1)
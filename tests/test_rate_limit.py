@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from rate_limit import MemoryBucketStore, RateLimit, RateLimiter, parse_limits
+from tests.factories import location
+
+pytestmark = pytest.mark.anyio
+
+LOCATIONS = "/api/ocpi/2.3.0/locations"
+
+
+@pytest.fixture
+def limits(hub, monkeypatch):
+    """Replace the hub's limiter with one configured by ``spec``."""
+    def install(spec: str) -> RateLimiter:
+        limiter = RateLimiter(MemoryBucketStore(), parse_limits(spec))
+        monkeypatch.setattr(hub, "rate_limiter", limiter)
+        return limiter
+    return install
+
+
+async def test_an_empty_bucket_answers_429_with_retry_after(client, register, limits):
+    limiter = limits("default=0.1/2")
+    _, emsp = await register("EMSP", "EMS")
+
+    assert [(await client.get(LOCATIONS, headers=emsp)).status_code for _ in range(2)] == [200, 200]
+    response = await client.get(LOCATIONS, headers=emsp)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "10"
+    assert response.json()["status_code"] == 2000
+    assert limiter.stats()["top_throttled"] == [{"party": "TR*EMS", "module": "locations.read", "requests": 1}]
+
+
+async def test_buckets_are_separate_per_organization_module_and_kind(client, register, limits):
+    limits("default=0.1/1")
+    _, cpo = await register("CPO", "CPO")
+    _, other = await register("CPO", "OTH")
+
+    assert (await client.get(LOCATIONS, headers=cpo)).status_code == 200
+    assert (await client.get(LOCATIONS, headers=cpo)).status_code == 429
+    # Another module, a write, and another organization each have a full bucket
+    assert (await client.get("/api/ocpi/2.3.0/tariffs", headers=cpo)).status_code == 200
+    put = await client.put(f"{LOCATIONS}/TR/CPO/LOC1", headers=cpo, json=location())
+    assert put.status_code == 200
+    assert (await client.get(LOCATIONS, headers=other)).status_code == 200
+
+
+async def test_the_bucket_refills_over_time(client, register, limits):
+    limits("default=20/1")
+    _, emsp = await register("EMSP", "EMS")
+
+    assert (await client.get(LOCATIONS, headers=emsp)).status_code == 200
+    response = await client.get(LOCATIONS, headers=emsp)
+    assert response.status_code == 429
+    # Never less than a second, even when the next token is closer
+    assert response.headers["retry-after"] == "1"
+
+    await asyncio.sleep(0.06)
+    assert (await client.get(LOCATIONS, headers=emsp)).status_code == 200
+
+
+async def test_a_failing_store_allows_the_request(client, register, limits):
+    limiter = limits("default=0.1/1")
+
+    async def take(key, limit):
+        raise ConnectionError("store unavailable")
+    limiter.store.take = take
+    _, emsp = await register("EMSP", "EMS")
+
+    assert [(await client.get(LOCATIONS, headers=emsp)).status_code for _ in range(3)] == [200, 200, 200]
+    assert limiter.stats()["store_errors"] == 3
+
+
+def test_the_most_specific_limit_wins():
+    limiter = RateLimiter(MemoryBucketStore(), parse_limits("default=1/2, sessions=3/6, sessions.write=5/10"))
+    assert limiter.limit_for("sessions", "write") == RateLimit(5, 10)
+    assert limiter.limit_for("sessions", "read") == RateLimit(3, 6)
+    assert limiter.limit_for("tokens", "read") == RateLimit(1, 2)
+    assert RateLimiter(MemoryBucketStore(), parse_limits("tokens=1/1")).limit_for("cdrs", "read") is None
+
+
+def test_invalid_limits_are_rejected():
+    with pytest.raises(ValueError, match="sessions=fast"):
+        parse_limits("default=1/2,sessions=fast")
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from session_updates import BUCKET_SIZE, PERIODS_COLLECTION, SessionUpdateCoalescer, load_periods
+from tests.factories import period, session
+
+pytestmark = pytest.mark.anyio
+
+KEY = "TR*CPO*S1"
+NOW = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def periods(start: int, count: int):
+    return [period((NOW + timedelta(minutes=i)).isoformat()) for i in range(start, start + count)]
+
+
+@pytest.fixture
+async def coalescer(hub):
+    await hub.db.sessions.insert_one({"country_code": "TR", "party_id": "CPO", "id": "S1", "kwh": 0})
+    return SessionUpdateCoalescer(hub.db, interval=3600)
+
+
+@pytest.fixture
+def bulk_write(hub, monkeypatch):
+    """Route bulk_write through ``wrapper(collection, operations, write)``; ``write()`` runs the real one."""
+    collection_type = type(hub.db.sessions)
+    real = collection_type.bulk_write
+
+    def patch(wrapper):
+        async def bulk_write(self, operations, ordered=True):
+            return await wrapper(self, operations, lambda: real(self, operations, ordered=ordered))
+        monkeypatch.setattr(collection_type, "bulk_write", bulk_write)
+    return patch
+
+
+async def test_updates_to_a_session_are_merged_into_one_write(hub, coalescer):
+    for kwh in (1.0, 2.5, 4.0):
+        coalescer.add(KEY, {"kwh": kwh, "last_updated": NOW + timedelta(seconds=kwh)}, periods(int(kwh), 1))
+    await coalescer.flush()
+
+    doc = await hub.db.sessions.find_one({"id": "S1"})
+    assert doc["kwh"] == 4.0
+    assert len((await load_periods(hub.db, [KEY]))[KEY]) == 3
+    # One session update and one period append
+    assert coalescer.stats()["flushed_writes"] == 2
+
+
+async def test_out_of_order_updates_keep_the_newest_last_updated(hub, coalescer):
+    coalescer.add(KEY, {"kwh": 2.0, "last_updated": NOW + timedelta(minutes=5)})
+    coalescer.add(KEY, {"kwh": 1.0, "last_updated": NOW})
+    await coalescer.flush()
+
+    doc = await hub.db.sessions.find_one({"id": "S1"})
+    assert doc["last_updated"] == (NOW + timedelta(minutes=5)).replace(tzinfo=None)
+
+
+async def test_periods_are_stored_in_bounded_buckets(hub, coalescer):
+    coalescer.add(KEY, {"last_updated": NOW}, periods(0, 60))
+    await coalescer.flush()
+    coalescer.add(KEY, {"last_updated": NOW}, periods(60, 90))
+    await coalescer.flush()
+
+    counts = [bucket["count"] async for bucket in hub.db[PERIODS_COLLECTION].find({"session_key": KEY})]
+    assert sum(counts) == 150 and max(counts) <= BUCKET_SIZE
+    stored = (await load_periods(hub.db, [KEY]))[KEY]
+    assert [p["start_date_time"] for p in stored] == [p["start_date_time"] for p in periods(0, 150)]
+
+
+async def test_failed_operations_are_retried_on_the_next_flush(hub, coalescer, bulk_write):
+    async def sessions_fail(collection, operations, write):
+        if collection.name == "sessions":
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 1, "errmsg": "failed"}], "nInserted": 0})
+        return await write()
+    bulk_write(sessions_fail)
+    coalescer.add(KEY, {"kwh": 5.0, "last_updated": NOW}, periods(0, 1))
+    with pytest.raises(RuntimeError):
+        await coalescer.flush()
+    assert coalescer.stats()["pending_sessions"] == 1
+
+    bulk_write(lambda collection, operations, write: write())
+    await coalescer.flush()
+    assert (await hub.db.sessions.find_one({"id": "S1"}))["kwh"] == 5.0
+    # The append succeeded the first time and is not repeated
+    assert len((await load_periods(hub.db, [KEY]))[KEY]) == 1
+
+
+async def test_appends_with_an_unknown_outcome_are_not_duplicated(hub, coalescer, bulk_write):
+    async def written_then_lost(collection, operations, write):
+        result = await write()
+        if collection.name == PERIODS_COLLECTION:
+            raise ConnectionError("connection lost after the write")
+        return result
+    bulk_write(written_then_lost)
+    coalescer.add(KEY, {"kwh": 1.0, "last_updated": NOW}, periods(0, 3))
+    with pytest.raises(RuntimeError):
+        await coalescer.flush()
+
+    bulk_write(lambda collection, operations, write: write())
+    coalescer.add(KEY, {"kwh": 2.0, "last_updated": NOW}, periods(3, 1))
+    await coalescer.flush()
+    stored = (await load_periods(hub.db, [KEY]))[KEY]
+    assert [p["start_date_time"] for p in stored] == [p["start_date_time"] for p in periods(0, 4)]
+
+
+async def test_a_put_waits_for_a_flush_writing_the_same_session(hub, coalescer, bulk_write):
+    async def slow(collection, operations, write):
+        await asyncio.sleep(0.05)
+        return await write()
+    bulk_write(slow)
+    coalescer.add(KEY, {"kwh": 6.0, "last_updated": NOW})
+    flush = asyncio.create_task(coalescer.flush())
+    await asyncio.sleep(0.01)
+
+    await coalescer.discard(KEY)
+    assert flush.done()
+    await hub.db.sessions.update_one({"id": "S1"}, {"$set": {"kwh": 100.0}})
+    await coalescer.flush()
+    assert (await hub.db.sessions.find_one({"id": "S1"}))["kwh"] == 100.0
+
+
+async def test_session_patches_are_coalesced_until_the_flush(hub, client, register):
+    _, cpo = await register("CPO", "CPO")
+    url = "/api/ocpi/2.3.0/sessions/TR/CPO/S1"
+    assert (await client.put(url, headers=cpo, json=session())).status_code == 200
+
+    for minute in range(3):
+        patch = {"kwh": minute + 1.0, "charging_periods": [period(f"2024-01-01T10:0{minute}:00Z")]}
+        assert (await client.patch(url, headers=cpo, json=patch)).status_code == 200
+    assert (await hub.db.sessions.find_one({"id": "S1"}))["kwh"] == 0.0
+
+    await hub.session_coalescer.flush()
+    data = (await client.get(url, headers=cpo)).json()["data"]
+    assert data["kwh"] == 3.0
+    assert len(data["charging_periods"]) == 3
+
+
+async def test_patching_an_unknown_session_is_not_found(client, register):
+    _, cpo = await register("CPO", "CPO")
+    response = await client.patch("/api/ocpi/2.3.0/sessions/TR/CPO/NOPE", headers=cpo, json={"kwh": 1})
+    assert response.status_code == 404